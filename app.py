@@ -2,13 +2,21 @@
 Application code for a tier list maker, using MySQL with Python for the
 tier list database.
 """
+import time
+# Taken before the other imports so that --measure-startup includes them
+STARTUP_TIME = time.perf_counter()
 import sys  # to print error messages to sys.stderr
-import mysql.connector
-# To get error codes from the connector, useful for user-friendly
-# error-handling
-import mysql.connector.errorcode as errorcode
+import importlib
+import threading
+import argparse
+import csv
+import io
+import itertools
+import json
 from enum import Enum
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 
 # Name: Madeline Shao
 # Email: mshao@caltech.edu
@@ -36,8 +44,80 @@ class Colors(Enum):
     WARNING = '\u001b[33m' # light yellow
     BOLD = '\u001b[1m'
 
-# connection global variable
-conn = None
+class LazyModule:
+    '''
+    Stands in for a module until one of its attributes is first used, then
+    imports it (import_name, if given, is what is imported, e.g. a submodule
+    that the module's attributes need).
+    '''
+    def __init__(self, name, import_name=None):
+        self._name = name
+        self._import_name = import_name or name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            importlib.import_module(self._import_name)
+            self._module = sys.modules[self._name]
+        return getattr(self._module, attr)
+
+class LazyConnection:
+    '''
+    Stands in for the connection until it is first used, then connects with
+    get_conn(), which replaces conn with the real connection.
+    '''
+    def __getattr__(self, attr):
+        return getattr(get_conn(), attr)
+
+# The MySQL driver is slow to import, so it is imported on first use
+# instead of before the menu is shown.
+mysql = LazyModule('mysql', 'mysql.connector')
+# To get error codes from the connector, useful for user-friendly
+# error-handling
+errorcode = LazyModule('mysql.connector.errorcode')
+
+# connection global variable, connected on first use
+conn = LazyConnection()
+
+# Output settings for the list views (set from the command line).
+# OUTPUT_FORMAT is one of OUTPUT_FORMATS. PAGE_SIZE is the number of rows
+# shown before asking to continue, or 0 to show everything at once.
+OUTPUT_FORMATS = ('table', 'csv', 'tsv', 'json')
+OUTPUT_FORMAT = 'table'
+PAGE_SIZE = 0
+# Rows fetched from the server per round trip when streaming a result
+FETCH_SIZE = 1000
+# Number of characters of output buffered before writing to the terminal
+WRITE_BUFFER_SIZE = 64 * 1024
+# Tierlists shown per page when looking up the tierlists that ranked a game
+LOOKUP_PAGE_SIZE = 20
+# Similar tierlists shown under a viewed tierlist
+SIMILAR_TIERLISTS_SHOWN = 5
+# Consensus tierlist methods and their tier column in mv_game_consensus
+CONSENSUS_METHODS = {'mean': 'mean_tier_id', 'median': 'median_tier_id',
+                     'weighted': 'weighted_tier_id'}
+# Groupings of the stats dashboard (group_type in mv_group_rank_dist)
+STATS_GROUP_TYPES = ('platform', 'publisher', 'developer', 'year')
+# Rendered tierlists kept in memory (0 to disable the cache)
+TIERLIST_CACHE_SIZE = 256
+
+# LRU cache of rendered tierlists, keyed by (username, tierlist_name,
+# tierlist version, tier version), most recently used last
+tierlist_cache = OrderedDict()
+tierlist_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+# Print how long startup takes and exit (set from the command line)
+MEASURE_STARTUP = False
+# Reference data being prefetched in the background: name -> Future
+warmup = {}
+# Seconds after startup that each prefetch finished, for --measure-startup
+warmup_times = {}
+_warmup_executor = None
+_warmup_local = threading.local()
+# Queries run at the same time when entering the edit menu, each on a
+# pooled connection of its own
+PREFETCH_WORKERS = 3
+_prefetch_executor = None
 
 # ----------------------------------------------------------------------
 # Print Utility Functions
@@ -67,13 +147,124 @@ def print_warning(msg):
     '''
     print(f"{Colors.WARNING.value}{msg}{Colors.END.value}")
 
+# ----------------------------------------------------------------------
+# Output Rendering Functions
+# ----------------------------------------------------------------------
+# The list views share one pipeline: stream_rows() reads the result from an
+# unbuffered cursor, render_rows() formats each row as it arrives and writes
+# the output through one buffer that is flushed in large chunks, so memory
+# use doesn't depend on the number of rows.
+
+def stream_rows(sql, params=None):
+    '''
+    Executes the query on an unbuffered cursor and yields the result rows,
+    fetching FETCH_SIZE rows from the server at a time. If the consumer
+    stops early, the rest of the result is discarded so the connection can
+    be used again.
+    '''
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        if conn.unread_result:
+            conn.consume_results()
+        cursor.close()
+
+def flush_output(out):
+    '''
+    Writes the buffered output to the terminal and empties the buffer.
+    '''
+    sys.stdout.write(out.getvalue())
+    sys.stdout.flush()
+    out.seek(0)
+    out.truncate()
+
+def continue_paging():
+    '''
+    Asks the user whether to show the next page. Returns False to stop.
+    '''
+    ans = input('-- Press enter for more results, or q to stop -- ')
+    return not (ans and ans[0].lower() == 'q')
+
+def render_rows(rows, columns, title=None,
+                empty_msg='No results found.'):
+    '''
+    Renders the rows in OUTPUT_FORMAT and returns the number of rows shown.
+    columns is a list of (header, width) tuples; width is the padding of the
+    column in a table (None for no padding). The title is only shown in
+    table format. If there are no rows, prints empty_msg instead.
+    In table format with a PAGE_SIZE, asks to continue after every page.
+    '''
+    rows = iter(rows)
+    count = 0
+    try:
+        first = next(rows, None)
+        if first is None:
+            print_warning(empty_msg)
+            return 0
+        headers = [header for header, _ in columns]
+        out = io.StringIO()
+        writer = None
+        if OUTPUT_FORMAT == 'table':
+            if title:
+                out.write(title + '\n')
+            header = ' | '.join(h.ljust(w) if w else h for h, w in columns)
+            out.write(f'{Colors.BOLD.value}{header}{Colors.END.value}\n')
+            out.write(f'{Colors.BOLD.value}{"-" * len(header)}'
+                      f'{Colors.END.value}\n')
+        elif OUTPUT_FORMAT in ('csv', 'tsv'):
+            delimiter = ',' if OUTPUT_FORMAT == 'csv' else '\t'
+            writer = csv.writer(out, delimiter=delimiter, lineterminator='\n')
+            writer.writerow(headers)
+
+        for row in itertools.chain((first,), rows):
+            if OUTPUT_FORMAT == 'table':
+                out.write(' | '.join(str(value).ljust(w) if w else str(value)
+                                     for value, (_, w) in zip(row, columns)))
+                out.write('\n')
+            elif writer:
+                writer.writerow(row)
+            else:
+                out.write(json.dumps(dict(zip(headers, row)), default=str))
+                out.write('\n')
+            count += 1
+            if out.tell() >= WRITE_BUFFER_SIZE:
+                flush_output(out)
+            if PAGE_SIZE and OUTPUT_FORMAT == 'table' and \
+                    count % PAGE_SIZE == 0:
+                flush_output(out)
+                if not continue_paging():
+                    break
+        flush_output(out)
+    finally:
+        # stop the query if the rows are still streaming from the server
+        close = getattr(rows, 'close', None)
+        if close:
+            close()
+    return count
+
 # ----------------------------------------------------------------------
 # SQL Utility Functions
 # ----------------------------------------------------------------------
-def get_conn(admin=False):
+def get_conn(admin=False, **kwargs):
+    """"
+    Connects the global conn and returns it, if connection is successful.
+    If unsuccessful, exits. Any extra keyword arguments (e.g.
+    allow_local_infile=True for bulk loads) are passed on to the connector.
+    """
+    global conn
+    conn = open_conn(admin, **kwargs)
+    return conn
+
+def open_conn(admin=False, **kwargs):
     """"
-    Returns a connected MySQL connector instance, if connection is successful.
-    If unsuccessful, exits.
+    Returns a new connected MySQL connector instance, if connection is
+    successful. If unsuccessful, exits.
     """
     try:
         user = 'appclient'
@@ -81,17 +272,17 @@ def get_conn(admin=False):
         if admin:
             user = 'appadmin'
             pw = 'admins'
-        global conn
-        conn = mysql.connector.connect(
+        new_conn = mysql.connector.connect(
           host='localhost',
           user='appadmin',
           # Find port in MAMP or MySQL Workbench GUI or with
           # SHOW VARIABLES WHERE variable_name LIKE 'port';
           port='3306',
           password='admins',
-          database='tierlistdb'
+          database='tierlistdb',
+          **kwargs
         )
-        return conn
+        return new_conn
     except mysql.connector.Error as err:
         # Remember that this is specific to _database_ users, not
         # application users. So is probably irrelevant to a client in your
@@ -107,9 +298,222 @@ def get_conn(admin=False):
             sys.stderr('An error occurred, please contact the administrator.')
         sys.exit(1)
 
+# ----------------------------------------------------------------------
+# Background Warmup
+# ----------------------------------------------------------------------
+# Reference data the user is likely to need (the tiers, the game catalog
+# and, after login, the user's tierlists) is fetched by a background thread
+# with its own connection while the user reads the menu. It is only used
+# when it is known to be current, or to answer yes to a lookup; anything
+# else still goes to the database.
+def warmup_conn():
+    '''
+    Returns the warmup thread's own connection, connecting on first use.
+    '''
+    if getattr(_warmup_local, 'conn', None) is None:
+        _warmup_local.conn = open_conn()
+    return _warmup_local.conn
+
+def start_warmup(name, fetch, *args):
+    '''
+    Starts prefetching reference data in the background. fetch(cursor, *args)
+    runs on the warmup thread and its result is stored under name.
+    '''
+    global _warmup_executor
+    if _warmup_executor is None:
+        _warmup_executor = ThreadPoolExecutor(max_workers=1,
+                                              thread_name_prefix='warmup')
+
+    def run():
+        warm_conn = warmup_conn()
+        result = fetch(warm_conn.cursor(), *args)
+        # end the read so that the next prefetch sees current data
+        warm_conn.commit()
+        warmup_times[name] = time.perf_counter() - STARTUP_TIME
+        return result
+
+    warmup[name] = _warmup_executor.submit(run)
+
+def warmed(name, wait=True):
+    '''
+    Returns the reference data prefetched under name, waiting for it if it
+    is still being fetched (unless wait is False), or None if it wasn't
+    prefetched, isn't ready or the fetch failed.
+    '''
+    future = warmup.get(name)
+    if future is None or (not wait and not future.done()) or \
+            future.exception() is not None:
+        return None
+    return future.result()
+
+# The tiers sorted by rank, each with the tier version, read in one
+# statement so that the version is the version of those tiers
+TIERS_SQL = "SELECT tier.*, current_version('tier') FROM tier ORDER BY tier_rank;"
+
+# The game tiers (game_id, tier_id) of one tierlist, from game_tier or, if
+# the tierlist is archived, from its row of tierlist_archive. Both are read
+# in one statement, so the archive job can't move the tierlist in between.
+# Takes the username and tierlist name twice.
+TIERLIST_GAMES_SQL = '''(SELECT game_id, tier_id FROM game_tier
+                         WHERE username = %s AND tierlist_name = %s
+                         UNION ALL
+                         SELECT game_id, tier_id FROM archived_game_tiers
+                         WHERE username = %s AND tierlist_name = %s)'''
+
+def split_tiers(rows):
+    '''
+    Splits the rows of TIERS_SQL into the tier version and the tiers.
+    '''
+    if not rows:
+        return None, []
+    return rows[0][-1], [row[:-1] for row in rows]
+
+def fetch_tiers(cursor):
+    '''
+    Returns the tier version and the tiers sorted by rank.
+    '''
+    cursor.execute(TIERS_SQL)
+    return split_tiers(cursor.fetchall())
+
+def fetch_catalog(cursor):
+    '''
+    Returns a dict of the game names by game id.
+    '''
+    cursor.execute('SELECT game_id, game_name FROM video_game;')
+    return dict(cursor.fetchall())
+
+def fetch_user_tierlists(cursor, username):
+    '''
+    Returns the set of the names of the user's tierlists.
+    '''
+    cursor.execute('SELECT tierlist_name FROM tierlist WHERE username = %s;',
+                   (username,))
+    return {row[0] for row in cursor.fetchall()}
+
+def report_startup():
+    '''
+    For --measure-startup: prints how long it took to show the menu and to
+    prefetch each piece of reference data, then exits.
+    '''
+    menu_time = time.perf_counter() - STARTUP_TIME
+    print()
+    print_bold(f'Menu shown after {menu_time * 1000:.1f} ms')
+    for name in warmup:
+        if warmed(name) is None:
+            print_err(f'  {name} could not be prefetched')
+        else:
+            print(f'  {name} prefetched after '
+                  f'{warmup_times[name] * 1000:.1f} ms')
+    sys.exit(0)
+
+# ----------------------------------------------------------------------
+# Edit Menu Prefetch
+# ----------------------------------------------------------------------
+# Entering the edit menu needs the tierlist's games, the tiers and the game
+# catalog. They are queried at the same time, each on a pooled connection
+# of its own, so the menu waits for one round trip instead of one per
+# query. The first render and the checks of the ids the user enters are
+# then answered from them.
+PREFETCH_POOL = {'pool_name': 'prefetch', 'pool_size': PREFETCH_WORKERS,
+                 # each query sees the latest commits without a COMMIT, and
+                 # read-only sessions need no reset when returned to the pool
+                 'autocommit': True, 'pool_reset_session': False}
+
+def prefetch_executor():
+    '''
+    Returns the threads that run the prefetch queries, starting them on
+    first use. There are as many as pooled connections, so a query never
+    waits for a connection.
+    '''
+    global _prefetch_executor
+    if _prefetch_executor is None:
+        _prefetch_executor = ThreadPoolExecutor(
+            max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch')
+    return _prefetch_executor
+
+def prefetch_rows(sql, params=()):
+    '''
+    Runs a query on a pooled connection and returns all its rows.
+    '''
+    pooled = open_conn(**PREFETCH_POOL)
+    try:
+        cursor = pooled.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        # returns the connection to the pool
+        pooled.close()
+
+def start_prefetch_pool():
+    '''
+    Opens the pooled connections in the background, so that entering the
+    edit menu doesn't wait for them to connect.
+    '''
+    prefetch_executor().submit(lambda: open_conn(**PREFETCH_POOL).close())
+
+def prefetch_editor(username, tierlist_name):
+    '''
+    Fetches everything the edit menu of the given tierlist needs at the same
+    time: the tierlist's version and games, the tiers and, unless it was
+    already prefetched, the game catalog. Returns None if the user doesn't
+    own a tierlist of that name. Otherwise returns a dict with the rendered
+    tierlist ('lines'), the tier of each game in it ('games': game_id ->
+    tier_id), the tier ids ('tier_ids') and the game names by id
+    ('catalog'). The rendered tierlist is also put in the tierlist cache.
+    '''
+    queries = {
+        # one statement, so that the version is the version of these
+        # games. A tierlist without games is one row of NULL games. The
+        # game_tier condition names the user, so only the user's partition
+        # is read.
+        'tierlist': (f'''SELECT t.version, g.game_id, v.game_name, g.tier_id,
+                                r.tier_rank
+                         FROM tierlist t
+                             LEFT JOIN {TIERLIST_GAMES_SQL} AS g ON TRUE
+                             LEFT JOIN video_game v ON v.game_id = g.game_id
+                             LEFT JOIN tier r ON r.tier_id = g.tier_id
+                         WHERE t.username = %s AND t.tierlist_name = %s
+                         ORDER BY r.tier_rank;''',
+                     (username, tierlist_name) * 3),
+        'tiers': (TIERS_SQL, ()),
+    }
+    catalog = warmed('catalog', wait=False)
+    if catalog is None:
+        queries['catalog'] = ('SELECT game_id, game_name FROM video_game;', ())
+    futures = {name: prefetch_executor().submit(prefetch_rows, *query)
+               for name, query in queries.items()}
+    results = {name: future.result() for name, future in futures.items()}
+
+    rows = results['tierlist']
+    if not rows:
+        return None
+    tier_version, tiers = split_tiers(results['tiers'])
+    games = [row for row in rows if row[1] is not None]
+    lines = format_tierlist([(row[2], row[4]) for row in games],
+                            sorted_tiers=tiers) if games else []
+    cache_tierlist((username, tierlist_name, rows[0][0], tier_version), lines)
+    if catalog is None:
+        catalog = dict(results['catalog'])
+    return {'lines': lines,
+            'games': {row[1]: row[3] for row in games},
+            'tier_ids': {tier[0] for tier in tiers},
+            'catalog': catalog}
+
 # ----------------------------------------------------------------------
 # Functions for Command-Line Options/Query Execution
 # ----------------------------------------------------------------------
+def game_exists(game_id):
+    '''
+    Returns whether a game with the given id exists. Games are only
+    deleted by merges, which drop them from the prefetched catalog, so it
+    answers for the games in it; a game merged away by another admin is
+    caught by sp_update_game_tier.
+    '''
+    catalog = warmed('catalog')
+    if catalog is not None and game_id in catalog:
+        return True
+    return entry_exists('video_game', 'game_id', game_id)
+
 def entry_exists(table, column1, value1, column2=None, value2=None,
                 column3=None, value3=None):
     '''
@@ -159,6 +563,23 @@ def entry_exists(table, column1, value1, column2=None, value2=None,
         else:
             sys.stderr('An error occurred when querying the database.')
 
+def tierlist_has_game(username, tierlist_name, game_id):
+    '''
+    Returns whether the tierlist has ranked the game, whether the tierlist
+    is archived or not. If the connection encounters an error, returns None.
+    '''
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT 1 FROM {TIERLIST_GAMES_SQL} AS g '
+                       'WHERE game_id = %s LIMIT 1;',
+                       (username, tierlist_name) * 2 + (game_id,))
+        return bool(cursor.fetchall())
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print(err)
+        else:
+            print_err('An error occurred when querying the database.')
+
 def username_tierlist_exists(username, tierlist_name):
     sql = 'SELECT user_owns_tierlist(\'%s\', \'%s\')' % (username,
                                                          tierlist_name)
@@ -233,16 +654,22 @@ def show_games():
     game_sort = "ORDER BY %s %s" % (sort_col, sort_dir)
 
     sql = """
-              SELECT *
+              SELECT game_id, game_name, developer, publisher, release_date,
+                  sales, platform
               FROM video_game
               %s
               %s LIMIT 30;
               """ % (game_filter, game_sort)
                 # escape parameters for secure execution
+    if game_filter != "":
+        title = f'Top 30 Nintendo games where {filter_col} = \'{filter_val}\', sorted by {sort_col} {sort_dir}:'
+    else:
+        title = f'Top 30 Nintendo games in database, sorted by {sort_col} {sort_dir}'
+    columns = [('ID', 3), ('game name', 40), ('developer', 20),
+               ('publisher', 13), ('release_date', 12), ('sales', 8),
+               ('platform', None)]
     try:
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        rows = cursor.fetchall()
+        render_rows(stream_rows(sql), columns, title)
     except mysql.connector.Error as err:
         if DEBUG:
             sys.stderr(err)
@@ -251,21 +678,6 @@ def show_games():
             sys.stderr('An error occurred when searching for video games.')
             return
 
-    if not rows:
-        print_warning('No results found.')
-    else:
-        if game_filter != "":
-            print(f'Top 30 Nintendo games where {filter_col} = \'{filter_val}\', sorted by {sort_col} {sort_dir}:')
-        else:
-            print(f'Top 30 Nintendo games in database, sorted by {sort_col} {sort_dir}')
-        # 40
-        print_bold('ID  | game name                                | developer            | publisher     | release_date | sales    | platform')
-        print_bold('--------------------------------------------------------------------------------------------------------------------------')
-        for row in rows:
-            (game_id, name, developer, publisher,
-             release_date, sales, platform) = row
-            print(f'{str(game_id).ljust(3)} | {name.ljust(40)} | {developer.ljust(20)} | {publisher.ljust(13)} | {str(release_date).ljust(12)} | {str(sales).ljust(8)} | {platform}')
-
 def get_color_code(color):
     '''
     Given an input string, gets the color code for that color. If the input
@@ -277,11 +689,17 @@ def get_color_code(color):
         color_code = Colors[color.upper()].value
     return color_code
 
-def get_sorted_tiers():
+def get_sorted_tiers(tier_version=None):
     '''
     Returns all the rows from the table tier, sorted by tier_rank ascending.
+    If the current tier version is given and the prefetched tiers are of
+    that version, they are returned without a query.
     '''
     global conn
+    if tier_version is not None:
+        tiers = warmed('tiers')
+        if tiers is not None and tiers[0] == tier_version:
+            return tiers[1]
     try:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM tier ORDER BY tier_rank;')
@@ -311,47 +729,204 @@ def show_tiers():
         else:
             sys.stderr('An error occurred when fetching the tiers.')
 
+def like_prefix(prefix):
+    '''
+    Returns a LIKE pattern matching strings that start with prefix.
+    '''
+    for c in ('\\', '%', '_'):
+        prefix = prefix.replace(c, '\\' + c)
+    return prefix + '%'
+
+def input_date(prompt):
+    '''
+    Prompts for a date in YYYY-MM-DD format. Returns the date string, None
+    if nothing was entered, or False if the input was not a valid date.
+    '''
+    value = input(prompt)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        print_err(f'Invalid date \'{value}\': dates should be YYYY-MM-DD')
+        return False
+
 def show_tierlists():
     '''
-    Shows all the tierlists and their owners in the database. Displays
-    the username and the tierlist name, sorted by username ascending.
+    Prompts the user to filter the tierlists by the start of the owner's
+    username and a range of creation dates, and to sort them by owner
+    (default), creation date or size. Shows the owner, creation date,
+    number of games, top tier and name of each tierlist.
+    If a date or the sort column or direction is invalid, prints an error
+    message and returns.
+    The sizes come from mv_tierlist_stats, and each sort is served by an
+    index on it, so tierlists are streamed without counting or sorting.
     '''
     global conn
-    try:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM tierlist ORDER BY username;')
-        rows = cursor.fetchall()
-        if not rows:
-            print_warning('No results found.')
+    conditions = []
+    params = []
+    ans = input('Do you want to filter the tierlists? ')
+    if ans and ans.lower()[0] == 'y':
+        owner = input('Enter the start of the owner\'s username (press enter for any owner): ')
+        if owner:
+            conditions.append('username LIKE %s')
+            params.append(like_prefix(owner))
+        date_from = input_date('Show tierlists created on or after (YYYY-MM-DD, press enter for any date): ')
+        if date_from is False:
             return
-        print_bold('username             | date tierlist created | tierlist name')
-        print_bold('------------------------------------------------------------')
-        for row in rows:
-            print(f'{row[0].ljust(20)} | {str(row[2]).ljust(21)} | {row[1]}')
+        if date_from:
+            conditions.append('date_created >= %s')
+            params.append(date_from)
+        date_to = input_date('Show tierlists created on or before (YYYY-MM-DD, press enter for any date): ')
+        if date_to is False:
+            return
+        if date_to:
+            conditions.append('date_created <= %s')
+            params.append(date_to)
+
+    # sort option -> (index serving the sort, sort columns)
+    sorts = {'owner': ('PRIMARY', ('username', 'tierlist_name')),
+             'date': ('idx_tierlist_stats_date',
+                      ('date_created', 'username', 'tierlist_name')),
+             'size': ('idx_tierlist_stats_size',
+                      ('num_games', 'username', 'tierlist_name'))}
+    sort_by = 'owner'
+    sort_dir = 'asc'
+    ans = input('Do you want to sort the tierlists? ')
+    if ans and ans.lower()[0] == 'y':
+        sort_by = input('Enter what to sort by (\'owner\' (default), \'date\' or \'size\'): ').lower() or 'owner'
+        sort_dir = input('What direction? (\'asc\' (default) or \'desc\'): ').lower() or 'asc'
+        if sort_by not in sorts:
+            print_err(f'Unable to sort: \'{sort_by}\' is not one of owner, date or size')
+            return
+        if sort_dir not in ('asc', 'desc'):
+            print_err(f'Unable to sort: Direction \'{sort_dir}\' is invalid')
+            return
+    index, sort_cols = sorts[sort_by]
+    where = ''
+    if conditions:
+        where = 'WHERE ' + ' AND '.join(conditions)
+    # All sort columns go in the same direction so the index can be read
+    # forwards or backwards.
+    order = ', '.join(f's.{col} {sort_dir}' for col in sort_cols)
+    sql = f'''
+        SELECT s.username, s.date_created, s.num_games,
+            COALESCE((SELECT CONCAT(tier_name, ' (', c.num_games, ')')
+                      FROM mv_tierlist_tier_counts c JOIN tier USING (tier_id)
+                      WHERE c.username = s.username
+                          AND c.tierlist_name = s.tierlist_name
+                      ORDER BY tier_rank LIMIT 1), '-'),
+            s.tierlist_name
+        FROM mv_tierlist_stats s FORCE INDEX FOR ORDER BY ({index})
+        {where}
+        ORDER BY {order};'''
+    columns = [('username', 20), ('date created', 12), ('games', 5),
+               ('top tier', 12), ('tierlist name', None)]
+    try:
+        render_rows(stream_rows(sql, params), columns)
     except mysql.connector.Error as err:
         if DEBUG:
             print(err)
         else:
-            sys.stderr('An error occurred when fetching the tiers.')
+            print_err('An error occurred when fetching the tierlists.')
+
+def get_rendered_tierlist(username, tierlist_name):
+    '''
+    Returns the lines of the given tierlist rendered in color (an empty list
+    if the tierlist is empty), or None if the user doesn't own a tierlist of
+    that name. Rendered tierlists are kept in an LRU cache keyed by the
+    tierlist's version and the tier version, so a cached copy is used until
+    a game in the tierlist or a tier changes.
+    '''
+    cursor = conn.cursor()
+    cursor.execute("SELECT version, current_version('tier') FROM tierlist "
+                   "WHERE username = %s AND tierlist_name = %s;",
+                   (username, tierlist_name))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    key = (username, tierlist_name, row[0], row[1])
+    if key in tierlist_cache:
+        tierlist_cache_stats['hits'] += 1
+        tierlist_cache.move_to_end(key)
+        return tierlist_cache[key]
+
+    tierlist_cache_stats['misses'] += 1
+    # only reads the user's partition of game_tier and, if the tierlist is
+    # archived, its row of tierlist_archive
+    cursor.execute(f'''SELECT game_name, tier_rank
+                       FROM {TIERLIST_GAMES_SQL} AS g
+                           JOIN video_game USING (game_id)
+                           JOIN tier USING (tier_id)
+                       ORDER BY tier_rank;''', (username, tierlist_name) * 2)
+    rows = cursor.fetchall()
+    lines = format_tierlist(rows, key[3]) if rows else []
+    cache_tierlist(key, lines)
+    return lines
+
+def cache_tierlist(key, lines):
+    '''
+    Puts the lines of a rendered tierlist in the LRU cache under key,
+    evicting the least recently used tierlists if the cache is full.
+    '''
+    if TIERLIST_CACHE_SIZE > 0:
+        tierlist_cache[key] = lines
+        tierlist_cache.move_to_end(key)
+        while len(tierlist_cache) > TIERLIST_CACHE_SIZE:
+            tierlist_cache.popitem(last=False)
+            tierlist_cache_stats['evictions'] += 1
 
 def print_tierlist(username, tierlist_name):
     '''
-    Prints the given tierlist in color.
+    Prints the given tierlist in color. Returns False if it couldn't be
+    shown (e.g. the user doesn't own a tierlist of that name).
     '''
     try:
-        cursor = conn.cursor()
-        cursor.execute('SELECT game_name, tier_rank FROM game_tier JOIN video_game USING(game_id) JOIN tier USING(tier_id) WHERE username=\'%s\' AND tierlist_name = \'%s\' ORDER BY tier_rank;' % (username, tierlist_name))
-        rows = cursor.fetchall()
-        if not rows:
-            print()
-            print_warning(f'User {username}\'s tierlist {tierlist_name} is empty.')
-            return
+        lines = get_rendered_tierlist(username, tierlist_name)
     except mysql.connector.Error as err:
         if DEBUG:
             print(err)
         else:
             sys.stderr('An error occurred when fetching the tiers.')
+        return False
+    if lines is None:
+        print_err(f'User {username} does not own a tierlist named {tierlist_name}.')
+        return False
+    print_tierlist_lines(username, tierlist_name, lines)
+    return True
+
+def print_tierlist_lines(username, tierlist_name, lines):
+    '''
+    Prints the lines of a rendered tierlist, or a message if it is empty.
+    '''
     print()
+    if not lines:
+        print_warning(f'User {username}\'s tierlist {tierlist_name} is empty.')
+        return
+    for line in lines:
+        print(line)
+
+def show_tierlist_cache_stats():
+    '''
+    For admins only. Shows the hits, misses and evictions of this session's
+    rendered tierlist cache.
+    '''
+    hits = tierlist_cache_stats['hits']
+    lookups = hits + tierlist_cache_stats['misses']
+    print_bold('Rendered tierlist cache')
+    print(f'  entries:   {len(tierlist_cache)} / {TIERLIST_CACHE_SIZE}')
+    print(f'  hits:      {hits}')
+    print(f'  misses:    {tierlist_cache_stats["misses"]}')
+    print(f'  evictions: {tierlist_cache_stats["evictions"]}')
+    if lookups:
+        print(f'  hit rate:  {hits / lookups:.1%}')
+
+def format_tierlist(rows, tier_version=None, sorted_tiers=None):
+    '''
+    Given (game_name, tier_rank) rows, returns the lines of the tierlist in
+    color, one per tier. The tiers are sorted_tiers if given, otherwise
+    tier_version is passed on to get_sorted_tiers().
+    '''
     # Create a dictionary where the key is the rank and the value is
     # a list of games assigned to that rank
     tier_dict = defaultdict(list)
@@ -360,7 +935,9 @@ def print_tierlist(username, tierlist_name):
         tier_dict[key].append(row[0])
 
     # get a list of tier tuples sorted by rank
-    sorted_tiers = get_sorted_tiers()
+    if sorted_tiers is None:
+        sorted_tiers = get_sorted_tiers(tier_version)
+    lines = []
     for tier_tuple in sorted_tiers:
         # get the color for the tier
         color_code = get_color_code(tier_tuple[3])
@@ -373,7 +950,8 @@ def print_tierlist(username, tierlist_name):
         if result.endswith(", "):
             result = result[:-2]
         result = result + f'{Colors.END.value}'
-        print(result)
+        lines.append(result)
+    return lines
 
 def view_tierlist():
     '''
@@ -385,12 +963,154 @@ def view_tierlist():
     global conn
     username = input('Enter the username of the user who owns the tierlist: ')
     tierlist_name = input('Enter the name of the tierlist: ')
-    # if not entry_exists('tierlist', 'username', username,
-    #                     'tierlist_name', tierlist_name):
-    if not username_tierlist_exists(username, tierlist_name):
-        print_err(f'User {username} does not own a tierlist named {tierlist_name}.')
+    # print_tierlist checks that the user owns the tierlist
+    if print_tierlist(username, tierlist_name):
+        show_similar_tierlists(username, tierlist_name)
+
+def get_consensus_tierlist(method, platform='', release_year=0):
+    '''
+    Returns the rendered community consensus tierlist for the given method
+    ('mean', 'median' or 'weighted'), optionally only with the games of one
+    platform and/or release year (an empty platform or year 0 means all).
+    Rendered tierlists are cached in consensus_cache and reused until the
+    game rank stats version changes.
+    '''
+    # end any open snapshot so that the version read is current
+    conn.commit()
+    cursor = conn.cursor()
+    cursor.execute("SELECT current_version('game_rank_stats');")
+    version = cursor.fetchone()[0]
+    cursor.execute('''SELECT rendered FROM consensus_cache
+                      WHERE method = %s AND platform = %s
+                          AND release_year = %s AND stats_version = %s;''',
+                   (method, platform, release_year, version))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+
+    sql = f'''SELECT game_name, tier_rank
+              FROM mv_game_consensus c JOIN video_game USING (game_id)
+                  JOIN tier ON tier.tier_id = c.{CONSENSUS_METHODS[method]}
+              WHERE 1 = 1'''
+    params = []
+    if platform:
+        sql += ' AND c.platform = %s'
+        params.append(platform)
+    if release_year:
+        sql += ' AND c.release_year = %s'
+        params.append(release_year)
+    sql += ' ORDER BY tier_rank, game_name;'
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    rendered = '\n'.join(format_tierlist(rows)) if rows else ''
+    # Stored with the version read before the query, so a change made in
+    # the meantime makes the next read render it again
+    cursor.execute('''INSERT INTO consensus_cache
+                      VALUES (%s, %s, %s, %s, %s)
+                      ON DUPLICATE KEY UPDATE
+                          stats_version = %s, rendered = %s;''',
+                   (method, platform, release_year, version, rendered,
+                    version, rendered))
+    conn.commit()
+    return rendered
+
+def view_consensus_tierlist():
+    '''
+    Prompts the user for how to aggregate the ranks (mean by default) and
+    optional platform and release year filters, then prints the community
+    consensus tierlist: every ranked game placed in the tier nearest its
+    aggregate rank.
+    '''
+    method = input('Aggregate ranks by mean, median or weighted mean? '
+                   '(default mean) ').strip().lower() or 'mean'
+    if method not in CONSENSUS_METHODS:
+        print_err(f'Unknown method {method}.')
+        return
+    platform = input('Only games on platform (leave blank for all): ').strip()
+    release_year = input('Only games released in year '
+                         '(leave blank for all): ').strip()
+    if release_year:
+        try:
+            release_year = int(release_year)
+        except ValueError:
+            print_err(f'Release year {release_year} was not a number.')
+            return
+    else:
+        release_year = 0
+
+    try:
+        rendered = get_consensus_tierlist(method, platform, release_year)
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print(err)
+        else:
+            print_err('An error occurred when fetching the consensus tierlist.')
+        return
+    print()
+    if not rendered:
+        print_warning('No ranked games match the filters.')
+        return
+    print_bold(f'Community tierlist ({method})')
+    print(rendered)
+
+def show_similar_tierlists(username, tierlist_name):
+    '''
+    Shows the tierlists of other users most similar to the given tierlist.
+    These are precomputed by similarity.py; if they haven't been computed
+    for this tierlist yet, nothing is shown.
+    '''
+    sql = '''SELECT n.neighbor_username, n.neighbor_tierlist_name,
+                 ROUND(n.similarity, 2)
+             FROM tierlist_neighbors n JOIN tierlist t
+                 ON t.username = n.neighbor_username
+                 AND t.tierlist_name = n.neighbor_tierlist_name
+             WHERE n.username = %s AND n.tierlist_name = %s
+             ORDER BY n.neighbor_rank LIMIT %s;'''
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, (username, tierlist_name, SIMILAR_TIERLISTS_SHOWN))
+        rows = cursor.fetchall()
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print(err)
+        else:
+            print_err('An error occurred when fetching similar tierlists.')
         return
-    print_tierlist(username, tierlist_name)
+    if not rows:
+        return
+    print()
+    print_bold('Tierlists like this:')
+    for row in rows:
+        print(f'  {row[0].ljust(20)} | {row[1].ljust(30)} | similarity {row[2]}')
+
+def show_related_games(game_name):
+    '''
+    Shows the games most often ranked in the same or an adjacent tier as the
+    given game. These are precomputed by coranking.py; if they haven't been
+    computed for this game yet, nothing is shown.
+    '''
+    sql = '''SELECT v2.game_name, r.num_coranked, r.num_cooccur
+             FROM video_game v JOIN game_related r USING (game_id)
+                 JOIN video_game v2 ON v2.game_id = r.related_game_id
+             WHERE v.game_name = %s
+             ORDER BY r.game_id, r.related_rank;'''
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, (game_name,))
+        rows = cursor.fetchall()
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print(err)
+        else:
+            print_err('An error occurred when fetching related games.')
+        return
+    if not rows:
+        return
+    print()
+    print_bold(f'Players who ranked {game_name} put these games in the same '
+               'or an adjacent tier:')
+    for row in rows:
+        print(f'  {row[0].ljust(40)} | {row[1]} of {row[2]} tierlists')
 
 def view_stats():
     '''
@@ -409,23 +1129,146 @@ def view_stats():
         game_filter = "WHERE game_name=\'%s\' " % (game_name,)
 
     try:
-        cursor = conn.cursor()
         sql = 'SELECT game_name, avg_rank, min_rank, max_rank \
 FROM game_rank_stats JOIN video_game USING(game_id) %sORDER BY avg_rank ASC;' % (game_filter,)
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        if not rows:
-            print_warning('No results found. Game has not been ranked yet.')
-            return
-        print_bold('game name                                | avg rank | min rank | max rank')
-        print_bold('-------------------------------------------------------------------------')
-        for row in rows:
-            print(f'{row[0].ljust(40)} | {str(row[1]).ljust(8)} | {str(row[2]).ljust(8)} | {str(row[3]).ljust(8)}')
+        columns = [('game name', 40), ('avg rank', 8), ('min rank', 8),
+                   ('max rank', 8)]
+        render_rows(stream_rows(sql), columns,
+                    empty_msg='No results found. Game has not been ranked yet.')
     except mysql.connector.Error as err:
         if DEBUG:
             print(err)
         else:
             sys.stderr('An error occurred when fetching the tiers.')
+        return
+    if game_name is not None and OUTPUT_FORMAT == 'table':
+        show_related_games(game_name)
+
+def show_stats_dashboard():
+    '''
+    Prompts the user for how to group the games (platform by default) and
+    shows the number of rankings, average rank, minimum rank and maximum rank
+    of each group, ordered by average rank ascending. Read from the rollup
+    in group_rank_stats, so the cost depends on the number of groups, not
+    the number of rankings.
+    '''
+    group_type = input('Group games by platform, publisher, developer or '
+                       'year? (default platform) ').strip().lower() \
+        or 'platform'
+    if group_type not in STATS_GROUP_TYPES:
+        print_err(f'Unknown grouping {group_type}.')
+        return
+    sql = '''SELECT group_value, num_ranked, ROUND(avg_rank, 2), min_rank,
+                 max_rank
+             FROM group_rank_stats WHERE group_type = %s
+             ORDER BY avg_rank, num_ranked DESC;'''
+    columns = [(group_type, 40), ('rankings', 8), ('avg rank', 8),
+               ('min rank', 8), ('max rank', 8)]
+    try:
+        render_rows(stream_rows(sql, (group_type,)), columns,
+                    empty_msg='No results found. No games have been ranked yet.')
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print(err)
+        else:
+            print_err('An error occurred when fetching the stats.')
+
+def find_tierlists_with_game(game_id, tier_id=None, after=None,
+                             page_size=LOOKUP_PAGE_SIZE):
+    '''
+    Returns one page of the tierlists that ranked the given game (in the
+    given tier, if tier_id is not None), as a list of (tier_id, tier_name,
+    username, tierlist_name) tuples ordered by tier_id, username and
+    tierlist_name, and the cursor of the next page (None if this is the last
+    page). Pass the cursor as after to get the next page.
+    Pages are read with keyset pagination from idx_game_tier_game and, for
+    the archived tierlists, from archived_game_index, which are in the same
+    order, so every page costs the same no matter how far in it is: the
+    cursor condition is written out column by column, which MySQL turns
+    into a range seek on the index (extended with the primary key), whereas
+    a row constructor comparison only uses game_id. A game is ranked in
+    every partition of game_tier, so each page reads the index of each
+    partition and merges them in order, then merges in the archived page.
+    '''
+    conditions = 'game_id = %s'
+    params = [game_id]
+    if tier_id is not None:
+        conditions += ' AND tier_id = %s'
+        params.append(tier_id)
+    if after is not None:
+        conditions += (' AND (tier_id > %s OR (tier_id = %s AND (username > %s '
+                       'OR (username = %s AND tierlist_name > %s))))')
+        after_tier_id, after_username, after_tierlist_name = after
+        params.extend([after_tier_id, after_tier_id, after_username,
+                       after_username, after_tierlist_name])
+    # one extra row tells if there is a next page
+    params.append(page_size + 1)
+    sql = f'''SELECT tier_id, tier_name, username, tierlist_name
+              FROM ((SELECT tier_id, username, tierlist_name FROM game_tier
+                     WHERE {conditions}
+                     ORDER BY tier_id, username, tierlist_name LIMIT %s)
+                    UNION ALL
+                    (SELECT tier_id, username, tierlist_name
+                     FROM archived_game_index
+                     WHERE {conditions}
+                     ORDER BY tier_id, username, tierlist_name LIMIT %s))
+                  AS g JOIN tier USING (tier_id)
+              ORDER BY tier_id, username, tierlist_name LIMIT %s;'''
+    cursor = conn.cursor()
+    cursor.execute(sql, params * 2 + [page_size + 1])
+    rows = cursor.fetchall()
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, (last[0], last[2], last[3])
+
+def show_tierlists_with_game():
+    '''
+    Prompts the user for the id of a game and, optionally, the id of a tier,
+    then shows the tierlists that ranked the game (in that tier), one page
+    at a time. If an id is not an integer or does not exist, prints an error
+    message and returns.
+    '''
+    game_id = input('Enter the id of the game: ')
+    try:
+        game_id = int(game_id)
+    except ValueError:
+        print_err(f'Failed to look up game: Game id input {game_id} was not a number')
+        return
+    if not entry_exists('video_game', 'game_id', game_id):
+        print_err(f'Failed to look up game: game id {game_id} does not exist')
+        return
+    tier_id = input('Enter the id of a tier to only show that tier (press enter for all tiers): ')
+    if tier_id == '':
+        tier_id = None
+    else:
+        try:
+            tier_id = int(tier_id)
+        except ValueError:
+            print_err(f'Failed to look up game: Tier id input {tier_id} was not a number')
+            return
+        if not entry_exists('tier', 'tier_id', tier_id):
+            print_err(f'Failed to look up game: tier id {tier_id} does not exist')
+            return
+
+    columns = [('tier', 4), ('username', 20), ('tierlist name', None)]
+    after = None
+    try:
+        while True:
+            rows, after = find_tierlists_with_game(game_id, tier_id, after)
+            render_rows(((row[1], row[2], row[3]) for row in rows), columns,
+                        empty_msg='No tierlists have ranked this game here yet.')
+            if after is None:
+                return
+            ans = input('Show the next page? ')
+            if not ans or ans.lower()[0] != 'y':
+                return
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print(err)
+        else:
+            print_err('An error occurred when looking up the tierlists.')
 
 def choose_tierlist_for_edit(username, is_admin):
     '''
@@ -438,17 +1281,30 @@ def choose_tierlist_for_edit(username, is_admin):
     # tierlist_exists = entry_exists("tierlist", "tierlist_name",
     #                                name, "username", username)
     # if not tierlist_exists:
-    if not username_tierlist_exists(username, name):
+    # the tierlist is looked up together with its games, the tiers and the
+    # catalog, so the menu is shown after a single round trip
+    try:
+        editor = prefetch_editor(username, name)
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print(err)
+        else:
+            print_err('An error occurred when loading the tierlist.')
+        return
+    if editor is None:
         print_err(f'Failed to edit tierlist: User {username} does not own a tierlist named {name}')
         return
+    print_tierlist_lines(username, name, editor['lines'])
     print()
-    edit_tierlist_options(username, name, is_admin)
+    edit_tierlist_options(username, name, is_admin, editor)
 
-def add_update_game_tier(username, tierlist):
+def add_update_game_tier(username, tierlist, editor=None):
     '''
     Prompts the user enter the id of a game and a tier. If the game or tier id
     is not an integer or is not a valid id, prints a message accordingly.
-    Otherwise, assigns the game to the tier of the given tierlist.
+    Otherwise, assigns the game to the tier of the given tierlist. The ids
+    are checked against the data prefetched by prefetch_editor(), if given,
+    before asking the database.
     '''
     global conn
     game_id = input(f'Enter the id of the game: ')
@@ -457,7 +1313,8 @@ def add_update_game_tier(username, tierlist):
     except ValueError:
         print_err(f'Failed to assign game to a tier: Game id input {game_id} was not a number')
         return
-    if not entry_exists("video_game", "game_id", game_id):
+    if (editor is None or game_id not in editor['catalog']) and \
+            not game_exists(game_id):
         print_err(f'Failed to assign game to a tier: game id {game_id} does not exist')
         return
 
@@ -467,7 +1324,9 @@ def add_update_game_tier(username, tierlist):
     except ValueError:
         print_err(f'Failed to assign game to a tier: Tier id {tier_id} was not a number')
         return
-    if not entry_exists("tier", "tier_id", tier_id):
+    # tiers can be added since the prefetch, so a tier not in it is looked up
+    if (editor is None or tier_id not in editor['tier_ids']) and \
+            not entry_exists("tier", "tier_id", tier_id):
         print_err(f'Failed to assign game to a tier: tier id {tier_id} does not exist')
         return
     sql = 'CALL sp_update_game_tier(\'%s\', \'%s\', %d, %d);' % (username,
@@ -479,20 +1338,29 @@ def add_update_game_tier(username, tierlist):
         cursor.execute(sql)
         conn.commit()
         print_success('Game successfully assigned to tier!')
+        if editor is not None:
+            editor['games'][game_id] = tier_id
     except mysql.connector.Error as err:
-        if DEBUG:
+        # don't leave the tierlist locked until an unrelated commit
+        conn.rollback()
+        if err.errno == errorcode.ER_SIGNAL_EXCEPTION:
+            # e.g. the game was merged away since it was checked above
+            print_err(f'Failed to assign game to a tier: {err.msg}')
+        elif DEBUG:
             print(err)
         else:
             sys.stderr('An error occurred when assigning the game to a tier.')
         return
     print_tierlist(username, tierlist)
 
-def delete_game_tier(username, tierlist):
+def delete_game_tier(username, tierlist, editor=None):
     '''
     Prompts the user to enter the id of a game. If the game or tier id
     is not an integer or is not a valid id, prints a message accordingly.
     If the game is not in the tierlist, prints a message
-    accordingly. Otherwise, deletes the game from the tierlist.
+    accordingly. Otherwise, deletes the game from the tierlist. The game is
+    looked for in the games prefetched by prefetch_editor(), if given,
+    before asking the database.
     '''
     global conn
     id = input(f'Enter the id of the game to delete from tierlist {tierlist}: ')
@@ -502,8 +1370,8 @@ def delete_game_tier(username, tierlist):
         print_err(f'Failed to delete game from tierlist: Game id input {id} was not a number')
         return
 
-    if not entry_exists("game_tier", "game_id", id, "username",
-                        username, "tierlist_name", tierlist):
+    if (editor is None or id not in editor['games']) and \
+            not tierlist_has_game(username, tierlist, id):
         print_err(f'Failed to delete game: Game id {id} is not in tierlist {tierlist}')
         return
 
@@ -514,7 +1382,10 @@ def delete_game_tier(username, tierlist):
         cursor.execute(sql)
         conn.commit()
         print_success(f'Game {id} deleted from tierlist {tierlist}!')
+        if editor is not None:
+            editor['games'].pop(id, None)
     except mysql.connector.Error as err:
+        conn.rollback()
         if DEBUG:
             print(err)
         else:
@@ -533,7 +1404,9 @@ def create_tierlist(username):
     # tierlist_exists = entry_exists("tierlist", "tierlist_name",
     #                                name, "username", username)
     # if tierlist_exists is None or tierlist_exists:
-    if username_tierlist_exists(username, name):
+    # the prefetched tierlists of the user can only say yes
+    if name in (warmed(('tierlists', username)) or ()) or \
+            username_tierlist_exists(username, name):
         print_err(f'Failed to create tierlist: User {username} already has a tierlist named {name}')
         return
     sql = 'CALL sp_insert_tierlist(\'%s\', \'%s\');' % (username, name)
@@ -542,6 +1415,7 @@ def create_tierlist(username):
         cursor.execute(sql)
         conn.commit()
         print_success('Tierlist added!')
+        (warmed(('tierlists', username)) or set()).add(name)
     except mysql.connector.Error as err:
         if DEBUG:
             print(err)
@@ -560,15 +1434,21 @@ def delete_tierlist(username):
     # tierlist_exists = entry_exists("tierlist", "tierlist_name",
     #                                name, "username", username)
     # if not tierlist_exists:
-    if not username_tierlist_exists(username, name):
+    # the prefetched tierlists of the user can only say yes
+    if name not in (warmed(('tierlists', username)) or ()) and \
+            not username_tierlist_exists(username, name):
         print_err(f'Failed to delete tierlist: User {username} does not own a tierlist named {name}')
         return
     sql = 'CALL sp_delete_tierlist(\'%s\', \'%s\');' % (username, name)
     try:
         cursor = conn.cursor()
         cursor.execute(sql)
+        # the delete's trigger locks shared stats rows, so commit right away
+        conn.commit()
         print_success('Tierlist deleted!')
+        (warmed(('tierlists', username)) or set()).discard(name)
     except mysql.connector.Error as err:
+        conn.rollback()
         if DEBUG:
             print(err)
         else:
@@ -581,8 +1461,10 @@ def add_game():
     publisher, release_date, sales, and platform. If the input sales is not
     a number or the date is not formatted correctly, an error message is
     printed. Otherwise if the input sales is empty,
-    sales is set to null. Adds the game to the video_game table and prints
-    the id.
+    sales is set to null. A game with the same normalized name (see
+    game_name_key) on the same platform is refused, and one on another
+    platform needs confirming. Adds the game to the video_game table and
+    prints the id.
     '''
     global conn
     name = input('Enter the name of the new game: ')
@@ -600,6 +1482,32 @@ there are no sales yet: ')
             print_err(f'Failed to add game: Sales input {sales} was not a number')
             return
     platform = input('Enter the platform: ')
+    try:
+        cursor = conn.cursor()
+        # the platform is compared in the column's collation, which
+        # ignores case and accents like name_key's
+        cursor.execute('SELECT game_id, game_name, platform, platform = %s '
+                       'FROM video_game '
+                       'WHERE name_key = game_name_key(%s);', (platform, name))
+        same_games = cursor.fetchall()
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print(err)
+        else:
+            print_err('An error occurred when checking for duplicate games.')
+        return
+    for game_id, game_name, game_platform, same_platform in same_games:
+        if same_platform:
+            print_err(f'Failed to add game: {game_name} on {game_platform} '
+                      f'already exists (id {game_id})')
+            return
+    if same_games:
+        print_warning('Games with the same name on other platforms:')
+        for game_id, game_name, game_platform, _ in same_games:
+            print(f'  {game_id}: {game_name} ({game_platform})')
+        ans = input('Add the game anyway? ')
+        if not ans or ans[0].lower() != 'y':
+            return
     if not sales:
         # if sales not given, set it to NULL
         sql = 'CALL sp_insert_video_game(\'%s\', \'%s\', \'%s\', \'%s\', NULL, \
@@ -713,6 +1621,188 @@ def add_tier():
         else:
             sys.stderr('An error occurred when adding the tier.')
 
+def input_tier_id(prompt, action):
+    '''
+    Prompts for a tier id and returns it, or None after printing a message
+    if the input is not a number.
+    '''
+    tier_id = input(prompt)
+    try:
+        return int(tier_id)
+    except ValueError:
+        print_err(f'Failed to {action}: tier id {tier_id} was not a number')
+
+def manage_tiers():
+    '''
+    For admins only. Shows the tiers and prompts for a change to one of
+    them: renaming or recoloring it, moving it to another rank, merging it
+    into another tier (its games move there in every tierlist) or deleting
+    it (its games are removed from every tierlist). Each change is one
+    transaction that also recomputes the rank stats.
+    '''
+    global conn
+    show_tiers()
+    print()
+    print('What would you like to do? ')
+    print('  (r) - rename or recolor a tier')
+    print('  (o) - move a tier to another rank')
+    print('  (m) - merge a tier into another tier')
+    print('  (d) - delete a tier and remove its games from every tierlist')
+    ans = input('Enter an option: ')
+    if not ans:
+        return
+    ans = ans[0].lower()
+    if ans == 'r':
+        action = 'update tier'
+        tier_id = input_tier_id('Enter the id of the tier: ', action)
+        if tier_id is None:
+            return
+        # an empty input keeps the current value
+        name = input('Enter the new name of the tier (empty to keep it): ')
+        color = input('Enter the new color of the tier (empty to keep it): ')
+        sql = 'CALL sp_update_tier(%s, %s, %s);'
+        params = (tier_id, name or None, color or None)
+        done = 'Tier updated!'
+    elif ans == 'o':
+        action = 'move tier'
+        tier_id = input_tier_id('Enter the id of the tier: ', action)
+        if tier_id is None:
+            return
+        rank = input('Enter the new rank of the tier: ')
+        try:
+            rank = int(rank)
+        except ValueError:
+            print_err(f'Failed to move tier: rank input {rank} was not a number')
+            return
+        sql = 'CALL sp_move_tier(%s, %s);'
+        params = (tier_id, rank)
+        done = 'Tier moved!'
+    elif ans == 'm':
+        action = 'merge tier'
+        tier_id = input_tier_id('Enter the id of the tier to merge: ', action)
+        if tier_id is None:
+            return
+        into_id = input_tier_id('Enter the id of the tier to merge it '
+                                'into: ', action)
+        if into_id is None:
+            return
+        sql = 'CALL sp_merge_tier(%s, %s);'
+        params = (tier_id, into_id)
+        done = 'Tiers merged!'
+    elif ans == 'd':
+        action = 'delete tier'
+        tier_id = input_tier_id('Enter the id of the tier to delete: ', action)
+        if tier_id is None:
+            return
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT SUM(num_ranked) FROM mv_game_rank_dist '
+                           'WHERE tier_id = %s;', (tier_id,))
+            num_ranked = cursor.fetchone()[0] or 0
+        except mysql.connector.Error as err:
+            if DEBUG:
+                print(err)
+            else:
+                print_err('An error occurred when counting the games of the tier.')
+            return
+        ans = input(f'This removes {num_ranked} games from tierlists. '
+                    'Continue? ')
+        if not ans or ans[0].lower() != 'y':
+            return
+        sql = 'CALL sp_delete_tier(%s);'
+        params = (tier_id,)
+        done = 'Tier deleted!'
+    else:
+        print('Unknown option.')
+        return
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        conn.commit()
+        print_success(done)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        if err.errno == errorcode.ER_SIGNAL_EXCEPTION:
+            # the message of a check in the procedure
+            print_err(f'Failed to {action}: {err.msg}')
+        elif DEBUG:
+            print(err)
+        else:
+            print_err(f'An error occurred when trying to {action}.')
+
+def merge_duplicate_games():
+    '''
+    For admins only. Shows the candidate duplicate games, the games that
+    share a normalized name (video_game.name_key), and prompts for a game to
+    keep and the games to merge into it. Each merge is one transaction
+    (sp_merge_game) that moves the duplicate's rankings to the kept game,
+    keeping the better tier in tierlists that ranked both, and deletes it.
+    '''
+    global conn
+    # grouping by name_key reads idx_game_name_key once, so finding the
+    # candidates costs O(games) rather than comparing every pair of games
+    sql = '''SELECT name_key, game_id, game_name, platform, release_date,
+                 COALESCE(num_ranked, 0)
+             FROM video_game LEFT JOIN mv_game_rank_stats USING (game_id)
+             WHERE name_key IN (SELECT name_key FROM video_game
+                                GROUP BY name_key HAVING COUNT(*) > 1)
+             ORDER BY name_key, game_id;'''
+    columns = [('normalized name', 30), ('ID', 5), ('game name', 40),
+               ('platform', 20), ('release_date', 12), ('ranked', None)]
+    try:
+        shown = render_rows(stream_rows(sql), columns,
+                            'Games with the same normalized name:',
+                            empty_msg='No duplicate games found.')
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print(err)
+        else:
+            print_err('An error occurred when searching for duplicate games.')
+        return
+    if not shown:
+        return
+
+    print()
+    keep_id = input('Enter the id of the game to keep (empty to stop): ')
+    if not keep_id:
+        return
+    dup_ids = input('Enter the ids of the games to merge into it, separated '
+                    'by commas: ')
+    try:
+        keep_id = int(keep_id)
+        dup_ids = [int(dup_id) for dup_id in dup_ids.split(',')
+                   if dup_id.strip()]
+    except ValueError:
+        print_err('Failed to merge games: the game ids must be numbers')
+        return
+    if not dup_ids:
+        return
+    ans = input(f'This moves the rankings of {len(dup_ids)} games to game '
+                f'{keep_id} and deletes them. Continue? ')
+    if not ans or ans[0].lower() != 'y':
+        return
+
+    catalog = warmed('catalog', wait=False)
+    for dup_id in dup_ids:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('CALL sp_merge_game(%s, %s);', (keep_id, dup_id))
+            conn.commit()
+            print_success(f'Game {dup_id} merged into game {keep_id}!')
+            if catalog is not None:
+                catalog.pop(dup_id, None)
+        except mysql.connector.Error as err:
+            conn.rollback()
+            if err.errno == errorcode.ER_SIGNAL_EXCEPTION:
+                # the message of a check in the procedure
+                print_err(f'Failed to merge game {dup_id}: {err.msg}')
+            elif DEBUG:
+                print(err)
+            else:
+                print_err('An error occurred when trying to merge games.')
+            return
+
 # ----------------------------------------------------------------------
 # Functions for Logging Users In
 # ----------------------------------------------------------------------
@@ -794,6 +1884,9 @@ def login():
             print('Returning to startup menu...')
             return
 
+    # fetched while the user reads the main menu
+    start_warmup(('tierlists', username), fetch_user_tierlists, username)
+    start_prefetch_pool()
     if is_admin(username):
         conn.close()
         conn = get_conn(admin=True)
@@ -855,9 +1948,12 @@ def print_universal_options():
     print('  (h) - print the option menu again')
     print('  (g) - show the list of Nintendo games you can tier (displays at most 30 games)')
     print('  (s) - show rank statistics for a game')
+    print('  (b) - show the rank statistics dashboard by platform, publisher, developer or release year')
     print('  (t) - show the different tiers')
-    print('  (u) - show the list of tierlists you can view')
+    print('  (u) - browse the tierlists you can view (filter by owner or date, sort by owner, date or size)')
     print('  (v) - view a tierlist')
+    print('  (r) - find the tierlists that ranked a game (in a given tier)')
+    print('  (k) - view the community consensus tierlist')
 
 def print_logged_in_options():
     '''
@@ -873,7 +1969,7 @@ def print_startup_menu_options():
     '''
     Prints the options for the startup menu
     '''
-    print_universal_options() # g, t, u, v, s
+    print_universal_options() # g, t, u, v, s, b, r, k
     print('  (l) - login or create an account')
     print('  (q) - quit')
 
@@ -886,6 +1982,8 @@ def show_startup_options():
     print_bold('Welcome to Tiers of the Kingdom!')
     print('What would you like to do? ')
     print_startup_menu_options()
+    if MEASURE_STARTUP:
+        report_startup()
     while True:
         print()
         ans = input('Enter an option: ')
@@ -907,6 +2005,12 @@ def show_startup_options():
             view_tierlist()
         elif ans == 's':
             view_stats()
+        elif ans == 'b':
+            show_stats_dashboard()
+        elif ans == 'r':
+            show_tierlists_with_game()
+        elif ans == 'k':
+            view_consensus_tierlist()
         elif ans == 'l':
             login()
         else:
@@ -919,7 +2023,7 @@ def print_client_menu_options():
     print()
     print_bold('Main menu')
     print('What would you like to do? ')
-    print_universal_options() # g, t, u, v
+    print_universal_options() # g, t, u, v, s, b, r, k
     print_logged_in_options() # p, c, d, e
     print('  (q) - quit')
 
@@ -949,6 +2053,12 @@ def show_client_options(username):
             view_tierlist()
         elif ans == 's':
             view_stats()
+        elif ans == 'b':
+            show_stats_dashboard()
+        elif ans == 'r':
+            show_tierlists_with_game()
+        elif ans == 'k':
+            view_consensus_tierlist()
         elif ans == 'p':
             change_password(username)
         elif ans == 'c':
@@ -967,11 +2077,14 @@ def print_admin_menu_options():
     print()
     print_bold('Main menu')
     print('What would you like to do? ')
-    print_universal_options() # g, t, u, v
+    print_universal_options() # g, t, u, v, s, b, r, k
     print_logged_in_options() # p, c, d, e
     print('  (a) - add a video game to the database')
     print('  (m) - update the sales of an existing video game')
     print('  (n) - add a new tier')
+    print('  (o) - rename, recolor, move, merge or delete a tier')
+    print('  (f) - find and merge duplicate video games')
+    print('  (x) - show the rendered tierlist cache statistics')
     print('  (q) - quit')
 
 # You may choose to support admin vs. client features in the same program, or
@@ -1004,6 +2117,12 @@ def show_admin_options(username):
             view_tierlist()
         elif ans == 's':
             view_stats()
+        elif ans == 'b':
+            show_stats_dashboard()
+        elif ans == 'r':
+            show_tierlists_with_game()
+        elif ans == 'k':
+            view_consensus_tierlist()
         elif ans == 'p':
             change_password(username)
         elif ans == 'c':
@@ -1018,13 +2137,21 @@ def show_admin_options(username):
             update_game_sales()
         elif ans == 'n':
             add_tier()
+        elif ans == 'o':
+            manage_tiers()
+        elif ans == 'f':
+            merge_duplicate_games()
+        elif ans == 'x':
+            show_tierlist_cache_stats()
         else:
             print('Unknown option.')
 
-def edit_tierlist_options(username, name, is_admin):
+def edit_tierlist_options(username, name, is_admin, editor=None):
     '''
     Prints the options that are available while editing a tierlist, such as
     adding/moving a game to a tier and deleting a game from the tierlist.
+    editor is the data prefetched by prefetch_editor(), kept up to date
+    with the user's edits.
     '''
     print_bold(f'Edit Tierlist \'{name}\' Menu')
     print('What would you like to do? ')
@@ -1045,9 +2172,9 @@ def edit_tierlist_options(username, name, is_admin):
                 print_client_menu_options()
             return
         elif ans == 'a':
-            add_update_game_tier(username, name)
+            add_update_game_tier(username, name, editor)
         elif ans == 'd':
-            delete_game_tier(username, name)
+            delete_game_tier(username, name, editor)
         else:
             print('Unknown option.')
 
@@ -1073,12 +2200,31 @@ def main():
     """
     Main function for starting things up.
     """
+    global OUTPUT_FORMAT, PAGE_SIZE, TIERLIST_CACHE_SIZE, MEASURE_STARTUP
+    parser = argparse.ArgumentParser(description='Tiers of the Kingdom')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS,
+                        default=OUTPUT_FORMAT,
+                        help='output format of the list views')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE,
+                        help='rows per page in the list views (0 for no paging)')
+    parser.add_argument('--tierlist-cache-size', type=int,
+                        default=TIERLIST_CACHE_SIZE,
+                        help='rendered tierlists kept in memory (0 to disable)')
+    parser.add_argument('--measure-startup', action='store_true',
+                        help='print how long startup takes and exit')
+    args, _ = parser.parse_known_args()
+    OUTPUT_FORMAT = args.format
+    PAGE_SIZE = args.page_size
+    TIERLIST_CACHE_SIZE = args.tierlist_cache_size
+    MEASURE_STARTUP = args.measure_startup
+    # fetched while the user reads the menu
+    start_warmup('tiers', fetch_tiers)
+    start_warmup('catalog', fetch_catalog)
     show_startup_options()
 
 if __name__ == '__main__':
-    # This conn is a global object that other functions can access.
+    # conn is a global object that other functions can access. It connects
+    # on first use, so the menu is shown without waiting for the database.
     # You'll need to use cursor = conn.cursor() each time you are
     # about to execute a query with cursor.execute(<sqlquery>)
-    conn = get_conn()
-    print_success('Successfully connected.')
     main()
@@ -0,0 +1,92 @@
+"""
+Moves tierlists that haven't been modified for a while from game_tier into
+tierlist_archive (see setup.sql), one row per tierlist with its game tiers
+packed into a JSON array, so that game_tier and its indexes only hold the
+tierlists people still edit:
+    python3 archive.py run --inactive-days 180
+    python3 archive.py status
+
+run archives the tierlists a batch at a time, oldest first, each batch in a
+transaction of its own (sp_archive_tierlists), pausing between batches so
+that it can run next to the app. Archived tierlists are still viewed,
+printed, exported and counted in the stats like the others; the first edit
+of one moves its game tiers back to game_tier (sp_rehydrate_tierlist).
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import app
+
+DEFAULT_INACTIVE_DAYS = 180
+# Tierlists archived per transaction
+DEFAULT_BATCH_SIZE = 1000
+# Seconds between batches
+DEFAULT_PAUSE = 0.1
+
+
+def run(args):
+    '''
+    Archives the tierlists not modified in the last args.inactive_days days,
+    batch by batch, until none are left.
+    '''
+    start = time.perf_counter()
+    cutoff = datetime.now() - timedelta(days=args.inactive_days)
+    cursor = app.conn.cursor()
+    total = 0
+    while True:
+        result = cursor.callproc('sp_archive_tierlists',
+                                 (cutoff, args.batch_size, 0))
+        if not result[2]:
+            break
+        total += result[2]
+        print(f'Archived {total} tierlists '
+              f'({time.perf_counter() - start:.0f}s)')
+        time.sleep(args.pause)
+    app.print_success(f'Archived {total} tierlists in '
+                      f'{time.perf_counter() - start:.0f}s.')
+
+def status():
+    '''
+    Prints the number of active and archived tierlists.
+    '''
+    cursor = app.conn.cursor()
+    cursor.execute('''SELECT SUM(is_archived = 0), SUM(is_archived = 1),
+                          MIN(IF(is_archived = 0, modified_at, NULL))
+                      FROM tierlist;''')
+    active, archived, oldest = cursor.fetchone()
+    print(f'Active tierlists:   {active or 0}')
+    print(f'Archived tierlists: {archived or 0}')
+    if oldest:
+        print(f'Oldest active tierlist last modified {oldest}')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Archive inactive tierlists.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser(
+        'run', help='archive the tierlists not modified recently')
+    run_parser.add_argument('--inactive-days', type=int,
+                            default=DEFAULT_INACTIVE_DAYS,
+                            help='archive tierlists not modified in this '
+                            'many days')
+    run_parser.add_argument('--batch-size', type=int,
+                            default=DEFAULT_BATCH_SIZE,
+                            help='tierlists archived per transaction')
+    run_parser.add_argument('--pause', type=float, default=DEFAULT_PAUSE,
+                            help='seconds to wait between batches')
+
+    subparsers.add_parser(
+        'status', help='count the active and archived tierlists')
+
+    args = parser.parse_args()
+    app.conn = app.get_conn(admin=True)
+    if args.command == 'run':
+        run(args)
+    else:
+        status()
+    app.conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""
+Reads and compacts the tierlist change feed (tierlist_change), which the
+tierlist and game_tier triggers append every tierlist create and delete and
+every game tier upsert and delete to.
+
+A mirror keeps the sequence number of the last change it applied and asks
+for the changes after it, one batch at a time:
+    python3 change_feed.py since 0 --limit 1000
+Changes are idempotent (upserts and deletes by key), so replaying a change
+twice is harmless.
+
+Sequence numbers are assigned when a change is written, not when its
+transaction commits, so a change can become visible after later ones. A
+reader therefore stops at a gap in the sequence numbers until no
+transaction that could have written the missing changes is still running
+(from information_schema.INNODB_TRX, which needs the PROCESS privilege),
+after which the changes that are still missing were rolled back.
+
+Compaction drops old changes that a later change of the same tierlist or
+game tier overrides, then old deletes, so the feed stays in proportion to
+the live data. Mirrors that last synced before a dropped delete, or before
+a bulk load by generate_data.py, must reload the tables (see
+ResyncRequired):
+    python3 change_feed.py compact --older-than-days 7
+"""
+import argparse
+import json
+import sys
+
+import app
+
+# Changes returned per batch
+DEFAULT_BATCH_SIZE = 1000
+# Sequence numbers compacted per transaction
+COMPACT_BATCH_SIZE = 10000
+
+# Change types that delete a tierlist or game tier
+DELETE_TYPES = ('tierlist_delete', 'game_tier_delete')
+
+
+class ResyncRequired(Exception):
+    '''
+    Raised when the changes after a mirror's sequence number are no longer
+    all in the feed. The mirror must reload the tables and continue from
+    resume_seq, which settled_seq() returned before the reload.
+    '''
+    def __init__(self, resume_seq):
+        super().__init__(f'Changes were compacted or bulk loaded; reload '
+                         f'the tables and continue from {resume_seq}.')
+        self.resume_seq = resume_seq
+
+# ----------------------------------------------------------------------
+# Reading
+# ----------------------------------------------------------------------
+def get_resync_before():
+    '''
+    Returns the oldest sequence number a mirror can continue from.
+    '''
+    cursor = app.conn.cursor()
+    cursor.execute('SELECT resync_before FROM change_feed_state;')
+    return cursor.fetchone()[0]
+
+def read_snapshot(sql, params=()):
+    '''
+    Runs the query in a new consistent snapshot. Returns a time at or after
+    the snapshot was taken, and the rows.
+    '''
+    app.conn.commit()
+    app.conn.start_transaction(consistent_snapshot=True, readonly=True)
+    cursor = app.conn.cursor()
+    cursor.execute('SELECT NOW(6);')
+    taken_at = cursor.fetchone()[0]
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    app.conn.commit()
+    return taken_at, rows
+
+def writers_running(started_by):
+    '''
+    Returns whether another transaction that started by started_by and has
+    written rows is still running. Every change visible in a snapshot was
+    written before the snapshot was taken, so the changes with lower
+    sequence numbers were written by transactions that started before it
+    too; once none of those is running, each of them is either visible or
+    rolled back.
+    '''
+    cursor = app.conn.cursor()
+    # trx_started is in whole seconds, rounded down, so this errs on the
+    # side of waiting
+    cursor.execute('''SELECT COUNT(*) FROM information_schema.INNODB_TRX
+                      WHERE trx_mysql_thread_id <> CONNECTION_ID()
+                          AND trx_started <= %s
+                          AND trx_rows_modified > 0;''', (started_by,))
+    running = cursor.fetchone()[0] > 0
+    app.conn.commit()
+    return running
+
+def settled_seq():
+    '''
+    Returns a sequence number that every change up to is either visible or
+    rolled back: the last change written, if no transaction that could have
+    written an earlier one is still running, or else resync_before. A
+    mirror takes it before reloading the tables and continues from there;
+    the changes it replays that the reload already saw are harmless.
+    '''
+    taken_at, rows = read_snapshot('SELECT MAX(seq) FROM tierlist_change;')
+    resync_before = get_resync_before()
+    if writers_running(taken_at):
+        return resync_before
+    return max(rows[0][0] or 0, resync_before)
+
+def read_changes(after_seq, limit=DEFAULT_BATCH_SIZE):
+    '''
+    Returns the next batch of at most limit changes after the sequence
+    number after_seq, as a list of dicts in sequence order, and the sequence
+    number to pass as after_seq for the next batch. The batch stops early at
+    a gap that may still be filled by a change that hasn't committed yet.
+    Raises ResyncRequired if some changes after after_seq were compacted
+    away or bulk loaded.
+    '''
+    # end any open snapshot so that recently committed changes are seen
+    app.conn.commit()
+    if after_seq < get_resync_before():
+        raise ResyncRequired(settled_seq())
+    taken_at, rows = read_snapshot(
+        '''SELECT seq, change_type, username, tierlist_name, game_id,
+               tier_id, date_created
+           FROM tierlist_change
+           WHERE seq > %s ORDER BY seq LIMIT %s;''', (after_seq, limit))
+
+    # The gaps are rolled back changes if no transaction that could have
+    # written them is running any more and they are still missing now
+    gaps_settled = False
+    if rows and rows[-1][0] != after_seq + len(rows) and \
+            not writers_running(taken_at):
+        cursor = app.conn.cursor()
+        cursor.execute('''SELECT COUNT(*) FROM tierlist_change
+                          WHERE seq > %s AND seq <= %s;''',
+                       (after_seq, rows[-1][0]))
+        gaps_settled = cursor.fetchone()[0] == len(rows)
+        app.conn.commit()
+
+    changes = []
+    last_seq = after_seq
+    for (seq, change_type, username, tierlist_name, game_id, tier_id,
+         date_created) in rows:
+        if seq != last_seq + 1 and not gaps_settled:
+            break
+        last_seq = seq
+        if change_type == 'resync':
+            continue
+        changes.append({'seq': seq, 'type': change_type,
+                        'username': username, 'tierlist_name': tierlist_name,
+                        'game_id': game_id, 'tier_id': tier_id,
+                        'date_created': date_created.isoformat()
+                        if date_created else None})
+    return changes, last_seq
+
+def since(args):
+    '''
+    Prints the changes after the given sequence number as JSON lines, batch
+    by batch, until the feed is caught up.
+    '''
+    after_seq = args.seq
+    count = 0
+    try:
+        while True:
+            changes, next_seq = read_changes(after_seq, args.limit)
+            for change in changes:
+                print(json.dumps(change))
+            count += len(changes)
+            if next_seq == after_seq:
+                break
+            after_seq = next_seq
+    except ResyncRequired as err:
+        app.print_err(str(err))
+        sys.exit(1)
+    print(f'{count} changes; continue from {after_seq}', file=sys.stderr)
+
+# ----------------------------------------------------------------------
+# Compaction
+# ----------------------------------------------------------------------
+def compact(args):
+    '''
+    Compacts the changes written more than older_than_days days ago: drops
+    the upserts and creates overridden by a later change of the same
+    tierlist or game tier, then the deletes, raising resync_before past
+    them.
+    '''
+    cursor = app.conn.cursor()
+    cursor.execute('''SELECT MIN(seq), MAX(seq) FROM tierlist_change
+                      WHERE changed_at < NOW() - INTERVAL %s DAY;''',
+                   (args.older_than_days,))
+    low, horizon = cursor.fetchone()
+    if horizon is None:
+        app.print_success('No changes to compact.')
+        return
+
+    placeholders = ', '.join(['%s'] * len(DELETE_TYPES))
+    overridden = 0
+    for start in range(low, horizon + 1, COMPACT_BATCH_SIZE):
+        end = min(start + COMPACT_BATCH_SIZE - 1, horizon)
+        # game_id is NULL for tierlist changes, so they only match
+        # tierlist changes. Deletes are left to the second pass, which
+        # raises resync_before past them: a tierlist delete overridden by a
+        # create of the same name still deletes the old tierlist's game
+        # tiers on a mirror.
+        cursor.execute(f'''DELETE c FROM tierlist_change c
+                               JOIN tierlist_change later
+                               ON later.username = c.username
+                                   AND later.tierlist_name = c.tierlist_name
+                                   AND later.game_id <=> c.game_id
+                                   AND later.seq > c.seq
+                           WHERE c.seq BETWEEN %s AND %s
+                               AND c.change_type NOT IN ({placeholders});''',
+                       (start, end, *DELETE_TYPES))
+        overridden += cursor.rowcount
+        app.conn.commit()
+
+    deletes = 0
+    for start in range(low, horizon + 1, COMPACT_BATCH_SIZE):
+        end = min(start + COMPACT_BATCH_SIZE - 1, horizon)
+        cursor.execute(f'''SELECT MAX(seq) FROM tierlist_change
+                           WHERE seq BETWEEN %s AND %s
+                               AND change_type IN ({placeholders});''',
+                       (start, end, *DELETE_TYPES))
+        last_delete = cursor.fetchone()[0]
+        if last_delete is None:
+            continue
+        # mirrors behind the dropped deletes must resync; set in the same
+        # transaction so no mirror can read past a missing delete
+        cursor.execute('''UPDATE change_feed_state
+                          SET resync_before = GREATEST(resync_before, %s);''',
+                       (last_delete,))
+        cursor.execute(f'''DELETE FROM tierlist_change
+                           WHERE seq BETWEEN %s AND %s
+                               AND change_type IN ({placeholders});''',
+                       (start, end, *DELETE_TYPES))
+        deletes += cursor.rowcount
+        app.conn.commit()
+    app.print_success(f'Dropped {overridden} overridden changes and '
+                      f'{deletes} deletes up to sequence number {horizon}.')
+
+# ----------------------------------------------------------------------
+# Bulk Changes
+# ----------------------------------------------------------------------
+def mark_resync(cursor):
+    '''
+    Makes every mirror reload the tables, after a bulk change that skipped
+    the triggers (and so the feed). The caller commits.
+    '''
+    cursor.execute('CALL sp_mark_resync();')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Read and compact the tierlist change feed.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    since_parser = subparsers.add_parser(
+        'since', help='print the changes after a sequence number')
+    since_parser.add_argument('seq', type=int)
+    since_parser.add_argument('--limit', type=int, default=DEFAULT_BATCH_SIZE,
+                              help='changes read per batch')
+
+    subparsers.add_parser(
+        'settled', help='print the sequence number to continue from after '
+        'reloading the tables (take it before reloading)')
+
+    compact_parser = subparsers.add_parser(
+        'compact', help='drop overridden changes and old deletes')
+    compact_parser.add_argument('--older-than-days', type=int, default=7)
+
+    args = parser.parse_args()
+    app.conn = app.get_conn(admin=True)
+    if args.command == 'since':
+        since(args)
+    elif args.command == 'settled':
+        print(settled_seq())
+    else:
+        compact(args)
+    app.conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+"""
+Computes, for every game, the games most often ranked in the same or an
+adjacent tier in the same tierlists ("players who ranked X also ranked Y"),
+and stores the top related games in game_related, which view_stats shows
+for a filtered game.
+
+For a block of games G, the co-occurrence counts with every other game are
+B[:, G].T @ B, where B is the tierlist x game indicator matrix, and the
+co-ranking counts are the sum over tiers r of
+(B_r-1[:, G] + B_r[:, G] + B_r+1[:, G]).T @ B_r, where B_r is the indicator
+of games in the r-th tier in rank order (so tiers are adjacent even if their
+ranks have a gap between them). Only one block of counts is in memory at a
+time, so the memory used is bounded by the block size times the number of
+games, never the number of games squared.
+
+A full run computes every game. Later runs only recompute the games whose
+rankings changed since (marked in game_coranking_dirty by the game_tier
+triggers), reading just the tierlists that contain them (found with
+idx_game_tier_game, and archived_game_index for the archived tierlists), and
+fix the related games of the games they were paired with:
+    python3 coranking.py --full
+    python3 coranking.py
+
+Requires NumPy and SciPy (pip3 install numpy scipy).
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+import app
+from similarity import load_rank_matrix
+
+# Number of related games kept per game
+DEFAULT_TOP_N = 10
+# Games counted against all others per block
+DEFAULT_BLOCK_SIZE = 64
+# Tierlists that must contain both games for them to be related
+DEFAULT_MIN_SUPPORT = 2
+# Rows written to game_related per INSERT
+WRITE_BATCH_SIZE = 5000
+
+
+# ----------------------------------------------------------------------
+# Counting Functions
+# ----------------------------------------------------------------------
+def get_tier_ranks():
+    '''
+    Returns the ranks of the tiers in order, as an array.
+    '''
+    cursor = app.conn.cursor()
+    cursor.execute('SELECT DISTINCT tier_rank FROM tier ORDER BY tier_rank;')
+    return np.array([row[0] for row in cursor.fetchall()], dtype=np.float32)
+
+def rank_indicators(R, ranks):
+    '''
+    Splits the tierlist x game rank matrix into one CSC indicator matrix
+    per tier, in the order of ranks (the tier ranks from get_tier_ranks()),
+    so that adjacent indicators are adjacent tiers even where the ranks
+    have gaps.
+    '''
+    R = R.tocoo()
+    positions = np.searchsorted(ranks, R.data)
+    indicators = []
+    for position in range(len(ranks)):
+        mask = positions == position
+        indicators.append(sp.csc_matrix(
+            (np.ones(mask.sum(), dtype=np.float32),
+             (R.row[mask], R.col[mask])), shape=R.shape))
+    return indicators
+
+def count_block(indicators, games):
+    '''
+    Returns the dense (co-occurrence, co-ranking) counts of the given games
+    with every game, as two len(games) x num_games arrays.
+    '''
+    columns = [B[:, games] for B in indicators]
+    present = sum(columns)
+    cooccur = 0
+    coranked = 0
+    for i, B in enumerate(indicators):
+        adjacent = sum(columns[max(i - 1, 0):i + 2])
+        # one product for both counts, since they share the right side
+        left = sp.hstack([present, adjacent]).T.tocsr()
+        counts = left.dot(B).toarray()
+        cooccur = cooccur + counts[:len(games)]
+        coranked = coranked + counts[len(games):]
+    return (np.rint(cooccur).astype(np.int64),
+            np.rint(coranked).astype(np.int64))
+
+def sort_key(related_id, coranked, cooccur):
+    '''
+    Sort key of a related game: most co-ranked first, then most
+    co-occurring, then lowest id.
+    '''
+    return (-coranked, -cooccur, related_id)
+
+def top_related(game_id, cooccur, coranked, top_n, min_support):
+    '''
+    Returns the top_n related games of one game as a list of
+    (related_game_id, num_coranked, num_cooccur), best first.
+    '''
+    coranked = coranked.copy()
+    coranked[cooccur < min_support] = 0
+    if game_id < len(coranked):
+        coranked[game_id] = 0
+    candidates = np.flatnonzero(coranked)
+    if len(candidates) > top_n:
+        # keep everything tied with the top_n-th, the tie breaks below
+        # decide between them
+        threshold = np.partition(-coranked[candidates], top_n - 1)[top_n - 1]
+        candidates = candidates[-coranked[candidates] <= threshold]
+    # same order as sort_key()
+    order = np.lexsort((candidates, -cooccur[candidates],
+                        -coranked[candidates]))[:top_n]
+    return [(int(g), int(coranked[g]), int(cooccur[g]))
+            for g in candidates[order]]
+
+def write_related(related, table='game_related'):
+    '''
+    Replaces the related games of the games in the dict
+    game_id -> list of (related_game_id, num_coranked, num_cooccur) in table
+    (game_related by default).
+    '''
+    cursor = app.conn.cursor()
+    game_ids = list(related)
+    for start in range(0, len(game_ids), WRITE_BATCH_SIZE // 10):
+        batch = game_ids[start:start + WRITE_BATCH_SIZE // 10]
+        cursor.executemany(f'DELETE FROM {table} WHERE game_id = %s;',
+                           [(game_id,) for game_id in batch])
+        rows = [(game_id, rank, related_id, coranked, cooccur)
+                for game_id in batch
+                for rank, (related_id, coranked, cooccur)
+                in enumerate(related[game_id], 1)]
+        if rows:
+            cursor.executemany(f'INSERT INTO {table} VALUES '
+                               '(%s, %s, %s, %s, %s);', rows)
+        app.conn.commit()
+
+# ----------------------------------------------------------------------
+# Full and Incremental Runs
+# ----------------------------------------------------------------------
+def full_build(args):
+    '''
+    Computes the related games of every ranked game and replaces
+    game_related. The related games are written to a new table that is
+    swapped in once it is complete, like similarity.py does.
+    '''
+    start = time.perf_counter()
+    cursor = app.conn.cursor()
+    # The rankings and the marks are read in one snapshot, so the marks
+    # read are exactly those of the changes the run sees; changes that
+    # aren't in the snapshot keep their marks for the next incremental run
+    app.conn.start_transaction(consistent_snapshot=True, readonly=True)
+    _, R = load_rank_matrix()
+    ranks = get_tier_ranks()
+    cursor.execute('SELECT game_id, marked_at FROM game_coranking_dirty;')
+    dirty = cursor.fetchall()
+    app.conn.commit()
+    indicators = rank_indicators(R, ranks)
+    ranked_games = np.flatnonzero(R.getnnz(axis=0))
+    del R
+    print(f'Loaded {len(ranked_games)} ranked games '
+          f'({time.perf_counter() - start:.0f}s)')
+
+    cursor.execute('DROP TABLE IF EXISTS game_related_new;')
+    cursor.execute('CREATE TABLE game_related_new LIKE game_related;')
+    for block_start in range(0, len(ranked_games), args.block_size):
+        games = ranked_games[block_start:block_start + args.block_size]
+        cooccur, coranked = count_block(indicators, games)
+        write_related({int(g): top_related(g, cooccur[i], coranked[i],
+                                           args.top_n, args.min_support)
+                       for i, g in enumerate(games)},
+                      table='game_related_new')
+        print(f'Computed {min(block_start + args.block_size, len(ranked_games))}'
+              f'/{len(ranked_games)} games '
+              f'({time.perf_counter() - start:.0f}s)')
+
+    # swap the tables in one atomic rename
+    cursor.execute('DROP TABLE IF EXISTS game_related_old;')
+    cursor.execute('''RENAME TABLE game_related TO game_related_old,
+                      game_related_new TO game_related;''')
+    cursor.execute('DROP TABLE game_related_old;')
+    # clear the marks read, unless the game changed again since
+    cursor.executemany('DELETE FROM game_coranking_dirty WHERE game_id = %s '
+                       'AND marked_at = %s;', dirty)
+    app.conn.commit()
+    app.print_success(f'Done in {time.perf_counter() - start:.0f}s.')
+
+def compute_games(game_ids, args, ranks):
+    '''
+    Computes the counts and related games of the given games from only the
+    tierlists that contain them. Returns (related, counts) where related
+    maps game_id -> top related games and counts maps game_id ->
+    (co-occurrence, co-ranking) arrays.
+    '''
+    related = {}
+    counts = {}
+    for block_start in range(0, len(game_ids), args.block_size):
+        games = game_ids[block_start:block_start + args.block_size]
+        placeholders = ', '.join(['%s'] * len(games))
+        # a tierlist is either in game_tier or archived, so it is only
+        # read by one of the two
+        sql = f'''SELECT username, tierlist_name, game_id, tier_rank
+                  FROM game_tier JOIN tier USING (tier_id)
+                  WHERE (username, tierlist_name) IN (
+                      SELECT username, tierlist_name FROM game_tier
+                      WHERE game_id IN ({placeholders}))
+                  UNION ALL
+                  SELECT username, tierlist_name, game_id, tier_rank
+                  FROM archived_game_tiers JOIN tier USING (tier_id)
+                  WHERE (username, tierlist_name) IN (
+                      SELECT username, tierlist_name FROM archived_game_index
+                      WHERE game_id IN ({placeholders}))
+                  ORDER BY username, tierlist_name;'''
+        _, R = load_rank_matrix(sql, games * 2)
+        num_games = max(R.shape[1], max(games) + 1)
+        R.resize((R.shape[0], num_games))
+        cooccur, coranked = count_block(rank_indicators(R, ranks), games)
+        for i, game_id in enumerate(games):
+            counts[game_id] = (cooccur[i], coranked[i])
+            related[game_id] = top_related(game_id, cooccur[i], coranked[i],
+                                           args.top_n, args.min_support)
+    return related, counts
+
+def read_related(game_ids):
+    '''
+    Returns the stored related games of the given games, as a dict
+    game_id -> list of (related_game_id, num_coranked, num_cooccur).
+    '''
+    related = {game_id: [] for game_id in game_ids}
+    cursor = app.conn.cursor()
+    for start in range(0, len(game_ids), 1000):
+        batch = game_ids[start:start + 1000]
+        placeholders = ', '.join(['%s'] * len(batch))
+        cursor.execute(f'''SELECT game_id, related_game_id, num_coranked,
+                               num_cooccur
+                           FROM game_related WHERE game_id IN ({placeholders})
+                           ORDER BY game_id, related_rank;''', batch)
+        for game_id, related_id, coranked, cooccur in cursor.fetchall():
+            related[game_id].append((related_id, coranked, cooccur))
+    return related
+
+def incremental_update(args):
+    '''
+    Recomputes the related games of the games whose rankings changed since
+    the last run, and updates the related games of every game paired with
+    them.
+    '''
+    start = time.perf_counter()
+    cursor = app.conn.cursor()
+    cursor.execute('SELECT game_id, marked_at FROM game_coranking_dirty;')
+    dirty = cursor.fetchall()
+    if not dirty:
+        app.print_success('No rankings have changed.')
+        return
+    dirty_games = sorted(row[0] for row in dirty)
+    dirty_set = set(dirty_games)
+    ranks = get_tier_ranks()
+    related, counts = compute_games(dirty_games, args, ranks)
+
+    # A changed game only changes its pairs with other games. Find the
+    # other games that are paired with it now or were related to it before.
+    others = set()
+    for game_id in dirty_games:
+        cooccur, coranked = counts[game_id]
+        others.update(int(g) for g in np.flatnonzero(coranked))
+    placeholders = ', '.join(['%s'] * len(dirty_games))
+    cursor.execute(f'''SELECT DISTINCT game_id FROM game_related
+                       WHERE related_game_id IN ({placeholders});''',
+                   dirty_games)
+    others.update(row[0] for row in cursor.fetchall())
+    others -= dirty_set
+    others = sorted(others)
+    stored = read_related(others)
+
+    # Merge the new pair counts into each other game's related games. If
+    # a changed game got less related to it, something else may take its
+    # place, so that game is recomputed from scratch.
+    recompute = []
+    updated = {}
+    for other in others:
+        entries = {related_id: (coranked, cooccur)
+                   for related_id, coranked, cooccur in stored[other]}
+        full = len(entries) >= args.top_n
+        worst = max((sort_key(g, c, o) for g, (c, o) in entries.items()),
+                    default=None)
+        needs_recompute = False
+        for game_id in dirty_games:
+            cooccur, coranked = counts[game_id]
+            pair_cooccur = int(cooccur[other]) if other < len(cooccur) else 0
+            pair_coranked = int(coranked[other]) if other < len(coranked) else 0
+            if pair_cooccur < args.min_support:
+                pair_coranked = 0
+            key = sort_key(game_id, pair_coranked, pair_cooccur)
+            if game_id in entries:
+                if pair_coranked == 0 or key > sort_key(game_id,
+                                                        *entries[game_id]):
+                    needs_recompute = True
+                    break
+                entries[game_id] = (pair_coranked, pair_cooccur)
+            elif pair_coranked > 0 and (not full or key < worst):
+                entries[game_id] = (pair_coranked, pair_cooccur)
+        if needs_recompute:
+            recompute.append(other)
+            continue
+        best = sorted(entries.items(),
+                      key=lambda e: sort_key(e[0], *e[1]))[:args.top_n]
+        new = [(g, c, o) for g, (c, o) in best]
+        if new != stored[other]:
+            updated[other] = new
+
+    if recompute:
+        recomputed, _ = compute_games(recompute, args, ranks)
+        updated.update(recomputed)
+    updated.update(related)
+    write_related(updated)
+
+    # clear the marks, unless the game changed again in the meantime
+    cursor.executemany('DELETE FROM game_coranking_dirty WHERE game_id = %s '
+                       'AND marked_at = %s;', dirty)
+    app.conn.commit()
+    app.print_success(f'Updated {len(dirty_games)} changed games and '
+                      f'{len(updated) - len(related)} affected games in '
+                      f'{time.perf_counter() - start:.1f}s.')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compute the related games of each game.')
+    parser.add_argument('--full', action='store_true',
+                        help='recompute every game instead of only the '
+                        'changed ones')
+    parser.add_argument('--top-n', type=int, default=DEFAULT_TOP_N,
+                        help='related games kept per game')
+    parser.add_argument('--min-support', type=int, default=DEFAULT_MIN_SUPPORT,
+                        help='tierlists that must contain both games')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+    args = parser.parse_args()
+    app.conn = app.get_conn(admin=True)
+    if args.full:
+        full_build(args)
+    else:
+        incremental_update(args)
+    app.conn.close()
+
+if __name__ == '__main__':
+    main()
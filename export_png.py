@@ -0,0 +1,292 @@
+"""
+Exports tierlists as PNG images, laid out like print_tierlist in the app:
+one row per tier in rank order, with the tier name on a label in the tier's
+color followed by the tier's games.
+
+Every tierlist, or only those of the owners and tierlist name given, is
+rendered in bulk by a process pool. The owners are split into ranges of
+about the same number of game tiers, and each worker runs the same query for
+one range at a time, streaming the game tiers in primary key order and
+rendering each tierlist as soon as its rows are read, then the archived
+tierlists of the range from tierlist_archive. Each worker loads the tiers
+and fonts once.
+
+Images are saved as <out>/<username>/<tierlist_name>.png (names are
+percent-encoded where they aren't safe in file names):
+    python3 export_png.py --out exports
+    python3 export_png.py --out exports --owner user1 --workers 8
+
+Requires Pillow (pip3 install pillow).
+"""
+import argparse
+import itertools
+import os
+import time
+from collections import defaultdict
+from multiprocessing import Pool, cpu_count
+from urllib.parse import quote
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+import app
+
+IMAGE_WIDTH = 1200
+LABEL_WIDTH = 120
+PADDING = 12
+FONT_SIZE = 20
+LINE_SPACING = 6
+BACKGROUND_COLOR = (26, 26, 26)
+TEXT_COLOR = (235, 235, 235)
+# Color of tiers whose color Pillow doesn't know (the app falls back to the
+# terminal default)
+DEFAULT_TIER_COLOR = (128, 128, 128)
+# Fonts tried in order when --font isn't given
+DEFAULT_FONTS = ('DejaVuSans.ttf', 'Arial.ttf')
+# Owner ranges per worker, so that workers that finish early take more
+TASKS_PER_WORKER = 8
+
+# Worker state, set up once per process by init_worker()
+_config = None
+_tiers = None
+_font = None
+_measure = None
+
+
+# ----------------------------------------------------------------------
+# Rendering
+# ----------------------------------------------------------------------
+def load_font(path, size):
+    '''
+    Returns the font at path, or the first of DEFAULT_FONTS that can be
+    found, or Pillow's built-in font.
+    '''
+    for name in ([path] if path else DEFAULT_FONTS):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            if path:
+                raise
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # Pillow < 10.1 has no scalable built-in font
+        return ImageFont.load_default()
+
+def tier_rgb(color):
+    '''
+    Returns the RGB value of a tier color name.
+    '''
+    try:
+        return ImageColor.getrgb(color)[:3]
+    except ValueError:
+        return DEFAULT_TIER_COLOR
+
+def label_text_color(rgb):
+    '''
+    Returns black or white, whichever is easier to read on rgb.
+    '''
+    luminance = 0.299 * rgb[0] + 0.587 * rgb[1] + 0.114 * rgb[2]
+    return (0, 0, 0) if luminance > 140 else (255, 255, 255)
+
+def wrap_games(games, width):
+    '''
+    Splits the comma separated games into lines that fit in width pixels.
+    A game too long for a line gets a line of its own.
+    '''
+    lines = []
+    line = ''
+    for i, game in enumerate(games):
+        piece = game + (', ' if i < len(games) - 1 else '')
+        if line and _measure.textlength(line + piece.rstrip(),
+                                        font=_font) > width:
+            lines.append(line.rstrip())
+            line = piece
+        else:
+            line += piece
+    if line:
+        lines.append(line.rstrip())
+    return lines or ['']
+
+def render_tierlist(games_by_tier):
+    '''
+    Returns the image of a tierlist given a dict tier_id -> list of game
+    names, with a row for every tier like print_tierlist.
+    '''
+    line_height = FONT_SIZE + LINE_SPACING
+    games_width = IMAGE_WIDTH - LABEL_WIDTH - 3 * PADDING
+    rows = []
+    for tier_id, tier_name, rgb in _tiers:
+        lines = wrap_games(games_by_tier.get(tier_id, []), games_width)
+        height = max(len(lines) * line_height, 2 * line_height) + PADDING
+        rows.append((tier_name, rgb, lines, height))
+
+    image = Image.new('RGB', (IMAGE_WIDTH,
+                              sum(row[3] for row in rows) + PADDING),
+                      BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(image)
+    y = PADDING
+    for tier_name, rgb, lines, height in rows:
+        label = (PADDING, y, PADDING + LABEL_WIDTH, y + height - PADDING)
+        draw.rectangle(label, fill=rgb)
+        draw.text(((label[0] + label[2]) / 2, (label[1] + label[3]) / 2),
+                  tier_name, font=_font, fill=label_text_color(rgb),
+                  anchor='mm')
+        text_y = y + (height - PADDING - len(lines) * line_height) / 2
+        for line in lines:
+            draw.text((LABEL_WIDTH + 2 * PADDING, text_y), line, font=_font,
+                      fill=TEXT_COLOR)
+            text_y += line_height
+        y += height
+    return image
+
+def image_path(out, username, tierlist_name):
+    '''
+    Returns the path of a tierlist's image, creating its directory.
+    '''
+    directory = os.path.join(out, quote(username, safe=' '))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, quote(tierlist_name, safe=' ') + '.png')
+
+# ----------------------------------------------------------------------
+# Work Splitting
+# ----------------------------------------------------------------------
+def filter_sql(config):
+    '''
+    Returns the WHERE conditions and parameters of the tierlist filters.
+    '''
+    conditions = []
+    params = []
+    if config['owner']:
+        conditions.append('username LIKE %s')
+        params.append(app.like_prefix(config['owner']))
+    if config['tierlist']:
+        conditions.append('tierlist_name = %s')
+        params.append(config['tierlist'])
+    return conditions, params
+
+def split_owners(config, num_tasks):
+    '''
+    Splits the owners of the tierlists to export into at most num_tasks
+    ranges (first_username, next_range_username or None) with about the
+    same number of game tiers each, from the tierlist stats.
+    '''
+    conditions, params = filter_sql(config)
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    cursor = app.conn.cursor()
+    cursor.execute(f'SELECT SUM(num_games) FROM mv_tierlist_stats{where};',
+                   params)
+    total = cursor.fetchone()[0] or 0
+    if not total:
+        return []
+
+    starts = []
+    done = 0
+    rows = app.stream_rows(f'''SELECT username, SUM(num_games)
+                               FROM mv_tierlist_stats{where}
+                               GROUP BY username ORDER BY username;''',
+                           params)
+    for username, num_games in rows:
+        if num_games and done >= len(starts) * total / num_tasks:
+            starts.append(username)
+        done += num_games
+    return list(zip(starts, starts[1:] + [None]))
+
+# ----------------------------------------------------------------------
+# Workers
+# ----------------------------------------------------------------------
+def init_worker(config):
+    '''
+    Connects to the database and loads the tiers and fonts once per worker.
+    '''
+    global _config, _tiers, _font, _measure
+    _config = config
+    app.conn = app.get_conn()
+    _tiers = [(tier_id, tier_name, tier_rgb(color))
+              for tier_id, _, tier_name, color in app.get_sorted_tiers()]
+    _font = load_font(config['font'], FONT_SIZE)
+    _measure = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+
+def save_images(rows):
+    '''
+    Saves an image of each tierlist in rows of (username, tierlist_name,
+    tier_id, game_name), which are grouped by tierlist. Returns the number
+    of tierlists saved.
+    '''
+    count = 0
+    for (username, tierlist_name), tierlist_rows in \
+            itertools.groupby(rows, key=lambda row: row[:2]):
+        games_by_tier = defaultdict(list)
+        for _, _, tier_id, game_name in tierlist_rows:
+            games_by_tier[tier_id].append(game_name)
+        render_tierlist(games_by_tier).save(
+            image_path(_config['out'], username, tierlist_name),
+            optimize=_config['optimize'])
+        count += 1
+    return count
+
+def export_range(task):
+    '''
+    Streams the game tiers of the owners in one range in primary key order
+    and saves an image of each tierlist, then does the same for the
+    archived tierlists in the range. Returns the number of tierlists
+    exported.
+    '''
+    first, after_last = task
+    conditions, params = filter_sql(_config)
+    conditions = ['username >= %s'] + conditions
+    params = [first] + params
+    if after_last is not None:
+        conditions.append('username < %s')
+        params.append(after_last)
+    where = ' AND '.join(conditions)
+    count = save_images(app.stream_rows(
+        f'''SELECT username, tierlist_name, tier_id, game_name
+            FROM game_tier JOIN video_game USING (game_id)
+            WHERE {where}
+            ORDER BY username, tierlist_name, game_id;''', params))
+    # read from tierlist_archive in primary key order, one row per tierlist
+    count += save_images(app.stream_rows(
+        f'''SELECT username, tierlist_name, tier_id, game_name
+            FROM archived_game_tiers JOIN video_game USING (game_id)
+            WHERE {where}
+            ORDER BY username, tierlist_name, game_id;''', params))
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Export tierlists as PNG images.')
+    parser.add_argument('--out', default='exports',
+                        help='directory to save the images to')
+    parser.add_argument('--owner', help='only export the tierlists of '
+                        'users whose username starts with this')
+    parser.add_argument('--tierlist', help='only export tierlists with '
+                        'this name')
+    parser.add_argument('--workers', type=int, default=cpu_count())
+    parser.add_argument('--font', help='TrueType font file to use')
+    parser.add_argument('--optimize', action='store_true',
+                        help='make smaller files (slower)')
+    args = parser.parse_args()
+    config = {'out': args.out, 'owner': args.owner,
+              'tierlist': args.tierlist, 'font': args.font,
+              'optimize': args.optimize}
+
+    start = time.perf_counter()
+    app.conn = app.get_conn()
+    tasks = split_owners(config, args.workers * TASKS_PER_WORKER)
+    app.conn.close()
+    if not tasks:
+        app.print_warning('No tierlists to export.')
+        return
+
+    exported = 0
+    with Pool(args.workers, initializer=init_worker,
+              initargs=(config,)) as pool:
+        for n, count in enumerate(pool.imap_unordered(export_range, tasks), 1):
+            exported += count
+            print(f'Exported {exported} tierlists '
+                  f'({n}/{len(tasks)} ranges, '
+                  f'{time.perf_counter() - start:.0f}s)')
+    app.print_success(f'Done in {time.perf_counter() - start:.0f}s.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+"""
+Generates a deterministic, synthetic tier list dataset at a configurable scale
+and bulk-loads it into the database created by setup.sql.
+
+The same seed and volumes always produce the same data, regardless of the
+number of worker processes. Game popularity and tierlist ownership follow a
+Zipf distribution, and tier placements are skewed by a per-game "quality" so
+that popular games tend to land in higher tiers.
+
+Rows are generated in chunks by a process pool, written to temporary
+tab-separated files and loaded with LOAD DATA LOCAL INFILE. The game_tier
+and tierlist triggers are skipped during the load, and the stats
+materialized views are rebuilt afterwards with grouped passes over
+game_tier, one partition per worker (see partitions.py).
+
+Example (roughly production scale):
+    python3 generate_data.py --truncate --games 100000 --users 1000000 \\
+        --tierlists 5000000 --game-tiers 200000000
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import math
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from multiprocessing import Pool
+
+import app
+from change_feed import mark_resync
+from partitions import rebuild_stats
+
+# Every synthetic user can log in with this password.
+USER_PASSWORD = 'password'
+
+# Tiers to create if the tier table is empty (same as load-data.sql)
+DEFAULT_TIERS = [(1, 'S', 'red'), (2, 'A', 'yellow'), (3, 'B', 'green'),
+                 (4, 'C', 'cyan'), (5, 'D', 'blue'), (6, 'E', 'magenta'),
+                 (7, 'F', 'gray')]
+
+FIRST_DATE = date(2015, 1, 1)
+LAST_DATE = date(2023, 5, 12)
+
+# Columns of the generated files, for tables with columns left to their
+# defaults (tierlist.version) or set by a trigger (video_game.name_key).
+# Generated tierlists were last modified when they were created, so the
+# archive job can archive the old ones.
+LOAD_COLUMNS = {'tierlist': '(username, tierlist_name, date_created) '
+                            'SET modified_at = date_created',
+                'video_game': '(game_id, game_name, developer, publisher, '
+                              'release_date, sales, platform)'}
+
+# Worker state, set up once per process by init_worker()
+_config = None
+_game_cum_weights = None
+_user_cum_weights = None
+_game_by_popularity = None
+_user_by_popularity = None
+_game_quality = None
+
+
+# ----------------------------------------------------------------------
+# Generation Functions
+# ----------------------------------------------------------------------
+def chunk_rng(seed, kind, index):
+    '''
+    Returns the random generator for one chunk of one kind of rows. Seeding
+    per chunk keeps the output independent of how chunks are scheduled.
+    '''
+    return random.Random(f'{seed}/{kind}/{index}')
+
+def zipf_cum_weights(n, exponent):
+    '''
+    Returns the cumulative Zipf weights for n items, most popular first.
+    '''
+    return list(itertools.accumulate(1.0 / (i + 1) ** exponent
+                                     for i in range(n)))
+
+def random_date(rng):
+    '''
+    Returns a random date between FIRST_DATE and LAST_DATE.
+    '''
+    return FIRST_DATE + timedelta(
+        days=rng.randrange((LAST_DATE - FIRST_DATE).days + 1))
+
+def tsv_field(value):
+    '''
+    Formats a value for LOAD DATA with the default escaping: NULL becomes
+    \\N and backslashes, tabs and newlines are escaped.
+    '''
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n'))
+
+def write_tsv(path, rows):
+    '''
+    Writes the rows to path as tab-separated values. Returns the row count.
+    '''
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        for row in rows:
+            f.write('\t'.join(tsv_field(value) for value in row))
+            f.write('\n')
+            count += 1
+    return count
+
+def init_worker(config):
+    '''
+    Builds the popularity tables every chunk needs, once per worker.
+    '''
+    global _config, _game_cum_weights, _user_cum_weights
+    global _game_by_popularity, _user_by_popularity, _game_quality
+    _config = config
+    _game_cum_weights = zipf_cum_weights(config['games'], config['game_skew'])
+    _user_cum_weights = zipf_cum_weights(config['users'], config['user_skew'])
+    # popularity rank -> id, shuffled so popular games aren't just the
+    # lowest ids
+    _game_by_popularity = list(range(1, config['games'] + 1))
+    random.Random(f'{config["seed"]}/game_popularity').shuffle(
+        _game_by_popularity)
+    _user_by_popularity = list(range(config['users']))
+    random.Random(f'{config["seed"]}/user_popularity').shuffle(
+        _user_by_popularity)
+    # Quality is higher for more popular games, with some noise. Indexed by
+    # popularity rank.
+    rng = random.Random(f'{config["seed"]}/game_quality')
+    n = config['games']
+    _game_quality = [rng.gauss(0, 0.8) + 1.2 * (1 - i / n) for i in range(n)]
+
+def generate_games(path, catalog):
+    '''
+    Writes the video_game rows. The first games are the real catalog; the
+    rest are variants of it (re-releases with a different date and sales).
+    '''
+    rng = chunk_rng(_config['seed'], 'games', 0)
+
+    def rows():
+        for i in range(_config['games']):
+            name, developer, publisher, release_date, platform = \
+                catalog[i % len(catalog)]
+            variant = i // len(catalog)
+            if variant:
+                name = f'{name} ({variant + 1})'[:125]
+                release_date = release_date + timedelta(
+                    days=rng.randrange(1, 3650))
+            sales = None
+            if rng.random() > 0.02:
+                sales = int(rng.lognormvariate(12, 1.5))
+            yield (i + 1, name, developer, publisher, release_date, sales,
+                   platform)
+    return write_tsv(path, rows())
+
+def generate_users(index, path):
+    '''
+    Writes one chunk of user_info rows. Usernames are user<i>.
+    '''
+    rng = chunk_rng(_config['seed'], 'users', index)
+    start = index * _config['chunk_rows']
+    stop = min(start + _config['chunk_rows'], _config['users'])
+    salt_chars = string.ascii_letters + string.digits
+
+    def rows():
+        for i in range(start, stop):
+            salt = ''.join(rng.choice(salt_chars) for _ in range(8))
+            password_hash = hashlib.sha256(
+                (salt + USER_PASSWORD).encode()).hexdigest()
+            yield (f'user{i}', salt, password_hash, 0, random_date(rng))
+    return write_tsv(path, rows())
+
+def pick_games(rng, size):
+    '''
+    Picks size distinct games, weighted by popularity. Returns a list of
+    popularity ranks.
+    '''
+    n = _config['games']
+    picked = set()
+    for _ in range(8):
+        missing = size - len(picked)
+        if missing <= 0:
+            break
+        picked.update(rng.choices(range(n), cum_weights=_game_cum_weights,
+                                  k=missing))
+    # Very large lists saturate the popular games; fill the rest uniformly
+    while len(picked) < size:
+        picked.add(rng.randrange(n))
+    return list(picked)[:size]
+
+def generate_tierlists(index, tierlist_path, game_tier_path):
+    '''
+    Writes one chunk of tierlist rows and the game_tier rows of those
+    tierlists. Returns the two row counts.
+    '''
+    rng = chunk_rng(_config['seed'], 'tierlists', index)
+    start = index * _config['chunk_lists']
+    stop = min(start + _config['chunk_lists'], _config['tierlists'])
+    tier_ids = _config['tier_ids']
+    middle = (len(tier_ids) - 1) / 2
+    # lognormal list sizes with the requested mean
+    mean_size = max(_config['game_tiers'] / _config['tierlists'], 1)
+    sigma = 0.8
+    mu = math.log(mean_size) - sigma ** 2 / 2
+    owners = rng.choices(_user_by_popularity, cum_weights=_user_cum_weights,
+                         k=stop - start)
+    game_tier_count = 0
+
+    with open(game_tier_path, 'w', encoding='utf-8', newline='\n') as gt:
+        def rows():
+            nonlocal game_tier_count
+            for offset, j in enumerate(range(start, stop)):
+                username = f'user{owners[offset]}'
+                tierlist_name = f'list {j}'
+                yield (username, tierlist_name, random_date(rng))
+
+                size = min(_config['games'],
+                           max(1, round(rng.lognormvariate(mu, sigma))))
+                # how harsh this particular user is
+                bias = rng.gauss(0, 0.7)
+                for rank in pick_games(rng, size):
+                    position = middle - _game_quality[rank] + bias + \
+                        rng.gauss(0, 1.0)
+                    position = min(len(tier_ids) - 1, max(0, round(position)))
+                    gt.write(f'{username}\t{tierlist_name}\t'
+                             f'{_game_by_popularity[rank]}\t'
+                             f'{tier_ids[position]}\n')
+                    game_tier_count += 1
+        tierlist_count = write_tsv(tierlist_path, rows())
+    return tierlist_count, game_tier_count
+
+def run_chunk(task):
+    '''
+    Pool entry point. Generates one chunk and returns the files to load as
+    (table, path, row count) tuples.
+    '''
+    kind, index = task
+    tmpdir = _config['tmpdir']
+    if kind == 'users':
+        path = os.path.join(tmpdir, f'user_info.{index}.tsv')
+        return [('user_info', path, generate_users(index, path))]
+    tierlist_path = os.path.join(tmpdir, f'tierlist.{index}.tsv')
+    game_tier_path = os.path.join(tmpdir, f'game_tier.{index}.tsv')
+    tierlists, game_tiers = generate_tierlists(index, tierlist_path,
+                                               game_tier_path)
+    return [('tierlist', tierlist_path, tierlists),
+            ('game_tier', game_tier_path, game_tiers)]
+
+# ----------------------------------------------------------------------
+# Loading Functions
+# ----------------------------------------------------------------------
+def read_catalog(path):
+    '''
+    Reads the real games from the csv file as (name, developer, publisher,
+    release date, platform) tuples.
+    '''
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader)  # header
+        return [(row[1], row[2], row[3], date.fromisoformat(row[4]), row[6])
+                for row in reader]
+
+def load_file(conn, table, path):
+    '''
+    Loads a tab-separated file into the table and deletes the file.
+    '''
+    cursor = conn.cursor()
+    cursor.execute("LOAD DATA LOCAL INFILE %s INTO TABLE " + table +
+                   " FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' " +
+                   LOAD_COLUMNS.get(table, '') + ";", (path,))
+    conn.commit()
+    os.remove(path)
+
+def get_tier_ids(conn):
+    '''
+    Returns the tier ids sorted by rank, creating the default tiers if the
+    tier table is empty.
+    '''
+    cursor = conn.cursor()
+    cursor.execute('SELECT tier_id FROM tier ORDER BY tier_rank;')
+    rows = cursor.fetchall()
+    if not rows:
+        cursor.executemany('CALL sp_insert_tier(%s, %s, %s);', DEFAULT_TIERS)
+        conn.commit()
+        cursor.execute('SELECT tier_id FROM tier ORDER BY tier_rank;')
+        rows = cursor.fetchall()
+    return [row[0] for row in rows]
+
+def prepare_tables(conn, truncate):
+    '''
+    Makes sure the tables to load are empty, truncating them if asked to.
+    '''
+    cursor = conn.cursor()
+    if truncate:
+        for table in ('game_tier', 'archived_game_index', 'tierlist_archive',
+                      'tierlist', 'video_game', 'user_info'):
+            cursor.execute(f'TRUNCATE TABLE {table};')
+        return
+    for table in ('game_tier', 'archived_game_index', 'tierlist_archive',
+                  'tierlist', 'video_game', 'user_info'):
+        cursor.execute(f'SELECT 1 FROM {table} LIMIT 1;')
+        if cursor.fetchall():
+            app.print_err(f'Table {table} is not empty. Use --truncate to '
+                          'replace the existing data.')
+            sys.exit(1)
+
+def generate(args):
+    '''
+    Generates and loads the whole dataset.
+    '''
+    conn = app.get_conn(admin=True, allow_local_infile=True)
+    cursor = conn.cursor()
+    # Bulk load settings for this session only. The game_tier triggers are
+    # skipped and the stats are rebuilt in one pass at the end.
+    cursor.execute('SET foreign_key_checks = 0, unique_checks = 0, '
+                   '@skip_gametier_triggers = 1;')
+    prepare_tables(conn, args.truncate)
+
+    config = {
+        'seed': args.seed,
+        'games': args.games,
+        'users': args.users,
+        'tierlists': args.tierlists,
+        'game_tiers': args.game_tiers,
+        'game_skew': args.game_skew,
+        'user_skew': args.user_skew,
+        'chunk_rows': args.chunk_rows,
+        # about chunk_rows game_tier rows per tierlist chunk
+        'chunk_lists': max(1, int(args.chunk_rows * args.tierlists /
+                                  max(args.game_tiers, 1))),
+        'tier_ids': get_tier_ids(conn),
+        'tmpdir': tempfile.mkdtemp(dir=args.tmpdir),
+    }
+    start = time.perf_counter()
+    counts = {}
+
+    init_worker(config)
+    games_path = os.path.join(config['tmpdir'], 'video_game.tsv')
+    counts['video_game'] = generate_games(games_path,
+                                          read_catalog(args.catalog))
+    load_file(conn, 'video_game', games_path)
+
+    tasks = [('users', i) for i in
+             range(math.ceil(args.users / config['chunk_rows']))]
+    tasks += [('tierlists', i) for i in
+              range(math.ceil(args.tierlists / config['chunk_lists']))]
+    with Pool(args.workers, initializer=init_worker,
+              initargs=(config,)) as pool:
+        # Chunks are generated in parallel while the previous ones load
+        for n, files in enumerate(pool.imap(run_chunk, tasks), 1):
+            for table, path, count in files:
+                load_file(conn, table, path)
+                counts[table] = counts.get(table, 0) + count
+            print(f'Loaded chunk {n}/{len(tasks)} '
+                  f'({time.perf_counter() - start:.0f}s)')
+    os.rmdir(config['tmpdir'])
+
+    cursor.execute('SET foreign_key_checks = 1, unique_checks = 1, '
+                   '@skip_gametier_triggers = NULL;')
+    print('Rebuilding stats...')
+    rebuild_stats(conn, args.workers)
+    # The load bypassed the change feed, so mirrors must reload the tables
+    mark_resync(cursor)
+    conn.commit()
+    cursor.execute('ANALYZE TABLE video_game, user_info, tierlist, '
+                   'game_tier, mv_game_rank_stats, mv_game_rank_dist, '
+                   'mv_game_consensus, mv_group_rank_dist, '
+                   'mv_tierlist_stats, mv_tierlist_tier_counts;')
+    cursor.fetchall()
+    conn.close()
+
+    app.print_success(f'Done in {time.perf_counter() - start:.0f}s.')
+    for table, count in counts.items():
+        print(f'  {table.ljust(10)} {count} rows')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate and bulk-load a synthetic tier list dataset.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--tierlists', type=int, default=500000)
+    parser.add_argument('--game-tiers', type=int, default=20000000,
+                        help='approximate total number of game_tier rows')
+    parser.add_argument('--game-skew', type=float, default=1.0,
+                        help='Zipf exponent of game popularity')
+    parser.add_argument('--user-skew', type=float, default=0.8,
+                        help='Zipf exponent of tierlists per user')
+    parser.add_argument('--chunk-rows', type=int, default=1000000,
+                        help='rows per generated file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--catalog', default='nintendo_video_games.csv')
+    parser.add_argument('--tmpdir', default=None)
+    parser.add_argument('--truncate', action='store_true',
+                        help='delete all games, users and tierlists first')
+    args = parser.parse_args()
+    generate(args)
+
+if __name__ == '__main__':
+    main()
@@ -7,9 +7,13 @@ CREATE USER 'appadmin'@'localhost' IDENTIFIED BY 'admins';
 CREATE USER 'appclient'@'localhost' IDENTIFIED BY 'clients';
 
 GRANT ALL PRIVILEGES ON tierlistdb.* TO 'appadmin'@'localhost';
+-- change_feed.py reads information_schema.INNODB_TRX to tell a rolled back
+-- change from one that hasn't committed yet
+GRANT PROCESS ON *.* TO 'appadmin'@'localhost';
 GRANT SELECT ON tierlistdb.* TO 'appclient'@'localhost';
 GRANT INSERT, UPDATE ON tierlistdb.user_info TO 'appclient'@'localhost';
 GRANT INSERT, DELETE ON tierlistdb.tierlist TO 'appclient'@'localhost';
 GRANT INSERT, UPDATE, DELETE ON tierlistdb.game_tier TO 'appclient'@'localhost';
+GRANT INSERT, UPDATE ON tierlistdb.consensus_cache TO 'appclient'@'localhost';
 
 FLUSH PRIVILEGES;
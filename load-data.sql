@@ -2,7 +2,8 @@
 SET GLOBAL local_infile = 'ON';
 
 LOAD DATA LOCAL INFILE 'nintendo_video_games.csv' INTO TABLE video_game
-FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n' IGNORE 1 ROWS;
+FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n' IGNORE 1 ROWS
+(game_id, game_name, developer, publisher, release_date, sales, platform);
 
 -- Create test values for other tables
 -- This is run before the add user routine in setup-passwords.sql is defined
@@ -10,7 +11,7 @@ INSERT INTO user_info VALUES
     -- admin user
     ('testuser', '12345678', SHA2('12345678testpw', 256), 1, CURDATE());
 
-INSERT INTO tierlist VALUES
+INSERT INTO tierlist (username, tierlist_name, date_created) VALUES
     ('testuser', 'testtierlist', CURDATE()),
     ('testuser', 'testtierlist2', CURDATE()),
     ('testuser', 'testtierlist4', CURDATE());
@@ -0,0 +1,267 @@
+"""
+Records interactive sessions of the command line app and replays them
+concurrently against a local database, reporting throughput, tail latency,
+lock waits and deadlocks at each concurrency level.
+
+Recording runs the app as usual and saves every prompt and answer:
+    python3 load_tester.py record sessions/edit_zelda.json
+
+Replaying runs the recorded sessions in a pool of processes (each with its
+own connection, since the app keeps its connection in a module global):
+    python3 load_tester.py replay sessions/*.json --concurrency 1,2,4,8,16
+
+A step is the work the app does between two prompts, i.e. the handling of one
+menu choice or input. Its latency is the time from the answer being given to
+the next prompt appearing.
+"""
+import argparse
+import builtins
+import contextlib
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import app
+
+# Prompts whose answers are replaced when replaying as synthetic users
+USERNAME_PROMPT = 'Enter a username: '
+PASSWORD_PROMPT = 'Enter your password: '
+
+# InnoDB counters sampled before and after each concurrency level
+STATUS_COUNTERS = ('Innodb_row_lock_waits', 'Innodb_row_lock_time')
+METRIC_COUNTERS = ('lock_deadlocks', 'lock_timeouts')
+
+# Sessions loaded in each worker process
+_sessions = None
+
+
+# ----------------------------------------------------------------------
+# Recording
+# ----------------------------------------------------------------------
+def record(path):
+    '''
+    Runs the app interactively and saves the prompts and answers of the
+    session to path when the user quits.
+    '''
+    steps = []
+    real_input = builtins.input
+
+    def recording_input(prompt=''):
+        answer = real_input(prompt)
+        steps.append([prompt, answer])
+        return answer
+
+    builtins.input = recording_input
+    try:
+        app.conn = app.get_conn()
+        app.main()
+    except (SystemExit, EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        builtins.input = real_input
+        with open(path, 'w') as f:
+            json.dump({'steps': steps}, f, indent=1)
+        print()
+        app.print_success(f'Recorded {len(steps)} inputs to {path}')
+
+# ----------------------------------------------------------------------
+# Replaying
+# ----------------------------------------------------------------------
+class EndOfSession(Exception):
+    '''
+    Raised by the replayed input() once a session runs out of answers.
+    '''
+
+def init_worker(paths):
+    '''
+    Loads the recorded sessions once per worker and silences the app.
+    '''
+    global _sessions
+    _sessions = []
+    for path in paths:
+        with open(path) as f:
+            _sessions.append(json.load(f)['steps'])
+    sys.stdout = open(os.devnull, 'w')
+
+def replay_session(task):
+    '''
+    Replays one recorded session with its own connection. Returns the step
+    latencies in seconds and the number of steps that raised an error (0 or
+    1, since a session ends at its first failed step).
+    '''
+    index, synthetic_users = task
+    steps = _sessions[index % len(_sessions)]
+    answers = iter(steps)
+    latencies = []
+    errors = 0
+    last_answer = None
+
+    def replay_input(prompt=''):
+        nonlocal last_answer
+        now = time.perf_counter()
+        if last_answer is not None:
+            latencies.append(now - last_answer)
+        try:
+            _, answer = next(answers)
+        except StopIteration:
+            raise EndOfSession()
+        if synthetic_users and prompt == USERNAME_PROMPT:
+            answer = f'user{index % synthetic_users}'
+        elif synthetic_users and prompt == PASSWORD_PROMPT:
+            answer = 'password'
+        last_answer = time.perf_counter()
+        return answer
+
+    builtins.input = replay_input
+    app.conn = app.get_conn()
+    try:
+        app.main()
+    except (EndOfSession, SystemExit):
+        pass
+    except Exception:
+        # The step failed (e.g. a deadlock surfaced as an exception). The
+        # remaining answers belong to prompts the app is no longer at, so
+        # count the failure and end the session here.
+        errors += 1
+        with contextlib.suppress(Exception):
+            app.conn.rollback()
+    with contextlib.suppress(Exception):
+        app.conn.close()
+    return latencies, errors
+
+def read_counters(conn):
+    '''
+    Returns the current values of the InnoDB lock counters. Counters that
+    can't be read are left out.
+    '''
+    counters = {}
+    cursor = conn.cursor()
+    cursor.execute('SHOW GLOBAL STATUS WHERE Variable_name IN (%s, %s);',
+                   STATUS_COUNTERS)
+    for name, value in cursor.fetchall():
+        counters[name] = int(value)
+    try:
+        cursor.execute('SELECT name, count FROM information_schema.INNODB_METRICS '
+                       'WHERE name IN (%s, %s);', METRIC_COUNTERS)
+        for name, value in cursor.fetchall():
+            counters[name] = int(value)
+    except app.mysql.connector.Error:
+        pass
+    return counters
+
+def percentile(sorted_values, p):
+    '''
+    Returns the p-th percentile (0-100) of already sorted values.
+    '''
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+def run_level(paths, concurrency, num_sessions, synthetic_users, monitor):
+    '''
+    Replays num_sessions sessions with the given number of concurrent
+    processes and returns the measurements for the report.
+    '''
+    before = read_counters(monitor)
+    tasks = [(i, synthetic_users) for i in range(num_sessions)]
+    latencies = []
+    errors = 0
+    with Pool(concurrency, initializer=init_worker, initargs=(paths,)) as pool:
+        start = time.perf_counter()
+        for session_latencies, session_errors in \
+                pool.imap_unordered(replay_session, tasks):
+            latencies.extend(session_latencies)
+            errors += session_errors
+        elapsed = time.perf_counter() - start
+    after = read_counters(monitor)
+    latencies.sort()
+
+    def delta(name):
+        if name not in before or name not in after:
+            return 'n/a'
+        return after[name] - before[name]
+
+    return {
+        'concurrency': concurrency,
+        'steps': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'max': (latencies[-1] if latencies else 0.0) * 1000,
+        'lock_waits': delta('Innodb_row_lock_waits'),
+        'lock_wait_ms': delta('Innodb_row_lock_time'),
+        'deadlocks': delta('lock_deadlocks'),
+        'lock_timeouts': delta('lock_timeouts'),
+        'errors': errors,
+    }
+
+def print_report(results):
+    '''
+    Prints one line of measurements per concurrency level.
+    '''
+    app.print_bold('conc | steps   | steps/s  | p50 ms  | p95 ms  | p99 ms  | max ms  | lock waits | lock wait ms | deadlocks | timeouts | errors')
+    app.print_bold('----------------------------------------------------------------------------------------------------------------------------')
+    for r in results:
+        print(f'{str(r["concurrency"]).ljust(4)} | {str(r["steps"]).ljust(7)} | '
+              f'{r["throughput"]:<8.1f} | {r["p50"]:<7.2f} | {r["p95"]:<7.2f} | '
+              f'{r["p99"]:<7.2f} | {r["max"]:<7.2f} | {str(r["lock_waits"]).ljust(10)} | '
+              f'{str(r["lock_wait_ms"]).ljust(12)} | {str(r["deadlocks"]).ljust(9)} | '
+              f'{str(r["lock_timeouts"]).ljust(8)} | {r["errors"]}')
+
+def replay(args):
+    '''
+    Replays the recorded sessions at each concurrency level and prints the
+    report.
+    '''
+    levels = [int(level) for level in args.concurrency.split(',')]
+    monitor = app.get_conn(admin=True)
+    results = []
+    for concurrency in levels:
+        num_sessions = args.sessions or concurrency * args.sessions_per_worker
+        print(f'Replaying {num_sessions} sessions with {concurrency} '
+              'concurrent processes...')
+        results.append(run_level(args.sessions_files, concurrency,
+                                 num_sessions, args.synthetic_users, monitor))
+    monitor.close()
+    print()
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Record and concurrently replay app sessions.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser(
+        'record', help='run the app and record the session')
+    record_parser.add_argument('path', help='file to save the session to')
+
+    replay_parser = subparsers.add_parser(
+        'replay', help='replay recorded sessions concurrently')
+    replay_parser.add_argument('sessions_files', nargs='+', metavar='session')
+    replay_parser.add_argument('--concurrency', default='1,2,4,8,16',
+                               help='comma separated concurrency levels')
+    replay_parser.add_argument('--sessions', type=int, default=0,
+                               help='sessions per level (default: '
+                               '--sessions-per-worker per process)')
+    replay_parser.add_argument('--sessions-per-worker', type=int, default=20)
+    replay_parser.add_argument('--synthetic-users', type=int, default=0,
+                               metavar='N',
+                               help='log in as user0..user<N-1> from '
+                               'generate_data.py instead of the recorded user')
+    replay_parser.add_argument('--json', help='also save the results here')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.path)
+    else:
+        replay(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+"""
+Maintenance of the partitioned game_tier table (see setup.sql), which is
+partitioned by a hash of the username so that every tierlist is in one
+partition. Each maintenance job runs one partition per worker:
+    python3 partitions.py rebuild-stats --workers 8
+    python3 partitions.py backup --out backup
+    python3 partitions.py restore --from backup --truncate
+
+rebuild-stats rebuilds the stats materialized views that are counted from
+game_tier, like the sp_rebuild_* procedures. A tierlist is in one
+partition, so the workers write its tier counts straight into
+mv_tierlist_tier_counts; a game is ranked in every partition, so its counts
+are written per partition to mv_game_rank_dist_partial and summed. The
+archived tierlists (tierlist_archive) are counted by one more worker as if
+they were a partition. The other views are then derived from these. Like the
+procedures, it must run while nothing writes to game_tier.
+
+backup writes each partition to <out>/game_tier.<partition>.tsv, and
+restore loads the files back into an empty game_tier, skipping the
+triggers, then rebuilds the stats. Only game_tier is backed up; the other
+tables, tierlist_archive and archived_game_index included, are small enough
+for mysqldump. Each partition is read in a snapshot of its own, so take
+backups while nothing writes to game_tier.
+
+repartition changes the number of partitions, or partitions a game_tier
+created before it was partitioned (dropping its foreign keys). It rewrites
+the table and blocks writes to it until it is done, so run it offline:
+    python3 partitions.py repartition --partitions 32
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from multiprocessing import Pool, cpu_count
+
+import app
+from change_feed import mark_resync
+
+DEFAULT_PARTITIONS = 16
+
+
+# ----------------------------------------------------------------------
+# Partitions
+# ----------------------------------------------------------------------
+def get_partitions(cursor):
+    '''
+    Returns the names of the partitions of game_tier in order, or an empty
+    list if it isn't partitioned.
+    '''
+    cursor.execute('''SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+                      WHERE TABLE_SCHEMA = DATABASE()
+                          AND TABLE_NAME = 'game_tier'
+                          AND PARTITION_NAME IS NOT NULL
+                      ORDER BY PARTITION_ORDINAL_POSITION;''')
+    return [row[0] for row in cursor.fetchall()]
+
+def backup_path(directory, partition):
+    '''
+    Returns the path of a partition's backup file.
+    '''
+    return os.path.join(directory, f'game_tier.{partition}.tsv')
+
+def repartition(args):
+    '''
+    Partitions game_tier into the given number of partitions, dropping the
+    foreign keys of a game_tier created before it was partitioned.
+    '''
+    start = time.perf_counter()
+    cursor = app.conn.cursor()
+    cursor.execute('''SELECT CONSTRAINT_NAME
+                      FROM information_schema.REFERENTIAL_CONSTRAINTS
+                      WHERE CONSTRAINT_SCHEMA = DATABASE()
+                          AND TABLE_NAME = 'game_tier';''')
+    for (name,) in cursor.fetchall():
+        print(f'Dropping foreign key {name}...')
+        cursor.execute(f'ALTER TABLE game_tier DROP FOREIGN KEY `{name}`;')
+    # the index of the tier_id foreign key stays behind when it is dropped
+    cursor.execute('''SELECT 1 FROM information_schema.STATISTICS
+                      WHERE TABLE_SCHEMA = DATABASE()
+                          AND TABLE_NAME = 'game_tier'
+                          AND COLUMN_NAME = 'tier_id' AND SEQ_IN_INDEX = 1
+                      LIMIT 1;''')
+    if not cursor.fetchall():
+        cursor.execute('CREATE INDEX idx_game_tier_tier ON game_tier(tier_id);')
+
+    before = len(get_partitions(cursor))
+    print(f'Repartitioning game_tier from {before or "no"} partitions into '
+          f'{args.partitions}...')
+    cursor.execute(f'ALTER TABLE game_tier PARTITION BY KEY (username) '
+                   f'PARTITIONS {int(args.partitions)};')
+    cursor.execute('ANALYZE TABLE game_tier;')
+    cursor.fetchall()
+    app.print_success(f'Done in {time.perf_counter() - start:.0f}s.')
+
+# ----------------------------------------------------------------------
+# Workers
+# ----------------------------------------------------------------------
+def init_worker(conn_kwargs):
+    '''
+    Connects to the database once per worker.
+    '''
+    app.conn = app.get_conn(admin=True, **conn_kwargs)
+
+def count_partition(partition):
+    '''
+    Counts the game tiers of one partition into mv_tierlist_tier_counts and
+    mv_game_rank_dist_partial.
+    '''
+    cursor = app.conn.cursor()
+    cursor.execute(f'''INSERT INTO mv_tierlist_tier_counts
+                       SELECT username, tierlist_name, tier_id, COUNT(*)
+                       FROM game_tier PARTITION (`{partition}`)
+                       GROUP BY username, tierlist_name, tier_id;''')
+    cursor.execute(f'''INSERT INTO mv_game_rank_dist_partial
+                       SELECT %s, game_id, tier_id, COUNT(*)
+                       FROM game_tier PARTITION (`{partition}`)
+                       GROUP BY game_id, tier_id;''', (partition,))
+    app.conn.commit()
+    return partition
+
+def count_archive():
+    '''
+    Counts the game tiers of the archived tierlists into
+    mv_tierlist_tier_counts and mv_game_rank_dist_partial, like a partition.
+    '''
+    cursor = app.conn.cursor()
+    cursor.execute('''INSERT INTO mv_tierlist_tier_counts
+                      SELECT username, tierlist_name, tier_id, COUNT(*)
+                      FROM archived_game_tiers
+                      GROUP BY username, tierlist_name, tier_id;''')
+    cursor.execute('''INSERT INTO mv_game_rank_dist_partial
+                      SELECT 'archive', game_id, tier_id, COUNT(*)
+                      FROM archived_game_tiers
+                      GROUP BY game_id, tier_id;''')
+    app.conn.commit()
+    return 'archive'
+
+def backup_partition(task):
+    '''
+    Writes the game tiers of one partition to its backup file in the
+    format of LOAD DATA. Returns the number of game tiers written.
+    '''
+    partition, directory = task
+    app.conn.start_transaction(consistent_snapshot=True, readonly=True)
+    count = 0
+    with open(backup_path(directory, partition), 'w', encoding='utf-8',
+              newline='') as f:
+        # LOAD DATA's default escaping: a backslash before tabs, newlines
+        # and backslashes in the names
+        writer = csv.writer(f, delimiter='\t', quoting=csv.QUOTE_NONE,
+                            escapechar='\\', lineterminator='\n')
+        for row in app.stream_rows(f'''SELECT username, tierlist_name,
+                                           game_id, tier_id
+                                       FROM game_tier
+                                           PARTITION (`{partition}`);'''):
+            writer.writerow(row)
+            count += 1
+    app.conn.commit()
+    return count
+
+def restore_file(path):
+    '''
+    Loads one backup file into game_tier without firing the triggers.
+    '''
+    cursor = app.conn.cursor()
+    cursor.execute('SET unique_checks = 0, @skip_gametier_triggers = 1;')
+    cursor.execute("LOAD DATA LOCAL INFILE %s INTO TABLE game_tier "
+                   "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+                   "(username, tierlist_name, game_id, tier_id);", (path,))
+    app.conn.commit()
+    return path
+
+# ----------------------------------------------------------------------
+# Maintenance Jobs
+# ----------------------------------------------------------------------
+def rebuild_stats(conn, workers):
+    '''
+    Rebuilds every stats materialized view counted from game_tier (what
+    sp_rebuild_game_rank_stats, sp_rebuild_tierlist_stats,
+    sp_rebuild_game_consensus and sp_rebuild_group_rank_stats do), counting
+    one partition per worker. If game_tier isn't partitioned, the procedures
+    are called instead.
+    '''
+    start = time.perf_counter()
+    cursor = conn.cursor()
+    partitions = get_partitions(cursor)
+    if not partitions:
+        cursor.execute('CALL sp_rebuild_game_rank_stats();')
+        cursor.execute('CALL sp_rebuild_tierlist_stats();')
+    else:
+        cursor.execute('DELETE FROM mv_tierlist_tier_counts;')
+        cursor.execute('DELETE FROM mv_game_rank_dist_partial;')
+        conn.commit()
+        with Pool(min(workers, len(partitions)), initializer=init_worker,
+                  initargs=({},)) as pool:
+            archive = pool.apply_async(count_archive)
+            for n, partition in enumerate(
+                    pool.imap_unordered(count_partition, partitions), 1):
+                print(f'Counted partition {partition} '
+                      f'({n}/{len(partitions)}, '
+                      f'{time.perf_counter() - start:.0f}s)')
+            archive.get()
+            print(f'Counted the archived tierlists '
+                  f'({time.perf_counter() - start:.0f}s)')
+        cursor.execute('DELETE FROM mv_game_rank_dist;')
+        cursor.execute('''INSERT INTO mv_game_rank_dist
+                          SELECT game_id, tier_id, SUM(num_ranked)
+                          FROM mv_game_rank_dist_partial
+                          GROUP BY game_id, tier_id;''')
+        cursor.execute('DELETE FROM mv_game_rank_dist_partial;')
+        cursor.execute('CALL sp_rebuild_game_rank_summary();')
+        cursor.execute('CALL sp_rebuild_tierlist_summary();')
+    cursor.execute('CALL sp_rebuild_game_consensus();')
+    cursor.execute('CALL sp_rebuild_group_rank_stats();')
+    conn.commit()
+
+def backup(args):
+    '''
+    Writes every partition of game_tier to a file in args.out.
+    '''
+    start = time.perf_counter()
+    partitions = get_partitions(app.conn.cursor())
+    if not partitions:
+        app.print_err('game_tier is not partitioned. Run repartition first.')
+        sys.exit(1)
+    os.makedirs(args.out, exist_ok=True)
+    total = 0
+    tasks = [(partition, args.out) for partition in partitions]
+    with Pool(min(args.workers, len(partitions)), initializer=init_worker,
+              initargs=({},)) as pool:
+        for n, count in enumerate(pool.imap_unordered(backup_partition,
+                                                      tasks), 1):
+            total += count
+            print(f'Backed up {n}/{len(partitions)} partitions '
+                  f'({total} game tiers, '
+                  f'{time.perf_counter() - start:.0f}s)')
+    app.print_success(f'Done in {time.perf_counter() - start:.0f}s.')
+
+def restore(args):
+    '''
+    Loads the backup files in args.source into an empty game_tier, then
+    rebuilds the stats.
+    '''
+    start = time.perf_counter()
+    paths = sorted(os.path.join(args.source, name)
+                   for name in os.listdir(args.source)
+                   if name.startswith('game_tier.') and name.endswith('.tsv'))
+    if not paths:
+        app.print_err(f'No game_tier backup files in {args.source}.')
+        sys.exit(1)
+    cursor = app.conn.cursor()
+    if args.truncate:
+        cursor.execute('TRUNCATE TABLE game_tier;')
+    else:
+        cursor.execute('SELECT 1 FROM game_tier LIMIT 1;')
+        if cursor.fetchall():
+            app.print_err('Table game_tier is not empty. Use --truncate to '
+                          'replace the existing game tiers.')
+            sys.exit(1)
+
+    with Pool(min(args.workers, len(paths)), initializer=init_worker,
+              initargs=({'allow_local_infile': True},)) as pool:
+        for n, _ in enumerate(pool.imap_unordered(restore_file, paths), 1):
+            print(f'Loaded {n}/{len(paths)} files '
+                  f'({time.perf_counter() - start:.0f}s)')
+    print('Rebuilding stats...')
+    rebuild_stats(app.conn, args.workers)
+    # The load bypassed the change feed, so mirrors must reload the tables
+    mark_resync(cursor)
+    app.conn.commit()
+    app.print_success(f'Done in {time.perf_counter() - start:.0f}s.')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Maintain the partitions of game_tier.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    repartition_parser = subparsers.add_parser(
+        'repartition', help='change the number of partitions (offline)')
+    repartition_parser.add_argument('--partitions', type=int,
+                                    default=DEFAULT_PARTITIONS)
+
+    rebuild_parser = subparsers.add_parser(
+        'rebuild-stats', help='rebuild the stats materialized views')
+    rebuild_parser.add_argument('--workers', type=int, default=cpu_count())
+
+    backup_parser = subparsers.add_parser(
+        'backup', help='write each partition to a file')
+    backup_parser.add_argument('--out', default='backup',
+                               help='directory to write the files to')
+    backup_parser.add_argument('--workers', type=int, default=cpu_count())
+
+    restore_parser = subparsers.add_parser(
+        'restore', help='load the files written by backup')
+    restore_parser.add_argument('--from', dest='source', default='backup',
+                                help='directory to read the files from')
+    restore_parser.add_argument('--workers', type=int, default=cpu_count())
+    restore_parser.add_argument('--truncate', action='store_true',
+                                help='delete the existing game tiers first')
+
+    args = parser.parse_args()
+    app.conn = app.get_conn(admin=True)
+    if args.command == 'repartition':
+        repartition(args)
+    elif args.command == 'rebuild-stats':
+        start = time.perf_counter()
+        rebuild_stats(app.conn, args.workers)
+        app.print_success(f'Done in {time.perf_counter() - start:.0f}s.')
+    elif args.command == 'backup':
+        backup(args)
+    else:
+        restore(args)
+    app.conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -62,6 +62,24 @@ CALL sp_delete_game_tier('testuser', 'testtierlist3', 1);
 -- WHERE username = 'testuser' AND tierlist_name = 'testtierlist3'
 CALL sp_delete_tierlist('testuser', 'testtierlist3');
 
+-- Rename the new tier, keeping its color
+CALL sp_update_tier(8, 'Z', NULL);
+
+-- Move the new tier to rank 1 (the tiers ranked 1 to 7 move down one rank)
+-- and recompute the rank stats, in one transaction
+CALL sp_move_tier(8, 1);
+
+-- Merge the new tier into tier 1: its games move to tier 1 in every
+-- tierlist, it is deleted, and the tiers below it move up one rank
+CALL sp_merge_tier(8, 1);
+
+-- Or delete it, removing its games from every tierlist
+-- CALL sp_delete_tier(8);
+
+-- Merge the test game into game 1 as a duplicate: its rankings move to
+-- game 1 (tierlists that ranked both keep the better tier), and it is deleted
+CALL sp_merge_game(1, 431);
+
 
 
 -- 3. More complex queries
@@ -83,6 +101,14 @@ FROM game_tier JOIN video_game USING (game_id) JOIN tier USING (tier_id)
 WHERE publisher = 'Nintendo'
 GROUP BY platform ORDER BY avg_rank ASC;
 
+-- Average, min, and max rank and number of rankings of every platform,
+-- ordered by rank asc, as shown by the stats dashboard. Read from the
+-- rollup maintained by the game_tier triggers instead of joining game_tier.
+SELECT group_value AS platform, num_ranked, avg_rank, min_rank, max_rank
+FROM group_rank_stats
+WHERE group_type = 'platform'
+ORDER BY avg_rank ASC;
+
 -- RA Expression: For a tierlist named “testtierlist2” by a user named
 -- “testuser”,
 -- return all the names of the games in the tierlist along with their rank
@@ -93,3 +119,78 @@ SELECT game_name, tier_rank, color
 FROM game_tier JOIN video_game USING (game_id) JOIN tier USING (tier_id)
 WHERE username = 'testuser' AND tierlist_name = 'testtierlist2'
 ORDER BY tier_rank ASC;
+
+-- Tierlist browser: tierlists of users whose username starts with 'test',
+-- created in 2023, largest first, with the number of games and top tier
+-- of each. Sizes come from mv_tierlist_stats; the sort is read backwards
+-- from idx_tierlist_stats_size, so there is no filesort.
+SELECT s.username, s.date_created, s.num_games,
+    (SELECT CONCAT(tier_name, ' (', c.num_games, ')')
+     FROM mv_tierlist_tier_counts c JOIN tier USING (tier_id)
+     WHERE c.username = s.username AND c.tierlist_name = s.tierlist_name
+     ORDER BY tier_rank LIMIT 1) AS top_tier,
+    s.tierlist_name
+FROM mv_tierlist_stats s FORCE INDEX FOR ORDER BY (idx_tierlist_stats_size)
+WHERE username LIKE 'test%' AND date_created BETWEEN '2023-01-01' AND '2023-12-31'
+ORDER BY s.num_games DESC, s.username DESC, s.tierlist_name DESC;
+
+-- Reverse lookup: the tierlists that put game 1 in tier 1, one page of 20
+-- at a time. The next page continues after the last row of the previous
+-- one (keyset pagination), read from idx_game_tier_game. The cursor
+-- condition is spelled out column by column so that EXPLAIN shows a range
+-- seek on idx_game_tier_game with all four key parts; MySQL only uses
+-- game_id for a row constructor comparison like
+-- (tier_id, username, tierlist_name) > (...), scanning every earlier page.
+-- The app reads archived_game_index with the same conditions and merges
+-- the two pages, so archived tierlists are found too.
+SELECT tier_id, tier_name, username, tierlist_name
+FROM game_tier JOIN tier USING (tier_id)
+WHERE game_id = 1 AND tier_id = 1
+    AND (tier_id > 1 OR (tier_id = 1 AND (username > 'testuser'
+        OR (username = 'testuser' AND tierlist_name > 'testtierlist'))))
+ORDER BY tier_id, username, tierlist_name
+LIMIT 20;
+
+-- Community consensus tierlist: Nintendo Switch games released in 2017, each
+-- in the tier nearest its median rank. Read from mv_game_consensus through
+-- idx_consensus_platform.
+SELECT game_name, tier_rank, color
+FROM mv_game_consensus c JOIN video_game USING (game_id)
+    JOIN tier ON tier.tier_id = c.median_tier_id
+WHERE c.platform = 'Nintendo Switch' AND c.release_year = 2017
+ORDER BY tier_rank, game_name;
+
+-- Change feed: the next 1000 changes after sequence number 500, with
+-- whether each was written more than a minute ago (a reader stops at a gap
+-- before a change that wasn't).
+SELECT seq, change_type, username, tierlist_name, game_id, tier_id,
+    date_created, changed_at < NOW(6) - INTERVAL 60 SECOND AS settled
+FROM tierlist_change
+WHERE seq > 500
+ORDER BY seq
+LIMIT 1000;
+
+-- Candidate duplicate games: the games sharing a normalized name, found by
+-- grouping on idx_game_name_key rather than comparing every pair of games.
+SELECT name_key, game_id, game_name, platform, release_date
+FROM video_game
+WHERE name_key IN (SELECT name_key FROM video_game
+                   GROUP BY name_key HAVING COUNT(*) > 1)
+ORDER BY name_key, game_id;
+
+-- Archived tierlist: the games of testuser's testtierlist if it was
+-- archived, unpacked from its one row in tierlist_archive (read by primary
+-- key) and ordered like the tierlist view.
+SELECT game_name, tier_rank, color
+FROM archived_game_tiers JOIN video_game USING (game_id)
+    JOIN tier USING (tier_id)
+WHERE username = 'testuser' AND tierlist_name = 'testtierlist'
+ORDER BY tier_rank, game_name;
+
+-- Archive candidates: the next batch of tierlists not modified in 180 days,
+-- oldest first, read from idx_tierlist_archive.
+SELECT username, tierlist_name, modified_at
+FROM tierlist
+WHERE is_archived = 0 AND modified_at < NOW() - INTERVAL 180 DAY
+ORDER BY modified_at
+LIMIT 1000;
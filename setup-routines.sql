@@ -18,6 +18,62 @@ DROP PROCEDURE IF EXISTS sp_gamestat_delgametier;
 DROP TRIGGER IF EXISTS trg_gametier_delete;
 DROP PROCEDURE IF EXISTS sp_gamestat_updategametier;
 DROP TRIGGER IF EXISTS trg_gametier_update;
+DROP PROCEDURE IF EXISTS sp_rebuild_game_rank_stats;
+DROP PROCEDURE IF EXISTS sp_rebuild_game_rank_summary;
+DROP TABLE IF EXISTS mv_tierlist_stats;
+DROP TABLE IF EXISTS mv_tierlist_tier_counts;
+DROP PROCEDURE IF EXISTS sp_rebuild_tierlist_stats;
+DROP PROCEDURE IF EXISTS sp_rebuild_tierlist_summary;
+DROP PROCEDURE IF EXISTS sp_tierliststat_newgametier;
+DROP PROCEDURE IF EXISTS sp_tierliststat_delgametier;
+DROP PROCEDURE IF EXISTS sp_tierliststat_updategametier;
+DROP TRIGGER IF EXISTS trg_tierlist_insert;
+DROP TRIGGER IF EXISTS trg_tierlist_delete;
+DROP TRIGGER IF EXISTS trg_user_info_delete;
+DROP TABLE IF EXISTS tierlist_neighbors;
+DROP TABLE IF EXISTS tierlist_neighbors_new;
+DROP TABLE IF EXISTS tierlist_neighbors_old;
+DROP TABLE IF EXISTS tierlist_similarity_dirty;
+DROP PROCEDURE IF EXISTS sp_similarity_markdirty;
+DROP TABLE IF EXISTS game_related;
+DROP TABLE IF EXISTS game_related_new;
+DROP TABLE IF EXISTS game_related_old;
+DROP TABLE IF EXISTS game_coranking_dirty;
+DROP PROCEDURE IF EXISTS sp_coranking_markdirty;
+DROP TABLE IF EXISTS mv_game_rank_dist;
+DROP TABLE IF EXISTS mv_game_rank_dist_partial;
+DROP TABLE IF EXISTS version_counter;
+DROP PROCEDURE IF EXISTS sp_bump_version;
+DROP FUNCTION IF EXISTS current_version;
+DROP TABLE IF EXISTS mv_game_consensus;
+DROP TABLE IF EXISTS consensus_cache;
+DROP FUNCTION IF EXISTS nearest_tier;
+DROP PROCEDURE IF EXISTS sp_consensus_refreshgame;
+DROP PROCEDURE IF EXISTS sp_rebuild_game_consensus;
+DROP TABLE IF EXISTS mv_group_rank_dist;
+DROP VIEW IF EXISTS group_rank_stats;
+DROP PROCEDURE IF EXISTS sp_groupstat_change;
+DROP PROCEDURE IF EXISTS sp_rebuild_group_rank_stats;
+DROP TABLE IF EXISTS tierlist_change;
+DROP TABLE IF EXISTS change_feed_state;
+DROP PROCEDURE IF EXISTS sp_log_change;
+DROP PROCEDURE IF EXISTS sp_mark_resync;
+DROP PROCEDURE IF EXISTS sp_tiers_changed;
+DROP PROCEDURE IF EXISTS sp_remap_tier;
+DROP PROCEDURE IF EXISTS sp_mark_ranks_dirty;
+DROP PROCEDURE IF EXISTS sp_close_rank;
+DROP PROCEDURE IF EXISTS sp_update_tier;
+DROP PROCEDURE IF EXISTS sp_move_tier;
+DROP PROCEDURE IF EXISTS sp_merge_tier;
+DROP PROCEDURE IF EXISTS sp_delete_tier;
+DROP FUNCTION IF EXISTS game_name_key;
+DROP TRIGGER IF EXISTS trg_video_game_insert;
+DROP TRIGGER IF EXISTS trg_video_game_update;
+DROP PROCEDURE IF EXISTS sp_merge_game;
+DROP VIEW IF EXISTS archived_game_tiers;
+DROP PROCEDURE IF EXISTS sp_rehydrate_tierlists;
+DROP PROCEDURE IF EXISTS sp_rehydrate_tierlist;
+DROP PROCEDURE IF EXISTS sp_archive_tierlists;
 
 -- Checks if the specified username owns a tierlist of the specified
 -- tierlist name in the tierlist table.
@@ -39,27 +95,204 @@ END !
 DELIMITER ;
 
 
+-- Archived tierlists. archive.py moves the game tiers of tierlists that
+-- haven't changed for a while from game_tier to tierlist_archive (see
+-- setup.sql), one row per tierlist, and the first edit of an archived
+-- tierlist moves them back (rehydrates it). The stats materialized views
+-- count archived game tiers like the others, so neither move changes them
+-- and both skip the game_tier triggers; the tierlist's version doesn't
+-- change either, since its contents don't. Both keep archived_game_index,
+-- the archived game tiers by game, in step.
+
+-- The game tiers of the archived tierlists, unpacked. The view is merged
+-- into the queries that use it, so looking up one tierlist reads one row
+-- of tierlist_archive.
+CREATE VIEW archived_game_tiers AS
+    SELECT a.username, a.tierlist_name, g.game_id, g.tier_id
+    FROM tierlist_archive a,
+        JSON_TABLE(a.game_tiers, '$[*]' COLUMNS (
+            game_id BIGINT UNSIGNED PATH '$[0]',
+            tier_id BIGINT UNSIGNED PATH '$[1]')) AS g;
+
+DELIMITER !
+
+-- Moves the game tiers of the tierlists listed in the temporary table
+-- rehydrated_tierlists (username, tierlist_name) from tierlist_archive back
+-- to game_tier, then drops the table. Called inside the transaction of the
+-- caller, which has locked the tierlists or the game tiers being changed.
+CREATE PROCEDURE sp_rehydrate_tierlists()
+BEGIN
+    DECLARE skip_before TINYINT DEFAULT NULL;
+
+    -- the caller may already be skipping the triggers
+    SET skip_before = @skip_gametier_triggers;
+    SET @skip_gametier_triggers = 1;
+    INSERT INTO game_tier
+        SELECT username, tierlist_name, a.game_id, a.tier_id
+        FROM rehydrated_tierlists JOIN archived_game_tiers a
+            USING (username, tierlist_name);
+    SET @skip_gametier_triggers = skip_before;
+
+    -- the index rows are found by primary key from the archived game tiers,
+    -- so they go before the archive rows
+    DELETE i FROM rehydrated_tierlists r
+        JOIN archived_game_tiers a
+            ON a.username = r.username AND a.tierlist_name = r.tierlist_name
+        JOIN archived_game_index i
+            ON i.game_id = a.game_id AND i.tier_id = a.tier_id
+                AND i.username = a.username
+                AND i.tierlist_name = a.tierlist_name;
+    DELETE tierlist_archive FROM tierlist_archive
+        JOIN rehydrated_tierlists USING (username, tierlist_name);
+    UPDATE tierlist JOIN rehydrated_tierlists USING (username, tierlist_name)
+        SET is_archived = 0, modified_at = modified_at;
+    DROP TEMPORARY TABLE rehydrated_tierlists;
+END !
+
+-- Rehydrates one archived tierlist. Called by the first edit of the
+-- tierlist, after it has locked the tierlist.
+CREATE PROCEDURE sp_rehydrate_tierlist(
+    rehydrated_username VARCHAR(20),
+    rehydrated_tierlist_name VARCHAR(50)
+)
+BEGIN
+    DROP TEMPORARY TABLE IF EXISTS rehydrated_tierlists;
+    CREATE TEMPORARY TABLE rehydrated_tierlists (
+        PRIMARY KEY (username, tierlist_name)
+    )
+        SELECT username, tierlist_name FROM tierlist
+        WHERE username = rehydrated_username
+            AND tierlist_name = rehydrated_tierlist_name AND is_archived = 1;
+    CALL sp_rehydrate_tierlists();
+END !
+
+-- Archives up to batch_size of the tierlists not changed since cutoff,
+-- oldest first, in one transaction, and sets num_archived to how many were
+-- archived (0 once there are none left). Run in batches by archive.py.
+CREATE PROCEDURE sp_archive_tierlists(
+    cutoff TIMESTAMP,
+    batch_size INT,
+    OUT num_archived INT
+)
+BEGIN
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        SET @skip_gametier_triggers = NULL;
+        DROP TEMPORARY TABLE IF EXISTS archived_tierlists;
+        RESIGNAL;
+    END;
+
+    START TRANSACTION;
+    -- Read from idx_tierlist_archive. Reading the tierlists to copy them
+    -- takes shared locks on them, so they can't be edited until the batch
+    -- commits, and a tierlist being edited is only read once its edit
+    -- commits (by then it no longer matches).
+    DROP TEMPORARY TABLE IF EXISTS archived_tierlists;
+    CREATE TEMPORARY TABLE archived_tierlists (
+        PRIMARY KEY (username, tierlist_name)
+    )
+        SELECT username, tierlist_name FROM tierlist
+        WHERE is_archived = 0 AND modified_at < cutoff
+        ORDER BY modified_at
+        LIMIT batch_size;
+
+    -- each tierlist's game tiers are read by primary key; a tierlist
+    -- without games is archived as an empty array
+    INSERT INTO tierlist_archive (username, tierlist_name, game_tiers)
+        SELECT username, tierlist_name,
+            IF(COUNT(g.game_id) = 0, JSON_ARRAY(),
+               JSON_ARRAYAGG(JSON_ARRAY(g.game_id, g.tier_id)))
+        FROM archived_tierlists LEFT JOIN game_tier g
+            USING (username, tierlist_name)
+        GROUP BY username, tierlist_name;
+    INSERT INTO archived_game_index
+        SELECT g.game_id, g.tier_id, username, tierlist_name
+        FROM archived_tierlists JOIN game_tier g
+            USING (username, tierlist_name);
+    SET @skip_gametier_triggers = 1;
+    DELETE game_tier FROM game_tier
+        JOIN archived_tierlists USING (username, tierlist_name);
+    SET @skip_gametier_triggers = NULL;
+    UPDATE tierlist JOIN archived_tierlists USING (username, tierlist_name)
+        SET is_archived = 1, modified_at = modified_at;
+
+    SELECT COUNT(*) FROM archived_tierlists INTO num_archived;
+    DROP TEMPORARY TABLE archived_tierlists;
+    COMMIT;
+END !
+DELIMITER ;
+
+
 
 -- Client procedures
--- Inserts (or updates on duplicate key) a new game tier into game_tier
+-- Inserts (or updates on duplicate key) a new game tier into game_tier,
+-- and gives the tierlist a new version. game_tier is partitioned, so it has
+-- no foreign keys; the tierlist, game and tier are checked here instead,
+-- and locked like a foreign key check would so that none of them can be
+-- deleted before the game tier is committed. An archived tierlist is
+-- rehydrated first.
 DELIMITER !
-CREATE PROCEDURE sp_update_game_tier(username VARCHAR(20),
-                  tierlist_name VARCHAR(50),game_id BIGINT UNSIGNED,
+CREATE PROCEDURE sp_update_game_tier(input_username VARCHAR(20),
+                  input_tierlist_name VARCHAR(50),
+                  input_game_id BIGINT UNSIGNED,
                   new_tier_id BIGINT UNSIGNED)
 BEGIN
+    DECLARE tierlist_found INT DEFAULT 0;
+    DECLARE tierlist_archived TINYINT DEFAULT 0;
+    DECLARE game_found INT DEFAULT 0;
+    DECLARE tier_found INT DEFAULT 0;
+
+    -- Everything is checked before anything is written, so a failed check
+    -- leaves nothing for the caller to roll back but the locks. The game
+    -- and tier are locked first, like the tier and game merges do, then
+    -- the tierlist before its game tiers, like in sp_delete_game_tier and
+    -- trg_tierlist_delete, so edits of the same tierlist queue up instead
+    -- of deadlocking.
+    SELECT COUNT(*) FROM video_game WHERE game_id = input_game_id
+        FOR SHARE INTO game_found;
+    SELECT COUNT(*) FROM tier WHERE tier_id = new_tier_id
+        FOR SHARE INTO tier_found;
+    SELECT COUNT(*), COALESCE(MAX(is_archived), 0) FROM tierlist
+        WHERE username = input_username
+            AND tierlist_name = input_tierlist_name
+        FOR UPDATE INTO tierlist_found, tierlist_archived;
+    IF tierlist_found = 0 OR game_found = 0 OR tier_found = 0 THEN
+        SIGNAL SQLSTATE '23000'
+            SET MESSAGE_TEXT = 'The tierlist, game or tier does not exist';
+    END IF;
+
+    IF tierlist_archived = 1 THEN
+        CALL sp_rehydrate_tierlist(input_username, input_tierlist_name);
+    END IF;
+    UPDATE tierlist SET version = UUID_SHORT()
+        WHERE username = input_username
+            AND tierlist_name = input_tierlist_name;
     INSERT INTO game_tier VALUES
-        (username, tierlist_name, game_id, new_tier_id)
+        (input_username, input_tierlist_name, input_game_id, new_tier_id)
     ON DUPLICATE KEY UPDATE
         tier_id = new_tier_id;
 END !
 DELIMITER ;
 
 
--- Deletes a game tier from game_tier
+-- Deletes a game tier from game_tier, and gives the tierlist a new version.
+-- An archived tierlist is rehydrated first.
 DELIMITER !
 CREATE PROCEDURE sp_delete_game_tier(old_username VARCHAR(20),
                 old_tierlist_name VARCHAR(50), old_game_id BIGINT UNSIGNED)
 BEGIN
+    DECLARE tierlist_archived TINYINT DEFAULT 0;
+
+    SELECT COALESCE(MAX(is_archived), 0) FROM tierlist
+        WHERE username = old_username AND tierlist_name = old_tierlist_name
+        FOR UPDATE INTO tierlist_archived;
+    IF tierlist_archived = 1 THEN
+        CALL sp_rehydrate_tierlist(old_username, old_tierlist_name);
+    END IF;
+    UPDATE tierlist SET version = UUID_SHORT()
+        WHERE username = old_username AND tierlist_name = old_tierlist_name;
+
     DELETE FROM game_tier
         WHERE username = old_username AND tierlist_name = old_tierlist_name AND
         game_id = old_game_id;
@@ -72,16 +305,18 @@ DELIMITER !
 CREATE PROCEDURE sp_insert_tierlist(username VARCHAR(20),
                     tierlist_name VARCHAR(50))
 BEGIN
-    INSERT INTO tierlist VALUES
+    INSERT INTO tierlist (username, tierlist_name, date_created) VALUES
         (username, tierlist_name, CURDATE());
 END !
 DELIMITER ;
 
--- Deletes a tierlist
+-- Deletes a tierlist. Its version goes with it, and since versions never
+-- repeat, no cached copy of it can be used again.
 DELIMITER !
 CREATE PROCEDURE sp_delete_tierlist(old_username VARCHAR(20),
                     old_tierlist_name VARCHAR(50))
 BEGIN
+    -- trg_tierlist_delete deletes the tierlist's game tiers
     DELETE FROM tierlist
         WHERE username = old_username AND tierlist_name = old_tierlist_name;
 END !
@@ -95,6 +330,10 @@ CREATE PROCEDURE sp_insert_tier(tier_rank SMALLINT,
 BEGIN
     INSERT INTO tier(tier_rank, tier_name, color) VALUES
         (tier_rank, tier_name, color);
+    -- games may now be nearest to the new tier
+    CALL sp_rebuild_game_consensus();
+    -- every rendered tierlist now has another row
+    CALL sp_bump_version('tier', 0);
 END !
 DELIMITER ;
 
@@ -132,13 +371,66 @@ CREATE TABLE mv_game_rank_stats (
     PRIMARY KEY (game_id)
 );
 
+-- Materialized view for the number of times each game has been ranked in
+-- each tier, used to find the median rank of a game.
+CREATE TABLE mv_game_rank_dist (
+    game_id BIGINT UNSIGNED,
+    tier_id BIGINT UNSIGNED,
+    num_ranked INT NOT NULL,
+    PRIMARY KEY (game_id, tier_id)
+);
+
+-- The counts of mv_game_rank_dist in each partition of game_tier, written
+-- in parallel by the stats rebuild of partitions.py and then summed into
+-- mv_game_rank_dist. Empty otherwise.
+CREATE TABLE mv_game_rank_dist_partial (
+    partition_name VARCHAR(64),
+    game_id BIGINT UNSIGNED,
+    tier_id BIGINT UNSIGNED,
+    num_ranked INT NOT NULL,
+    PRIMARY KEY (partition_name, game_id, tier_id)
+);
+
+DELIMITER !
+
+-- Rebuilds mv_game_rank_stats from mv_game_rank_dist.
+CREATE PROCEDURE sp_rebuild_game_rank_summary()
+BEGIN
+    DELETE FROM mv_game_rank_stats;
+    INSERT INTO mv_game_rank_stats
+        SELECT game_id, SUM(num_ranked), SUM(num_ranked * tier_rank),
+            MIN(tier_rank), MAX(tier_rank)
+        FROM mv_game_rank_dist JOIN tier USING (tier_id)
+        GROUP BY game_id;
+END !
+
+-- Rebuilds the game rank stats materialized views (mv_game_rank_stats and
+-- mv_game_rank_dist) from scratch with a grouped pass over game_tier and
+-- one over the archived game tiers. Used to set up the views and after
+-- bulk loads, which skip the per-row triggers below by setting
+-- @skip_gametier_triggers = 1. partitions.py does the same passes one
+-- partition per worker.
+CREATE PROCEDURE sp_rebuild_game_rank_stats()
+BEGIN
+    DELETE FROM mv_game_rank_dist;
+    INSERT INTO mv_game_rank_dist
+        SELECT game_id, tier_id, COUNT(*)
+        FROM game_tier
+        GROUP BY game_id, tier_id;
+    INSERT INTO mv_game_rank_dist
+        SELECT * FROM (
+            SELECT game_id, tier_id, COUNT(*) AS num_ranked
+            FROM archived_game_tiers
+            GROUP BY game_id, tier_id
+        ) AS archived
+    ON DUPLICATE KEY UPDATE
+        num_ranked = mv_game_rank_dist.num_ranked + archived.num_ranked;
+    CALL sp_rebuild_game_rank_summary();
+END !
+DELIMITER ;
 
 -- Set up the materialized view
-INSERT INTO mv_game_rank_stats
-    SELECT game_id, COUNT(tier_rank), SUM(tier_rank), MIN(tier_rank),
-        MAX(tier_rank)
-    FROM game_tier JOIN tier USING (tier_id)
-    GROUP BY game_id;
+CALL sp_rebuild_game_rank_stats();
 
 
 -- Create the view based on the materialized view
@@ -179,13 +471,29 @@ BEGIN
         sum_rank = sum_rank + new_tier_rank,
         min_rank = LEAST(min_rank, new_tier_rank),
         max_rank = GREATEST(max_rank, new_tier_rank);
+
+    INSERT INTO mv_game_rank_dist VALUES (new_game_id, new_tier_id, 1)
+    ON DUPLICATE KEY UPDATE
+        num_ranked = num_ranked + 1;
+
+    CALL sp_groupstat_change(new_game_id, new_tier_id, 1);
 END !
 
 -- Handles new rows added to game_tier table, updates stats accordingly
 CREATE TRIGGER trg_gametier_insert AFTER INSERT
        ON game_tier FOR EACH ROW
 BEGIN
-    CALL sp_gamestat_newgametier(NEW.game_id, NEW.tier_id);
+    IF COALESCE(@skip_gametier_triggers, 0) = 0 THEN
+        CALL sp_gamestat_newgametier(NEW.game_id, NEW.tier_id);
+        CALL sp_tierliststat_newgametier(NEW.username, NEW.tierlist_name,
+                                         NEW.tier_id);
+        CALL sp_similarity_markdirty(NEW.username, NEW.tierlist_name);
+        CALL sp_coranking_markdirty(NEW.game_id);
+        CALL sp_consensus_refreshgame(NEW.game_id);
+        CALL sp_bump_version('game_rank_stats', NEW.game_id);
+        CALL sp_log_change('game_tier_upsert', NEW.username, NEW.tierlist_name,
+                           NEW.game_id, NEW.tier_id, NULL);
+    END IF;
 END !
 DELIMITER ;
 
@@ -202,23 +510,36 @@ CREATE PROCEDURE sp_gamestat_delgametier(
     old_tier_id BIGINT UNSIGNED
 )
 BEGIN
+    DECLARE num_left INT DEFAULT NULL;
     DECLARE new_min_rank SMALLINT DEFAULT NULL;
     DECLARE new_max_rank SMALLINT DEFAULT NULL;
     DECLARE old_tier_rank SMALLINT DEFAULT NULL;
 
-    -- Check if the game tier was the last one in the game (since after
-    -- row trigger, should be deleted from game_tier already). If so,
+    UPDATE mv_game_rank_dist
+        SET num_ranked = num_ranked - 1
+        WHERE game_id = old_game_id AND tier_id = old_tier_id;
+    DELETE FROM mv_game_rank_dist
+        WHERE game_id = old_game_id AND tier_id = old_tier_id
+            AND num_ranked = 0;
+
+    CALL sp_groupstat_change(old_game_id, old_tier_id, -1);
+
+    -- The game's remaining ranks are read from mv_game_rank_dist (already
+    -- updated above) rather than game_tier, whose game_id index would have
+    -- to be searched in every partition.
+    SELECT SUM(num_ranked), MIN(tier_rank), MAX(tier_rank)
+        FROM mv_game_rank_dist JOIN tier USING (tier_id)
+        WHERE game_id = old_game_id
+        INTO num_left, new_min_rank, new_max_rank;
+
+    -- Check if the game tier was the last one in the game. If so,
     -- delete the game from the MV.
-    IF old_game_id NOT IN (SELECT DISTINCT game_id FROM game_tier) THEN
+    IF num_left IS NULL THEN
         DELETE FROM mv_game_rank_stats
             WHERE game_id = old_game_id;
     ELSE
-        -- If game tier is not the last one in the game, update the stats.
-        -- Find the new min and max rank for that game.
-        SELECT min(tier_rank), max(tier_rank)
-            FROM game_tier JOIN tier USING(tier_id)
-            WHERE game_id = old_game_id INTO new_min_rank, new_max_rank;
-
+        -- If game tier is not the last one in the game, update the stats
+        -- with the new min and max rank for that game.
         SELECT tier_rank
             FROM tier
             WHERE tier_id = old_tier_id INTO old_tier_rank;
@@ -237,7 +558,17 @@ END !
 CREATE TRIGGER trg_gametier_delete AFTER DELETE
        ON game_tier FOR EACH ROW
 BEGIN
-    CALL sp_gamestat_delgametier(OLD.game_id, OLD.tier_id);
+    IF COALESCE(@skip_gametier_triggers, 0) = 0 THEN
+        CALL sp_gamestat_delgametier(OLD.game_id, OLD.tier_id);
+        CALL sp_tierliststat_delgametier(OLD.username, OLD.tierlist_name,
+                                         OLD.tier_id);
+        CALL sp_similarity_markdirty(OLD.username, OLD.tierlist_name);
+        CALL sp_coranking_markdirty(OLD.game_id);
+        CALL sp_consensus_refreshgame(OLD.game_id);
+        CALL sp_bump_version('game_rank_stats', OLD.game_id);
+        CALL sp_log_change('game_tier_delete', OLD.username, OLD.tierlist_name,
+                           OLD.game_id, NULL, NULL);
+    END IF;
 END !
 DELIMITER ;
 
@@ -264,7 +595,1151 @@ END !
 CREATE TRIGGER trg_gametier_update AFTER UPDATE
        ON game_tier FOR EACH ROW
 BEGIN
-    CALL sp_gamestat_updategametier(OLD.game_id, OLD.tier_id,
-                                  NEW.game_id, NEW.tier_id);
+    IF COALESCE(@skip_gametier_triggers, 0) = 0 THEN
+        CALL sp_gamestat_updategametier(OLD.game_id, OLD.tier_id,
+                                      NEW.game_id, NEW.tier_id);
+        CALL sp_tierliststat_updategametier(OLD.username, OLD.tierlist_name,
+                                            OLD.tier_id, NEW.tier_id);
+        CALL sp_similarity_markdirty(NEW.username, NEW.tierlist_name);
+        CALL sp_coranking_markdirty(NEW.game_id);
+        CALL sp_consensus_refreshgame(NEW.game_id);
+        CALL sp_bump_version('game_rank_stats', NEW.game_id);
+        CALL sp_log_change('game_tier_upsert', NEW.username, NEW.tierlist_name,
+                           NEW.game_id, NEW.tier_id, NULL);
+    END IF;
 END !
 DELIMITER ;
+
+
+-- Materialized view for the size of each tierlist, so that the tierlist
+-- browser can show and sort by the number of games in each tierlist without
+-- counting game_tier rows.
+CREATE TABLE mv_tierlist_stats (
+    username VARCHAR(20),
+    tierlist_name VARCHAR(50),
+    -- copy of tierlist.date_created, so that sorting by date is served by
+    -- an index on this table
+    date_created DATE NOT NULL,
+    -- number of games in the tierlist
+    num_games INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, tierlist_name),
+    -- InnoDB appends the primary key to secondary indexes, so these serve
+    -- ORDER BY date_created/num_games, username, tierlist_name
+    INDEX idx_tierlist_stats_date (date_created),
+    INDEX idx_tierlist_stats_size (num_games)
+);
+
+-- Materialized view for the number of games in each tier of each tierlist,
+-- used to summarize the top tier of a tierlist.
+CREATE TABLE mv_tierlist_tier_counts (
+    username VARCHAR(20),
+    tierlist_name VARCHAR(50),
+    tier_id BIGINT UNSIGNED,
+    num_games INT NOT NULL,
+    PRIMARY KEY (username, tierlist_name, tier_id)
+);
+
+
+DELIMITER !
+
+-- Rebuilds mv_tierlist_stats from mv_tierlist_tier_counts.
+CREATE PROCEDURE sp_rebuild_tierlist_summary()
+BEGIN
+    DELETE FROM mv_tierlist_stats;
+    INSERT INTO mv_tierlist_stats
+        SELECT username, tierlist_name, date_created,
+            COALESCE(SUM(num_games), 0)
+        FROM tierlist LEFT JOIN mv_tierlist_tier_counts
+            USING (username, tierlist_name)
+        GROUP BY username, tierlist_name, date_created;
+END !
+
+-- Rebuilds the tierlist stats materialized views (mv_tierlist_stats and
+-- mv_tierlist_tier_counts) with one grouped pass over game_tier and one
+-- over the archived game tiers (a tierlist is in one or the other). Used
+-- to set up the views and after bulk loads. partitions.py does the same
+-- passes one partition per worker.
+CREATE PROCEDURE sp_rebuild_tierlist_stats()
+BEGIN
+    DELETE FROM mv_tierlist_tier_counts;
+    INSERT INTO mv_tierlist_tier_counts
+        SELECT username, tierlist_name, tier_id, COUNT(*)
+        FROM game_tier
+        GROUP BY username, tierlist_name, tier_id;
+    INSERT INTO mv_tierlist_tier_counts
+        SELECT username, tierlist_name, tier_id, COUNT(*)
+        FROM archived_game_tiers
+        GROUP BY username, tierlist_name, tier_id;
+    CALL sp_rebuild_tierlist_summary();
+END !
+
+-- A procedure to execute when inserting a new game tier, to add the game
+-- to the tierlist's count and the count of its tier.
+CREATE PROCEDURE sp_tierliststat_newgametier(
+    new_username VARCHAR(20),
+    new_tierlist_name VARCHAR(50),
+    new_tier_id BIGINT UNSIGNED
+)
+BEGIN
+    UPDATE mv_tierlist_stats
+        SET num_games = num_games + 1
+        WHERE username = new_username AND tierlist_name = new_tierlist_name;
+
+    INSERT INTO mv_tierlist_tier_counts
+        VALUES (new_username, new_tierlist_name, new_tier_id, 1)
+    ON DUPLICATE KEY UPDATE
+        num_games = num_games + 1;
+END !
+
+-- A procedure to execute when deleting a game tier, to remove the game
+-- from the tierlist's count and the count of its tier. Tiers that become
+-- empty are removed from mv_tierlist_tier_counts.
+CREATE PROCEDURE sp_tierliststat_delgametier(
+    old_username VARCHAR(20),
+    old_tierlist_name VARCHAR(50),
+    old_tier_id BIGINT UNSIGNED
+)
+BEGIN
+    UPDATE mv_tierlist_stats
+        SET num_games = num_games - 1
+        WHERE username = old_username AND tierlist_name = old_tierlist_name;
+
+    UPDATE mv_tierlist_tier_counts
+        SET num_games = num_games - 1
+        WHERE username = old_username AND tierlist_name = old_tierlist_name
+            AND tier_id = old_tier_id;
+    DELETE FROM mv_tierlist_tier_counts
+        WHERE username = old_username AND tierlist_name = old_tierlist_name
+            AND tier_id = old_tier_id AND num_games = 0;
+END !
+
+-- A procedure to execute when a game is moved to another tier. The size of
+-- the tierlist is unchanged, only the tier counts move.
+CREATE PROCEDURE sp_tierliststat_updategametier(
+    old_username VARCHAR(20),
+    old_tierlist_name VARCHAR(50),
+    old_tier_id BIGINT UNSIGNED,
+    new_tier_id BIGINT UNSIGNED
+)
+BEGIN
+    IF old_tier_id <> new_tier_id THEN
+        CALL sp_tierliststat_delgametier(old_username, old_tierlist_name,
+                                         old_tier_id);
+        CALL sp_tierliststat_newgametier(old_username, old_tierlist_name,
+                                         new_tier_id);
+    END IF;
+END !
+
+-- Handles new tierlists, adds an empty entry for them in the stats.
+-- Bulk loads skip this trigger too and rebuild the stats afterwards.
+CREATE TRIGGER trg_tierlist_insert AFTER INSERT
+       ON tierlist FOR EACH ROW
+BEGIN
+    IF COALESCE(@skip_gametier_triggers, 0) = 0 THEN
+        INSERT INTO mv_tierlist_stats
+            VALUES (NEW.username, NEW.tierlist_name, NEW.date_created, 0);
+        CALL sp_log_change('tierlist_create', NEW.username, NEW.tierlist_name,
+                           NULL, NULL, NEW.date_created);
+    END IF;
+END !
+
+-- Handles deleted tierlists. game_tier is partitioned and has no foreign
+-- key to cascade the delete, so the tierlist's game tiers are deleted here
+-- (one partition), firing the game_tier triggers so that the stats and the
+-- change feed see every deleted game tier. The game tiers of an archived
+-- tierlist are moved back to game_tier first (a trigger on tierlist can't
+-- call sp_rehydrate_tierlist, which updates tierlist). The tierlist's stats
+-- are removed too.
+CREATE TRIGGER trg_tierlist_delete AFTER DELETE
+       ON tierlist FOR EACH ROW
+BEGIN
+    DECLARE skip_before TINYINT DEFAULT NULL;
+
+    IF OLD.is_archived = 1 THEN
+        SET skip_before = @skip_gametier_triggers;
+        SET @skip_gametier_triggers = 1;
+        INSERT INTO game_tier
+            SELECT username, tierlist_name, game_id, tier_id
+            FROM archived_game_tiers
+            WHERE username = OLD.username
+                AND tierlist_name = OLD.tierlist_name;
+        SET @skip_gametier_triggers = skip_before;
+        DELETE i FROM archived_game_tiers a
+            JOIN archived_game_index i
+                ON i.game_id = a.game_id AND i.tier_id = a.tier_id
+                    AND i.username = a.username
+                    AND i.tierlist_name = a.tierlist_name
+            WHERE a.username = OLD.username
+                AND a.tierlist_name = OLD.tierlist_name;
+        DELETE FROM tierlist_archive
+            WHERE username = OLD.username
+                AND tierlist_name = OLD.tierlist_name;
+    END IF;
+    DELETE FROM game_tier
+        WHERE username = OLD.username AND tierlist_name = OLD.tierlist_name;
+    IF COALESCE(@skip_gametier_triggers, 0) = 0 THEN
+        DELETE FROM mv_tierlist_stats
+            WHERE username = OLD.username
+                AND tierlist_name = OLD.tierlist_name;
+        DELETE FROM mv_tierlist_tier_counts
+            WHERE username = OLD.username
+                AND tierlist_name = OLD.tierlist_name;
+        -- similarity.py drops the tierlist from other tierlists' neighbors
+        DELETE FROM tierlist_neighbors
+            WHERE username = OLD.username
+                AND tierlist_name = OLD.tierlist_name;
+        CALL sp_similarity_markdirty(OLD.username, OLD.tierlist_name);
+        CALL sp_log_change('tierlist_delete', OLD.username,
+                           OLD.tierlist_name, NULL, NULL, NULL);
+    END IF;
+END !
+
+-- Deletes a user's tierlists before the user. Rows deleted by a foreign key
+-- cascade don't fire triggers, so leaving them to the cascade from
+-- user_info would skip trg_tierlist_delete and orphan the tierlists' game
+-- tiers, archive rows and stats; by the time the cascade runs there is
+-- nothing left for it to delete.
+CREATE TRIGGER trg_user_info_delete BEFORE DELETE
+       ON user_info FOR EACH ROW
+BEGIN
+    DELETE FROM tierlist WHERE username = OLD.username;
+END !
+DELIMITER ;
+
+-- Set up the tierlist stats materialized views
+CALL sp_rebuild_tierlist_stats();
+
+
+-- The most similar tierlists of other users for each tierlist ("tierlists
+-- like this"). Computed in batch by similarity.py, not by routines.
+CREATE TABLE tierlist_neighbors (
+    username VARCHAR(20),
+    tierlist_name VARCHAR(50),
+    -- 1 for the most similar tierlist
+    neighbor_rank SMALLINT,
+    neighbor_username VARCHAR(20) NOT NULL,
+    neighbor_tierlist_name VARCHAR(50) NOT NULL,
+    -- cosine similarity of the two tierlists' rankings
+    similarity FLOAT NOT NULL,
+    PRIMARY KEY (username, tierlist_name, neighbor_rank)
+);
+
+-- Tierlists changed since similarity.py last ran, so that it only has to
+-- update their neighbors.
+CREATE TABLE tierlist_similarity_dirty (
+    username VARCHAR(20),
+    tierlist_name VARCHAR(50),
+    -- when the tierlist last changed; similarity.py only clears the mark if
+    -- the tierlist hasn't changed again while it was running
+    marked_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    PRIMARY KEY (username, tierlist_name)
+);
+
+
+DELIMITER !
+
+-- Marks a tierlist as changed for similarity.py.
+CREATE PROCEDURE sp_similarity_markdirty(
+    changed_username VARCHAR(20),
+    changed_tierlist_name VARCHAR(50)
+)
+BEGIN
+    INSERT INTO tierlist_similarity_dirty
+        VALUES (changed_username, changed_tierlist_name, NOW(6))
+    ON DUPLICATE KEY UPDATE
+        marked_at = NOW(6);
+END !
+DELIMITER ;
+
+
+-- The games most often ranked in the same or an adjacent tier as each game
+-- ("players who ranked X also ranked Y"). Computed in batch by
+-- coranking.py, not by routines.
+CREATE TABLE game_related (
+    game_id BIGINT UNSIGNED,
+    -- 1 for the most related game
+    related_rank SMALLINT,
+    related_game_id BIGINT UNSIGNED NOT NULL,
+    -- number of tierlists with both games in the same or adjacent tiers
+    num_coranked INT NOT NULL,
+    -- number of tierlists with both games
+    num_cooccur INT NOT NULL,
+    PRIMARY KEY (game_id, related_rank),
+    -- to find the games a changed game is related to
+    INDEX idx_game_related_related (related_game_id)
+);
+
+-- Games whose rankings changed since coranking.py last ran.
+CREATE TABLE game_coranking_dirty (
+    game_id BIGINT UNSIGNED PRIMARY KEY,
+    -- when the game's rankings last changed; coranking.py only clears the
+    -- mark if they haven't changed again while it was running
+    marked_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+);
+
+
+DELIMITER !
+
+-- Marks a game's rankings as changed for coranking.py.
+CREATE PROCEDURE sp_coranking_markdirty(changed_game_id BIGINT UNSIGNED)
+BEGIN
+    INSERT INTO game_coranking_dirty VALUES (changed_game_id, NOW(6))
+    ON DUPLICATE KEY UPDATE
+        marked_at = NOW(6);
+END !
+DELIMITER ;
+
+
+-- Version counters, bumped whenever the data they count changes so that
+-- caches of derived results know when they are stale. Each counter is
+-- split into shards that writers pick by key, so concurrent writers rarely
+-- update the same row; the version is the sum of the shards.
+CREATE TABLE version_counter (
+    counter_name VARCHAR(30),
+    shard TINYINT UNSIGNED,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    PRIMARY KEY (counter_name, shard)
+);
+
+
+DELIMITER !
+
+-- Bumps the given counter, in the shard of the given key.
+CREATE PROCEDURE sp_bump_version(bumped_counter_name VARCHAR(30),
+                                 shard_key BIGINT UNSIGNED)
+BEGIN
+    INSERT INTO version_counter VALUES (bumped_counter_name, shard_key % 64, 1)
+    ON DUPLICATE KEY UPDATE
+        version = version + 1;
+END !
+
+-- Returns the current version of the given counter.
+CREATE FUNCTION current_version(input_counter_name VARCHAR(30))
+RETURNS BIGINT UNSIGNED READS SQL DATA
+BEGIN
+    DECLARE counter_version BIGINT UNSIGNED DEFAULT 0;
+
+    SELECT COALESCE(SUM(version), 0) FROM version_counter
+        WHERE counter_name = input_counter_name
+        INTO counter_version;
+
+    RETURN counter_version;
+END !
+DELIMITER ;
+
+
+-- The community consensus tier of every ranked game under each way of
+-- aggregating its ranks, with the game's platform and release year so that
+-- filtered consensus tierlists are read from an index. Maintained by the
+-- game_tier triggers.
+CREATE TABLE mv_game_consensus (
+    game_id BIGINT UNSIGNED PRIMARY KEY,
+    platform VARCHAR(50) NOT NULL,
+    release_year SMALLINT NOT NULL,
+    -- tier nearest the mean rank
+    mean_tier_id BIGINT UNSIGNED NOT NULL,
+    -- tier nearest the median rank
+    median_tier_id BIGINT UNSIGNED NOT NULL,
+    -- tier nearest the mean rank weighted towards the middle tier for games
+    -- ranked only a few times (a Bayesian average with 5 votes for the
+    -- middle tier)
+    weighted_tier_id BIGINT UNSIGNED NOT NULL,
+    INDEX idx_consensus_platform (platform),
+    INDEX idx_consensus_year (release_year)
+);
+
+-- Rendered consensus tierlists, valid while the game_rank_stats version
+-- they were rendered at is current. An empty platform and release year 0
+-- mean no filter.
+CREATE TABLE consensus_cache (
+    method VARCHAR(10),
+    platform VARCHAR(50),
+    release_year SMALLINT,
+    stats_version BIGINT UNSIGNED NOT NULL,
+    rendered MEDIUMTEXT NOT NULL,
+    PRIMARY KEY (method, platform, release_year)
+);
+
+
+DELIMITER !
+
+-- Returns the tier whose rank is nearest the given aggregate rank, the
+-- better tier on ties.
+CREATE FUNCTION nearest_tier(agg_rank DECIMAL(10, 4))
+RETURNS BIGINT UNSIGNED READS SQL DATA
+BEGIN
+    DECLARE nearest_tier_id BIGINT UNSIGNED DEFAULT NULL;
+
+    SELECT tier_id FROM tier
+        ORDER BY ABS(tier_rank - agg_rank), tier_rank LIMIT 1
+        INTO nearest_tier_id;
+
+    RETURN nearest_tier_id;
+END !
+
+-- Recomputes the consensus tiers of one game from its rank stats, after
+-- the game was ranked, moved or unranked.
+CREATE PROCEDURE sp_consensus_refreshgame(changed_game_id BIGINT UNSIGNED)
+BEGIN
+    DECLARE game_num_ranked INT DEFAULT NULL;
+    DECLARE game_sum_rank INT DEFAULT NULL;
+    DECLARE game_median_rank DECIMAL(10, 4) DEFAULT NULL;
+    DECLARE prior_rank DECIMAL(10, 4) DEFAULT NULL;
+
+    SELECT num_ranked, sum_rank FROM mv_game_rank_stats
+        WHERE game_id = changed_game_id INTO game_num_ranked, game_sum_rank;
+
+    IF game_num_ranked IS NULL THEN
+        DELETE FROM mv_game_consensus WHERE game_id = changed_game_id;
+    ELSE
+        -- The median is the mean of the two middle ranks (the same rank if
+        -- num_ranked is odd), found from the cumulative counts per tier.
+        SELECT (MIN(IF(cum_ranked >= (game_num_ranked + 1) DIV 2,
+                       tier_rank, NULL))
+                + MIN(IF(cum_ranked >= game_num_ranked DIV 2 + 1,
+                         tier_rank, NULL))) / 2
+            FROM (SELECT tier_rank,
+                      SUM(num_ranked) OVER (ORDER BY tier_rank) AS cum_ranked
+                  FROM mv_game_rank_dist JOIN tier USING (tier_id)
+                  WHERE game_id = changed_game_id) AS dist
+            INTO game_median_rank;
+
+        SELECT (MIN(tier_rank) + MAX(tier_rank)) / 2 FROM tier
+            INTO prior_rank;
+
+        REPLACE INTO mv_game_consensus
+            SELECT game_id, platform, YEAR(release_date),
+                nearest_tier(game_sum_rank / game_num_ranked),
+                nearest_tier(game_median_rank),
+                nearest_tier((game_sum_rank + 5 * prior_rank)
+                             / (game_num_ranked + 5))
+            FROM video_game WHERE game_id = changed_game_id;
+    END IF;
+END !
+
+-- Rebuilds the consensus tiers of every game with one pass over the rank
+-- stats. Used to set up the view, after bulk loads and after tier changes.
+CREATE PROCEDURE sp_rebuild_game_consensus()
+BEGIN
+    DECLARE prior_rank DECIMAL(10, 4) DEFAULT NULL;
+
+    SELECT (MIN(tier_rank) + MAX(tier_rank)) / 2 FROM tier
+        INTO prior_rank;
+
+    DELETE FROM mv_game_consensus;
+    INSERT INTO mv_game_consensus
+        SELECT game_id, platform, YEAR(release_date),
+            nearest_tier(sum_rank / num_ranked),
+            nearest_tier(median_rank),
+            nearest_tier((sum_rank + 5 * prior_rank) / (num_ranked + 5))
+        FROM mv_game_rank_stats
+            JOIN video_game USING (game_id)
+            JOIN (SELECT game_id,
+                      (MIN(IF(cum_ranked >= (total_ranked + 1) DIV 2,
+                              tier_rank, NULL))
+                       + MIN(IF(cum_ranked >= total_ranked DIV 2 + 1,
+                                tier_rank, NULL))) / 2 AS median_rank
+                  FROM (SELECT game_id, tier_rank,
+                            SUM(num_ranked) OVER (PARTITION BY game_id
+                                                  ORDER BY tier_rank)
+                                AS cum_ranked,
+                            SUM(num_ranked) OVER (PARTITION BY game_id)
+                                AS total_ranked
+                        FROM mv_game_rank_dist JOIN tier USING (tier_id))
+                      AS dist
+                  GROUP BY game_id) AS medians USING (game_id);
+
+    CALL sp_bump_version('game_rank_stats', 0);
+END !
+DELIMITER ;
+
+-- Set up the consensus view
+CALL sp_rebuild_game_consensus();
+
+
+-- Rollup of the rank stats by platform, publisher, developer and release
+-- year: the number of times games of each group have been ranked in each
+-- tier. Maintained by sp_gamestat_newgametier and sp_gamestat_delgametier
+-- like mv_game_rank_stats. Keeping counts per tier (rather than min/max)
+-- means removing a ranking never has to look at the group's other games.
+CREATE TABLE mv_group_rank_dist (
+    -- 'platform', 'publisher', 'developer' or 'year'
+    group_type VARCHAR(10),
+    group_value VARCHAR(75),
+    tier_id BIGINT UNSIGNED,
+    num_ranked INT NOT NULL,
+    PRIMARY KEY (group_type, group_value, tier_id)
+);
+
+-- The rank stats of each group, computed from at most one row per tier of
+-- the group, so reading all the groups of a type costs O(groups).
+CREATE VIEW group_rank_stats AS
+    SELECT
+        group_type,
+        group_value,
+        SUM(num_ranked) AS num_ranked,
+        SUM(num_ranked * tier_rank) / SUM(num_ranked) AS avg_rank,
+        MIN(tier_rank) AS min_rank,
+        MAX(tier_rank) AS max_rank
+    FROM mv_group_rank_dist JOIN tier USING (tier_id)
+    GROUP BY group_type, group_value;
+
+
+DELIMITER !
+
+-- Adds delta (1 or -1) rankings in the given tier to each group of the
+-- given game. Groups whose count in the tier drops to 0 are removed.
+CREATE PROCEDURE sp_groupstat_change(
+    changed_game_id BIGINT UNSIGNED,
+    changed_tier_id BIGINT UNSIGNED,
+    delta INT
+)
+BEGIN
+    INSERT INTO mv_group_rank_dist
+        SELECT * FROM (
+            SELECT 'platform' AS group_type, platform AS group_value,
+                    changed_tier_id AS tier_id, delta AS num_ranked
+                FROM video_game WHERE game_id = changed_game_id
+            UNION ALL
+            SELECT 'publisher', publisher, changed_tier_id, delta
+                FROM video_game WHERE game_id = changed_game_id
+            UNION ALL
+            SELECT 'developer', developer, changed_tier_id, delta
+                FROM video_game WHERE game_id = changed_game_id
+            UNION ALL
+            SELECT 'year', YEAR(release_date), changed_tier_id, delta
+                FROM video_game WHERE game_id = changed_game_id
+        ) AS game_groups
+    ON DUPLICATE KEY UPDATE
+        num_ranked = mv_group_rank_dist.num_ranked + delta;
+
+    IF delta < 0 THEN
+        DELETE mv_group_rank_dist FROM mv_group_rank_dist
+            JOIN video_game ON game_id = changed_game_id
+            WHERE tier_id = changed_tier_id AND num_ranked = 0
+                AND ((group_type = 'platform' AND group_value = platform)
+                    OR (group_type = 'publisher' AND group_value = publisher)
+                    OR (group_type = 'developer' AND group_value = developer)
+                    OR (group_type = 'year'
+                        AND group_value = YEAR(release_date)));
+    END IF;
+END !
+
+-- Rebuilds the group rollup from the per game distribution
+-- (mv_game_rank_dist) rather than game_tier. Used to set up the rollup and
+-- after bulk loads, once sp_rebuild_game_rank_stats has run.
+CREATE PROCEDURE sp_rebuild_group_rank_stats()
+BEGIN
+    DELETE FROM mv_group_rank_dist;
+    INSERT INTO mv_group_rank_dist
+        SELECT 'platform', platform, tier_id, SUM(num_ranked)
+            FROM mv_game_rank_dist JOIN video_game USING (game_id)
+            GROUP BY platform, tier_id
+        UNION ALL
+        SELECT 'publisher', publisher, tier_id, SUM(num_ranked)
+            FROM mv_game_rank_dist JOIN video_game USING (game_id)
+            GROUP BY publisher, tier_id
+        UNION ALL
+        SELECT 'developer', developer, tier_id, SUM(num_ranked)
+            FROM mv_game_rank_dist JOIN video_game USING (game_id)
+            GROUP BY developer, tier_id
+        UNION ALL
+        SELECT 'year', YEAR(release_date), tier_id, SUM(num_ranked)
+            FROM mv_game_rank_dist JOIN video_game USING (game_id)
+            GROUP BY YEAR(release_date), tier_id;
+END !
+DELIMITER ;
+
+-- Set up the group rollup
+CALL sp_rebuild_group_rank_stats();
+
+
+-- Change feed of the tierlists: every tierlist create and delete and every
+-- game tier upsert and delete, in order, so that mirrors (search indexes,
+-- caches, exports) can sync in O(changes). Written by the tierlist and
+-- game_tier triggers and read with change_feed.py. Bulk loads skip the
+-- triggers, so generate_data.py makes mirrors resync instead (see
+-- change_feed_state).
+CREATE TABLE tierlist_change (
+    -- assigned in insert order; a transaction that is still open or was
+    -- rolled back leaves a gap, which readers wait out (see change_feed.py)
+    seq BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    -- 'tierlist_create', 'tierlist_delete', 'game_tier_upsert',
+    -- 'game_tier_delete', or 'resync' for the marker of a bulk load
+    change_type VARCHAR(20) NOT NULL,
+    username VARCHAR(20),
+    tierlist_name VARCHAR(50),
+    -- NULL for tierlist changes
+    game_id BIGINT UNSIGNED,
+    -- the new tier of game tier upserts
+    tier_id BIGINT UNSIGNED,
+    -- the creation date of created tierlists
+    date_created DATE,
+    changed_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    -- compaction finds the later changes of the same tierlist or game tier
+    -- with this (InnoDB appends seq)
+    INDEX idx_change_key (username, tierlist_name, game_id),
+    CHECK (change_type IN ('tierlist_create', 'tierlist_delete',
+                           'game_tier_upsert', 'game_tier_delete', 'resync'))
+);
+
+-- A single row holding the oldest sequence number a mirror can continue
+-- from. Compaction removes old deletes, and bulk loads bypass the feed, so
+-- a mirror that last synced before resync_before must reload the tables.
+CREATE TABLE change_feed_state (
+    id TINYINT PRIMARY KEY DEFAULT 1,
+    resync_before BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    CHECK (id = 1)
+);
+INSERT INTO change_feed_state VALUES ();
+
+
+DELIMITER !
+
+-- Appends a change to the change feed.
+CREATE PROCEDURE sp_log_change(
+    new_change_type VARCHAR(20),
+    changed_username VARCHAR(20),
+    changed_tierlist_name VARCHAR(50),
+    changed_game_id BIGINT UNSIGNED,
+    changed_tier_id BIGINT UNSIGNED,
+    changed_date_created DATE
+)
+BEGIN
+    INSERT INTO tierlist_change(change_type, username, tierlist_name,
+                                game_id, tier_id, date_created)
+        VALUES (new_change_type, changed_username, changed_tierlist_name,
+                changed_game_id, changed_tier_id, changed_date_created);
+END !
+DELIMITER ;
+
+DELIMITER !
+
+-- Makes every mirror reload the tables, after a bulk change that skipped
+-- the triggers (bulk loads, restores, tier merges and deletes).
+CREATE PROCEDURE sp_mark_resync()
+BEGIN
+    INSERT INTO tierlist_change (change_type) VALUES ('resync');
+    UPDATE change_feed_state SET resync_before = LAST_INSERT_ID();
+END !
+DELIMITER ;
+
+
+-- Tier management (admins). Moving a tier to another rank changes the stats
+-- of every game ranked in it, and merging or deleting a tier changes every
+-- game tier in it, so these don't go through the game_tier triggers (one
+-- call per game tier). Each runs as one transaction that changes game_tier
+-- and the per tier counts (mv_game_rank_dist, mv_tierlist_tier_counts)
+-- set-wise, then rebuilds the stats derived from the counts with grouped
+-- passes over them. Readers see the old stats until it commits.
+
+DELIMITER !
+
+-- Rebuilds the stats that depend on the tier ranks from mv_game_rank_dist
+-- and invalidates the rendered tierlists. Called inside the transactions
+-- of the tier management procedures.
+CREATE PROCEDURE sp_tiers_changed()
+BEGIN
+    CALL sp_rebuild_game_rank_summary();
+    -- also bumps the game_rank_stats version, for the consensus cache
+    CALL sp_rebuild_game_consensus();
+    CALL sp_bump_version('tier', 0);
+END !
+
+-- Marks the games and tierlists with game tiers in the tiers ranked from
+-- low_rank to high_rank for coranking.py and similarity.py, which both
+-- read tier_rank, after those tiers changed rank. Archived tierlists are
+-- counted in the stats, so they are marked too.
+CREATE PROCEDURE sp_mark_ranks_dirty(
+    low_rank SMALLINT,
+    high_rank SMALLINT
+)
+BEGIN
+    INSERT INTO game_coranking_dirty
+        SELECT DISTINCT game_id, NOW(6)
+        FROM mv_game_rank_dist JOIN tier USING (tier_id)
+        WHERE tier_rank BETWEEN low_rank AND high_rank
+    ON DUPLICATE KEY UPDATE
+        marked_at = NOW(6);
+    INSERT INTO tierlist_similarity_dirty
+        SELECT DISTINCT username, tierlist_name, NOW(6)
+        FROM mv_tierlist_tier_counts JOIN tier USING (tier_id)
+        WHERE tier_rank BETWEEN low_rank AND high_rank
+    ON DUPLICATE KEY UPDATE
+        marked_at = NOW(6);
+END !
+
+-- Closes the gap a deleted tier of rank old_tier_rank left in the ranks:
+-- the tiers below it move up one rank. Updating in rank order moves each
+-- tier into a rank that is already free, so tier_rank stays unique. The
+-- moved tiers' games and tierlists are marked, since their ranks changed
+-- and the tiers on either side of the gap are now adjacent.
+CREATE PROCEDURE sp_close_rank(old_tier_rank SMALLINT)
+BEGIN
+    UPDATE tier SET tier_rank = tier_rank - 1
+        WHERE tier_rank > old_tier_rank
+        ORDER BY tier_rank;
+    CALL sp_mark_ranks_dirty(old_tier_rank, 32767);
+END !
+
+-- Moves the game tiers of one tier to another tier, or deletes them if
+-- new_tier_id is NULL, without firing the game_tier triggers, and updates
+-- the per tier counts to match. The affected games and tierlists are
+-- marked for coranking.py and similarity.py, and the change feed's mirrors
+-- must resync. Called inside the transactions of sp_merge_tier and
+-- sp_delete_tier.
+CREATE PROCEDURE sp_remap_tier(
+    old_tier_id BIGINT UNSIGNED,
+    new_tier_id BIGINT UNSIGNED
+)
+BEGIN
+    -- Archived tierlists with game tiers in the tier are rehydrated so that
+    -- the statements below change them too (archive.py archives them again
+    -- on its next run). The tier counts list them.
+    DROP TEMPORARY TABLE IF EXISTS rehydrated_tierlists;
+    CREATE TEMPORARY TABLE rehydrated_tierlists (
+        PRIMARY KEY (username, tierlist_name)
+    )
+        SELECT username, tierlist_name
+        FROM mv_tierlist_tier_counts JOIN tierlist
+            USING (username, tierlist_name)
+        WHERE tier_id = old_tier_id AND is_archived = 1;
+    CALL sp_rehydrate_tierlists();
+
+    -- marked while the counts still list the tier's games and tierlists
+    INSERT INTO game_coranking_dirty
+        SELECT game_id, NOW(6) FROM mv_game_rank_dist
+            WHERE tier_id = old_tier_id
+    ON DUPLICATE KEY UPDATE
+        marked_at = NOW(6);
+    INSERT INTO tierlist_similarity_dirty
+        SELECT username, tierlist_name, NOW(6) FROM mv_tierlist_tier_counts
+            WHERE tier_id = old_tier_id
+    ON DUPLICATE KEY UPDATE
+        marked_at = NOW(6);
+
+    -- A game is in a tierlist once, so moving its game tier to another
+    -- tier can't collide with another game tier. Both statements read
+    -- idx_game_tier_tier in every partition.
+    SET @skip_gametier_triggers = 1;
+    IF new_tier_id IS NULL THEN
+        DELETE FROM game_tier WHERE tier_id = old_tier_id;
+    ELSE
+        UPDATE game_tier SET tier_id = new_tier_id
+            WHERE tier_id = old_tier_id;
+    END IF;
+    SET @skip_gametier_triggers = NULL;
+
+    IF new_tier_id IS NULL THEN
+        UPDATE mv_tierlist_stats s JOIN mv_tierlist_tier_counts c
+                USING (username, tierlist_name)
+            SET s.num_games = s.num_games - c.num_games
+            WHERE c.tier_id = old_tier_id;
+    ELSE
+        INSERT INTO mv_tierlist_tier_counts
+            SELECT * FROM (
+                SELECT username, tierlist_name, new_tier_id, num_games
+                    FROM mv_tierlist_tier_counts
+                    WHERE tier_id = old_tier_id
+            ) AS moved
+        ON DUPLICATE KEY UPDATE
+            num_games = mv_tierlist_tier_counts.num_games + moved.num_games;
+        INSERT INTO mv_game_rank_dist
+            SELECT * FROM (
+                SELECT game_id, new_tier_id, num_ranked
+                    FROM mv_game_rank_dist
+                    WHERE tier_id = old_tier_id
+            ) AS moved
+        ON DUPLICATE KEY UPDATE
+            num_ranked = mv_game_rank_dist.num_ranked + moved.num_ranked;
+    END IF;
+    DELETE FROM mv_tierlist_tier_counts WHERE tier_id = old_tier_id;
+    DELETE FROM mv_game_rank_dist WHERE tier_id = old_tier_id;
+    CALL sp_rebuild_group_rank_stats();
+    CALL sp_mark_resync();
+END !
+
+-- Renames and/or recolors a tier (a NULL name or color is left as is).
+CREATE PROCEDURE sp_update_tier(
+    changed_tier_id BIGINT UNSIGNED,
+    new_tier_name VARCHAR(30),
+    new_color VARCHAR(30)
+)
+BEGIN
+    UPDATE tier
+        SET tier_name = COALESCE(new_tier_name, tier_name),
+            color = COALESCE(new_color, color)
+        WHERE tier_id = changed_tier_id;
+    IF ROW_COUNT() = 0 AND NOT EXISTS (
+            SELECT 1 FROM tier WHERE tier_id = changed_tier_id) THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'The tier does not exist';
+    END IF;
+    -- rendered tierlists, including the cached consensus tierlists, show
+    -- the tier names and colors
+    CALL sp_bump_version('tier', 0);
+    CALL sp_bump_version('game_rank_stats', 0);
+END !
+
+-- Moves a tier to another rank, from 1 to the lowest tier's rank. If
+-- another tier has that rank, the tiers from there to the tier's old rank
+-- shift by one to make room. tier_rank is unique, so the ranks being
+-- shifted are negated until all are set. The games and tierlists of every
+-- tier that changed rank are marked for coranking.py and similarity.py.
+CREATE PROCEDURE sp_move_tier(
+    moved_tier_id BIGINT UNSIGNED,
+    new_tier_rank SMALLINT
+)
+BEGIN
+    DECLARE old_tier_rank SMALLINT DEFAULT NULL;
+    DECLARE max_tier_rank SMALLINT DEFAULT NULL;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        RESIGNAL;
+    END;
+
+    START TRANSACTION;
+    SELECT tier_rank FROM tier WHERE tier_id = moved_tier_id
+        FOR UPDATE INTO old_tier_rank;
+    IF old_tier_rank IS NULL THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'The tier does not exist';
+    END IF;
+    IF new_tier_rank < 1 THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'Ranks start at 1';
+    END IF;
+    SELECT MAX(tier_rank) FROM tier INTO max_tier_rank;
+    IF new_tier_rank > max_tier_rank THEN
+        SIGNAL SQLSTATE '45000'
+            SET MESSAGE_TEXT = 'The rank is below the lowest tier';
+    END IF;
+
+    IF new_tier_rank <> old_tier_rank THEN
+        IF EXISTS (SELECT 1 FROM tier WHERE tier_rank = new_tier_rank) THEN
+            UPDATE tier
+                SET tier_rank = -IF(tier_id = moved_tier_id, new_tier_rank,
+                    tier_rank + SIGN(old_tier_rank - new_tier_rank))
+                WHERE tier_rank BETWEEN LEAST(old_tier_rank, new_tier_rank)
+                    AND GREATEST(old_tier_rank, new_tier_rank);
+            UPDATE tier SET tier_rank = -tier_rank WHERE tier_rank < 0;
+        ELSE
+            UPDATE tier SET tier_rank = new_tier_rank
+                WHERE tier_id = moved_tier_id;
+        END IF;
+        -- the tier ids of the game tiers are unchanged, only the stats
+        -- computed from the ranks change
+        CALL sp_mark_ranks_dirty(LEAST(old_tier_rank, new_tier_rank),
+                                 GREATEST(old_tier_rank, new_tier_rank));
+        CALL sp_tiers_changed();
+    END IF;
+    COMMIT;
+END !
+
+-- Merges a tier into another: its games move to the other tier in every
+-- tierlist, and it is deleted. The tiers below it move up one rank.
+CREATE PROCEDURE sp_merge_tier(
+    old_tier_id BIGINT UNSIGNED,
+    into_tier_id BIGINT UNSIGNED
+)
+BEGIN
+    DECLARE tiers_found INT DEFAULT 0;
+    DECLARE old_tier_rank SMALLINT DEFAULT NULL;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        SET @skip_gametier_triggers = NULL;
+        RESIGNAL;
+    END;
+
+    START TRANSACTION;
+    -- locked so that no game can be added to either tier until the merge
+    -- commits (sp_update_game_tier reads the tier with FOR SHARE)
+    SELECT COUNT(*) FROM tier WHERE tier_id IN (old_tier_id, into_tier_id)
+        FOR UPDATE INTO tiers_found;
+    IF old_tier_id = into_tier_id THEN
+        SIGNAL SQLSTATE '45000'
+            SET MESSAGE_TEXT = 'A tier cannot be merged into itself';
+    END IF;
+    IF tiers_found < 2 THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'The tier does not exist';
+    END IF;
+
+    SELECT tier_rank FROM tier WHERE tier_id = old_tier_id
+        INTO old_tier_rank;
+    CALL sp_remap_tier(old_tier_id, into_tier_id);
+    DELETE FROM tier WHERE tier_id = old_tier_id;
+    CALL sp_close_rank(old_tier_rank);
+    CALL sp_tiers_changed();
+    COMMIT;
+END !
+
+-- Deletes a tier and removes its games from every tierlist. The tiers
+-- below it move up one rank.
+CREATE PROCEDURE sp_delete_tier(old_tier_id BIGINT UNSIGNED)
+BEGIN
+    DECLARE tiers_found INT DEFAULT 0;
+    DECLARE old_tier_rank SMALLINT DEFAULT NULL;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        SET @skip_gametier_triggers = NULL;
+        RESIGNAL;
+    END;
+
+    START TRANSACTION;
+    SELECT COUNT(*), MAX(tier_rank) FROM tier WHERE tier_id = old_tier_id
+        FOR UPDATE INTO tiers_found, old_tier_rank;
+    IF tiers_found = 0 THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'The tier does not exist';
+    END IF;
+
+    CALL sp_remap_tier(old_tier_id, NULL);
+    DELETE FROM tier WHERE tier_id = old_tier_id;
+    CALL sp_close_rank(old_tier_rank);
+    CALL sp_tiers_changed();
+    COMMIT;
+END !
+DELIMITER ;
+
+
+-- Duplicate games (admins). The catalog can list the same game more than
+-- once (ports, re-releases, typos). video_game.name_key is the game's name
+-- normalized by game_name_key, so candidate duplicates are the games that
+-- share a key: grouping by it with idx_game_name_key finds them in one pass,
+-- never comparing every pair of games. sp_merge_game merges a duplicate
+-- into the game that is kept.
+
+DELIMITER !
+
+-- Returns the normalized name of a game: lower case, '&' as 'and', every
+-- run of other characters than letters and digits as one space, without
+-- the word 'the' or a trailing edition word (3D, DX, HD, Deluxe,
+-- Remastered, Plus). Accents are kept; the collation of name_key ignores
+-- them.
+CREATE FUNCTION game_name_key(input_game_name VARCHAR(125))
+RETURNS VARCHAR(255) DETERMINISTIC
+BEGIN
+    DECLARE name_key VARCHAR(255) DEFAULT NULL;
+
+    -- padded with spaces so that whole words can be matched
+    SET name_key = CONCAT(' ', REGEXP_REPLACE(
+        LOWER(REPLACE(input_game_name, '&', ' and ')), '[^[:alnum:]]+', ' '),
+        ' ');
+    SET name_key = REPLACE(name_key, ' the ', ' ');
+    SET name_key = REGEXP_REPLACE(name_key,
+        '( (3d|dx|hd|deluxe|remastered|plus))+ $', ' ');
+    RETURN TRIM(name_key);
+END !
+
+-- Keep name_key up to date, including for games bulk loaded with LOAD DATA
+CREATE TRIGGER trg_video_game_insert BEFORE INSERT
+       ON video_game FOR EACH ROW
+BEGIN
+    SET NEW.name_key = game_name_key(NEW.game_name);
+END !
+
+CREATE TRIGGER trg_video_game_update BEFORE UPDATE
+       ON video_game FOR EACH ROW
+BEGIN
+    SET NEW.name_key = game_name_key(NEW.game_name);
+END !
+
+-- Merges a duplicate game into the game that is kept: the duplicate's game
+-- tiers become game tiers of the kept game and the duplicate is deleted.
+-- A tierlist that ranked both keeps the better (lower rank) of the two
+-- tiers. Like the tier management procedures, it runs as one transaction
+-- that changes game_tier set-wise without the triggers, and updates the
+-- stats from the tierlists that ranked the duplicate, so its cost is in
+-- proportion to the duplicate's rankings rather than the kept game's.
+CREATE PROCEDURE sp_merge_game(
+    keep_game_id BIGINT UNSIGNED,
+    dup_game_id BIGINT UNSIGNED
+)
+BEGIN
+    DECLARE games_found INT DEFAULT 0;
+    DECLARE done TINYINT DEFAULT 0;
+    DECLARE changed_game_id BIGINT UNSIGNED;
+    DECLARE changed_tier_id BIGINT UNSIGNED;
+    DECLARE delta INT;
+    DECLARE delta_cursor CURSOR FOR
+        SELECT game_id, tier_id, num_ranked FROM merged_game_dist
+            WHERE num_ranked <> 0;
+    DECLARE CONTINUE HANDLER FOR NOT FOUND SET done = 1;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        SET @skip_gametier_triggers = NULL;
+        DROP TEMPORARY TABLE IF EXISTS merged_tierlists, merged_game_dist;
+        RESIGNAL;
+    END;
+
+    START TRANSACTION;
+    -- locked so that neither game can be added to a tierlist until the
+    -- merge commits (sp_update_game_tier reads the game with FOR SHARE)
+    SELECT COUNT(*) FROM video_game WHERE game_id IN (keep_game_id, dup_game_id)
+        FOR UPDATE INTO games_found;
+    IF keep_game_id = dup_game_id THEN
+        SIGNAL SQLSTATE '45000'
+            SET MESSAGE_TEXT = 'A game cannot be merged into itself';
+    END IF;
+    IF games_found < 2 THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'The game does not exist';
+    END IF;
+
+    -- Archived tierlists that ranked the duplicate are rehydrated first,
+    -- found by the duplicate's entries in archived_game_index.
+    DROP TEMPORARY TABLE IF EXISTS rehydrated_tierlists;
+    CREATE TEMPORARY TABLE rehydrated_tierlists (
+        PRIMARY KEY (username, tierlist_name)
+    )
+        SELECT username, tierlist_name FROM archived_game_index
+        WHERE game_id = dup_game_id;
+    CALL sp_rehydrate_tierlists();
+
+    -- The tierlists that ranked the duplicate, with the tier the merged
+    -- game ends up in and, if the tierlist also ranked the kept game, the
+    -- tier of the ranking that is dropped. Reading game_tier here takes
+    -- shared locks on the rows read, so they can't change until the merge
+    -- commits.
+    CREATE TEMPORARY TABLE merged_tierlists (
+        PRIMARY KEY (username, tierlist_name)
+    )
+        SELECT d.username, d.tierlist_name,
+            IF(k.tier_id IS NULL OR dt.tier_rank < kt.tier_rank,
+               d.tier_id, k.tier_id) AS kept_tier_id,
+            IF(k.tier_id IS NULL, NULL,
+               IF(dt.tier_rank < kt.tier_rank, k.tier_id, d.tier_id))
+                AS dropped_tier_id
+        FROM game_tier d
+            JOIN tier dt ON dt.tier_id = d.tier_id
+            LEFT JOIN game_tier k ON k.username = d.username
+                AND k.tierlist_name = d.tierlist_name
+                AND k.game_id = keep_game_id
+            LEFT JOIN tier kt ON kt.tier_id = k.tier_id
+        WHERE d.game_id = dup_game_id;
+
+    -- The change in each game's count per tier, for the group rollup: the
+    -- duplicate loses all its rankings, which the kept game gains except
+    -- for the dropped ones.
+    CREATE TEMPORARY TABLE merged_game_dist (
+        game_id BIGINT UNSIGNED,
+        tier_id BIGINT UNSIGNED,
+        num_ranked INT NOT NULL,
+        PRIMARY KEY (game_id, tier_id)
+    );
+    INSERT INTO merged_game_dist
+        SELECT dup_game_id, tier_id, -num_ranked FROM mv_game_rank_dist
+            WHERE game_id = dup_game_id
+        UNION ALL
+        SELECT keep_game_id, tier_id, num_ranked FROM mv_game_rank_dist
+            WHERE game_id = dup_game_id;
+    INSERT INTO merged_game_dist
+        SELECT * FROM (
+            SELECT keep_game_id AS game_id, dropped_tier_id AS tier_id,
+                    -COUNT(*) AS num_ranked
+                FROM merged_tierlists
+                WHERE dropped_tier_id IS NOT NULL
+                GROUP BY dropped_tier_id
+        ) AS dropped
+    ON DUPLICATE KEY UPDATE
+        num_ranked = merged_game_dist.num_ranked + dropped.num_ranked;
+
+    CALL sp_coranking_markdirty(keep_game_id);
+    INSERT INTO tierlist_similarity_dirty
+        SELECT username, tierlist_name, NOW(6) FROM merged_tierlists
+    ON DUPLICATE KEY UPDATE
+        marked_at = NOW(6);
+    UPDATE tierlist JOIN merged_tierlists USING (username, tierlist_name)
+        SET version = UUID_SHORT();
+
+    -- Tierlists that ranked both keep the better tier and drop the
+    -- duplicate; the duplicate's other game tiers move to the kept game.
+    -- All three statements find the duplicate's game tiers (or the kept
+    -- game's in those tierlists) by primary key or idx_game_tier_game.
+    SET @skip_gametier_triggers = 1;
+    UPDATE game_tier JOIN merged_tierlists USING (username, tierlist_name)
+        SET tier_id = kept_tier_id
+        WHERE game_id = keep_game_id AND dropped_tier_id IS NOT NULL;
+    DELETE game_tier FROM game_tier
+        JOIN merged_tierlists USING (username, tierlist_name)
+        WHERE game_id = dup_game_id AND dropped_tier_id IS NOT NULL;
+    UPDATE game_tier SET game_id = keep_game_id
+        WHERE game_id = dup_game_id;
+    SET @skip_gametier_triggers = NULL;
+
+    -- A tierlist that ranked both has one game fewer, in the dropped tier
+    UPDATE mv_tierlist_tier_counts
+        JOIN merged_tierlists USING (username, tierlist_name)
+        SET num_games = num_games - 1
+        WHERE tier_id = dropped_tier_id;
+    DELETE mv_tierlist_tier_counts FROM mv_tierlist_tier_counts
+        JOIN merged_tierlists USING (username, tierlist_name)
+        WHERE tier_id = dropped_tier_id AND num_games = 0;
+    UPDATE mv_tierlist_stats JOIN merged_tierlists
+            USING (username, tierlist_name)
+        SET num_games = num_games - 1
+        WHERE dropped_tier_id IS NOT NULL;
+
+    -- The group rollup is changed before the duplicate is deleted, since
+    -- sp_groupstat_change reads the groups from video_game
+    OPEN delta_cursor;
+    delta_loop: LOOP
+        FETCH delta_cursor INTO changed_game_id, changed_tier_id, delta;
+        IF done THEN
+            LEAVE delta_loop;
+        END IF;
+        CALL sp_groupstat_change(changed_game_id, changed_tier_id, delta);
+    END LOOP;
+    CLOSE delta_cursor;
+
+    DELETE FROM mv_game_rank_dist WHERE game_id = dup_game_id;
+    INSERT INTO mv_game_rank_dist
+        SELECT * FROM (
+            SELECT game_id, tier_id, num_ranked FROM merged_game_dist
+                WHERE game_id = keep_game_id AND num_ranked <> 0
+        ) AS merged
+    ON DUPLICATE KEY UPDATE
+        num_ranked = mv_game_rank_dist.num_ranked + merged.num_ranked;
+    DELETE FROM mv_game_rank_dist
+        WHERE game_id = keep_game_id AND num_ranked = 0;
+
+    DELETE FROM mv_game_rank_stats
+        WHERE game_id IN (keep_game_id, dup_game_id);
+    INSERT INTO mv_game_rank_stats
+        SELECT game_id, SUM(num_ranked), SUM(num_ranked * tier_rank),
+            MIN(tier_rank), MAX(tier_rank)
+        FROM mv_game_rank_dist JOIN tier USING (tier_id)
+        WHERE game_id = keep_game_id
+        GROUP BY game_id;
+    CALL sp_consensus_refreshgame(keep_game_id);
+    DELETE FROM mv_game_consensus WHERE game_id = dup_game_id;
+    CALL sp_bump_version('game_rank_stats', keep_game_id);
+
+    -- The change feed gets the game tiers of the duplicate as deletes and
+    -- those of the kept game in the same tierlists as upserts
+    INSERT INTO tierlist_change (change_type, username, tierlist_name, game_id)
+        SELECT 'game_tier_delete', username, tierlist_name, dup_game_id
+        FROM merged_tierlists;
+    INSERT INTO tierlist_change (change_type, username, tierlist_name,
+                                 game_id, tier_id)
+        SELECT 'game_tier_upsert', username, tierlist_name, keep_game_id,
+            kept_tier_id
+        FROM merged_tierlists;
+
+    -- coranking.py recomputes the related games of the games that listed
+    -- the duplicate
+    INSERT INTO game_coranking_dirty
+        SELECT game_id, NOW(6) FROM game_related
+            WHERE related_game_id = dup_game_id
+    ON DUPLICATE KEY UPDATE
+        marked_at = NOW(6);
+    DELETE FROM game_related WHERE game_id = dup_game_id;
+    DELETE FROM game_coranking_dirty WHERE game_id = dup_game_id;
+    DELETE FROM video_game WHERE game_id = dup_game_id;
+
+    DROP TEMPORARY TABLE merged_tierlists, merged_game_dist;
+    COMMIT;
+END !
+DELIMITER ;
+
+-- Set up the normalized names of the games loaded before the triggers
+UPDATE video_game SET name_key = game_name_key(game_name);
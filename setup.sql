@@ -2,6 +2,8 @@
 
 -- DROP TABLE commands:
 DROP TABLE IF EXISTS game_tier;
+DROP TABLE IF EXISTS archived_game_index;
+DROP TABLE IF EXISTS tierlist_archive;
 DROP TABLE IF EXISTS tierlist;
 DROP TABLE IF EXISTS tier;
 DROP TABLE IF EXISTS video_game;
@@ -21,7 +23,11 @@ CREATE TABLE video_game (
     -- number of sales. Can be null if game is not released yet
     sales INT,
     -- ex: Nintendo DS
-    platform VARCHAR(50) NOT NULL
+    platform VARCHAR(50) NOT NULL,
+    -- game_name normalized for finding duplicate games (see game_name_key in
+    -- setup-routines.sql, whose triggers set it). The column's collation
+    -- ignores case and accents.
+    name_key VARCHAR(255)
 );
 
 -- This table holds information for authenticating users based on
@@ -54,12 +60,31 @@ CREATE TABLE tierlist (
     username VARCHAR(20),
     tierlist_name VARCHAR(50),
     date_created DATE NOT NULL,
+    -- Changed whenever the tierlist's games or tiers change, so that rendered
+    -- copies of it can be cached (see get_rendered_tierlist in app.py).
+    -- Versions come from UUID_SHORT(), which never repeats, so a deleted and
+    -- recreated tierlist can't match a copy of the old one.
+    version BIGINT UNSIGNED NOT NULL DEFAULT (UUID_SHORT()),
+    -- When the tierlist last changed (edits change its version). Archiving
+    -- and rehydrating it set the column to itself, so that they don't
+    -- count as changes.
+    modified_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ON UPDATE CURRENT_TIMESTAMP,
+    -- 1 if the tierlist's game tiers are in tierlist_archive rather than
+    -- game_tier
+    is_archived TINYINT NOT NULL DEFAULT 0,
     -- username, tierlist_name is primary key since
     -- a tierlist name may not be unique between users, but is
     -- unique for one user
     PRIMARY KEY (username, tierlist_name),
     -- if a user account is deleted, their tierlists should be deleted
-    FOREIGN KEY (username) REFERENCES user_info(username) ON DELETE CASCADE
+    -- (trg_user_info_delete deletes them first, so that trg_tierlist_delete
+    -- fires for each)
+    FOREIGN KEY (username) REFERENCES user_info(username) ON DELETE CASCADE,
+    -- the archive job finds the inactive tierlists that aren't archived yet
+    -- with this, oldest first
+    INDEX idx_tierlist_archive (is_archived, modified_at),
+    CHECK (is_archived IN (0,1))
 );
 
 -- Table representing a tier, common across all tierlists.
@@ -77,6 +102,14 @@ CREATE TABLE tier (
 
 -- Relation table representing what tier each game is in a particular
 -- tierlist. All attributes are not null.
+-- By far the largest table, so it is partitioned by a hash of the owner:
+-- all of a user's tierlists are in one partition, the queries and
+-- procedures that look up a tierlist only read that partition, and
+-- maintenance (stats rebuilds, backups) runs one partition per worker (see
+-- partitions.py, which also changes the number of partitions).
+-- MySQL doesn't allow foreign keys on partitioned tables, so the references
+-- to tierlist, video_game and tier are checked by sp_update_game_tier, and
+-- a deleted tierlist's game tiers are deleted by trg_tierlist_delete.
 CREATE TABLE game_tier (
     username VARCHAR(20),
     tierlist_name VARCHAR(50),
@@ -84,13 +117,53 @@ CREATE TABLE game_tier (
     tier_id BIGINT UNSIGNED NOT NULL,
     -- username, tierlist_name, game_id is the primary key since a game can only
     -- appear once in a user's tierlist
-    PRIMARY KEY (username, tierlist_name, game_id),
-    -- Object tier should be deleted if any of the foreign keys are deleted.
-    FOREIGN KEY (username, tierlist_name) REFERENCES
-                tierlist(username, tierlist_name) ON DELETE CASCADE,
-    FOREIGN KEY (game_id) REFERENCES video_game(game_id) ON DELETE CASCADE,
-    FOREIGN KEY (tier_id) REFERENCES tier(tier_id) ON DELETE CASCADE
+    PRIMARY KEY (username, tierlist_name, game_id)
+)
+PARTITION BY KEY (username) PARTITIONS 16;
+
+-- The game tiers of the tierlists that haven't changed for a while (see
+-- archive.py), moved out of game_tier so that its indexes only hold the
+-- tierlists still being edited. One row per tierlist, with its game tiers
+-- packed into a JSON array of [game_id, tier_id] pairs (stored in MySQL's
+-- binary JSON format). Unpacked by the archived_game_tiers view, and moved
+-- back to game_tier by the first edit of the tierlist. The stats
+-- materialized views count archived game tiers like the others.
+CREATE TABLE tierlist_archive (
+    username VARCHAR(20),
+    tierlist_name VARCHAR(50),
+    game_tiers JSON NOT NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (username, tierlist_name)
+);
+
+-- The archived game tiers by game, for what game_tier's idx_game_tier_game
+-- does for the tierlists still in game_tier: the reverse lookup, finding
+-- the tierlists coranking.py recounts for a game, and finding the
+-- tierlists a game merge changes. Kept in step with tierlist_archive by
+-- sp_archive_tierlists, sp_rehydrate_tierlists and trg_tierlist_delete,
+-- which find a tierlist's rows by primary key from its archived game tiers.
+-- This is one entry per archived game tier, in place of the three game_tier
+-- has (its primary key and two indexes).
+CREATE TABLE archived_game_index (
+    game_id BIGINT UNSIGNED,
+    tier_id BIGINT UNSIGNED,
+    username VARCHAR(20),
+    tierlist_name VARCHAR(50),
+    -- same order as idx_game_tier_game extended with game_tier's primary
+    -- key, for the reverse lookup's keyset pagination
+    PRIMARY KEY (game_id, tier_id, username, tierlist_name)
 );
 
 -- Index
 CREATE INDEX idx_sales ON video_game(sales);
+-- For grouping the games by normalized name to find duplicates, and for
+-- checking new games against them
+CREATE INDEX idx_game_name_key ON video_game(name_key);
+-- For looking up the tierlists that ranked a game (in a given tier), and for
+-- the per-game stats maintenance in setup-routines.sql. InnoDB appends the
+-- primary key, so this also orders by username, tierlist_name for keyset
+-- pagination.
+CREATE INDEX idx_game_tier_game ON game_tier(game_id, tier_id);
+-- For finding the game tiers of a tier (the foreign key's index before
+-- game_tier was partitioned)
+CREATE INDEX idx_game_tier_tier ON game_tier(tier_id);
@@ -0,0 +1,472 @@
+"""
+Computes the most similar tierlists of other users for every tierlist
+("tierlists like this") and stores them in tierlist_neighbors, where
+view_tierlist reads them with a primary key lookup.
+
+Each tierlist is a sparse vector over games, with a score of
+(lowest tier rank + 1 - tier rank) for every game it ranks, and tierlists are
+compared by cosine similarity. The similarities are computed in batch with
+sparse matrix products, a block of tierlists at a time.
+
+A full run computes the neighbors of every tierlist and saves the rank
+matrix and neighbors to a cache file. Later runs only update the tierlists
+that changed since (marked in tierlist_similarity_dirty by the game_tier
+triggers), plus the tierlists whose neighbors they affect:
+    python3 similarity.py --full
+    python3 similarity.py
+
+Requires NumPy and SciPy (pip3 install numpy scipy).
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+import app
+
+# Number of similar tierlists kept per tierlist
+DEFAULT_K = 10
+# Tierlists compared against all others per sparse matrix product
+DEFAULT_BLOCK_SIZE = 128
+# Rows written to tierlist_neighbors per INSERT
+WRITE_BATCH_SIZE = 5000
+DEFAULT_CACHE = 'similarity_cache.npz'
+
+
+# ----------------------------------------------------------------------
+# Loading Functions
+# ----------------------------------------------------------------------
+def load_rank_matrix(sql=None, params=None):
+    '''
+    Streams game tiers ordered by tierlist and returns (keys, R) where keys
+    is the list of (username, tierlist_name) of each row and R is a sparse
+    CSR matrix with R[i, game_id] = tier rank of the game in tierlist i.
+    The query must return username, tierlist_name, game_id, tier_rank
+    ordered by username, tierlist_name. Without a query, every tierlist is
+    read: the active ones from game_tier, then the archived ones from
+    tierlist_archive.
+    '''
+    if sql is None:
+        result = itertools.chain(
+            app.stream_rows('''SELECT username, tierlist_name, game_id,
+                                   tier_rank
+                               FROM game_tier JOIN tier USING (tier_id)
+                               ORDER BY username, tierlist_name;'''),
+            app.stream_rows('''SELECT username, tierlist_name, game_id,
+                                   tier_rank
+                               FROM archived_game_tiers
+                                   JOIN tier USING (tier_id)
+                               ORDER BY username, tierlist_name;'''))
+    else:
+        result = app.stream_rows(sql, params)
+    keys = []
+    row_chunks, col_chunks, val_chunks = [], [], []
+    rows, cols, vals = [], [], []
+    last_key = None
+    for username, tierlist_name, game_id, tier_rank in result:
+        if (username, tierlist_name) != last_key:
+            last_key = (username, tierlist_name)
+            keys.append(last_key)
+        rows.append(len(keys) - 1)
+        cols.append(game_id)
+        vals.append(tier_rank)
+        if len(rows) >= app.FETCH_SIZE * 100:
+            row_chunks.append(np.array(rows, dtype=np.int32))
+            col_chunks.append(np.array(cols, dtype=np.int32))
+            val_chunks.append(np.array(vals, dtype=np.float32))
+            rows, cols, vals = [], [], []
+    row_chunks.append(np.array(rows, dtype=np.int32))
+    col_chunks.append(np.array(cols, dtype=np.int32))
+    val_chunks.append(np.array(vals, dtype=np.float32))
+    rows = np.concatenate(row_chunks)
+    cols = np.concatenate(col_chunks)
+    vals = np.concatenate(val_chunks)
+    num_games = int(cols.max()) + 1 if len(cols) else 1
+    R = sp.csr_matrix((vals, (rows, cols)), shape=(len(keys), num_games))
+    return keys, R
+
+def get_max_rank():
+    '''
+    Returns the rank of the lowest tier.
+    '''
+    cursor = app.conn.cursor()
+    cursor.execute('SELECT MAX(tier_rank) FROM tier;')
+    return int(cursor.fetchone()[0] or 0)
+
+def to_unit_scores(R, max_rank):
+    '''
+    Turns a rank matrix into L2-normalized score vectors, where a higher
+    tier scores higher.
+    '''
+    X = R.astype(np.float32, copy=True)
+    X.data = max_rank + 1 - X.data
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sp.diags(1 / norms).dot(X).tocsr()
+
+# ----------------------------------------------------------------------
+# Similarity Functions
+# ----------------------------------------------------------------------
+def top_k_rows(X, row_ids, owners, alive, k, block_size):
+    '''
+    Returns the k most similar tierlists of other users for each of the
+    given rows of X, as a dict row -> (neighbor rows, similarities) sorted
+    by decreasing similarity.
+    '''
+    result = {}
+    XT = X.T.tocsr()
+    for start in range(0, len(row_ids), block_size):
+        block = row_ids[start:start + block_size]
+        S = X[block].dot(XT).tocsr()
+        for i, row in enumerate(block):
+            lo, hi = S.indptr[i], S.indptr[i + 1]
+            cols = S.indices[lo:hi]
+            sims = S.data[lo:hi]
+            keep = (owners[cols] != owners[row]) & alive[cols] & (sims > 0)
+            cols, sims = cols[keep], sims[keep]
+            if len(cols) > k:
+                part = np.argpartition(-sims, k)[:k]
+                cols, sims = cols[part], sims[part]
+            order = np.argsort(-sims, kind='stable')
+            result[row] = (cols[order], sims[order])
+    return result
+
+def set_neighbors(neighbors, neighbor_sims, row, cols, sims):
+    '''
+    Stores the neighbors of one row in the n x k neighbor arrays. Unused
+    slots are -1 with similarity 0.
+    '''
+    neighbors[row] = -1
+    neighbor_sims[row] = 0
+    neighbors[row, :len(cols)] = cols
+    neighbor_sims[row, :len(sims)] = sims
+
+# ----------------------------------------------------------------------
+# Storage Functions
+# ----------------------------------------------------------------------
+def save_cache(path, keys, owners, alive, X, neighbors, neighbor_sims,
+               max_rank):
+    '''
+    Saves the score matrix and neighbors for the next incremental run.
+    '''
+    np.savez(path, usernames=np.array([key[0] for key in keys]),
+             tierlist_names=np.array([key[1] for key in keys]),
+             owners=owners, alive=alive, data=X.data, indices=X.indices,
+             indptr=X.indptr, shape=np.array(X.shape),
+             neighbors=neighbors, neighbor_sims=neighbor_sims,
+             max_rank=np.array(max_rank))
+
+def load_cache(path):
+    '''
+    Loads what save_cache() saved.
+    '''
+    cache = np.load(path)
+    keys = list(zip(cache['usernames'].tolist(),
+                    cache['tierlist_names'].tolist()))
+    X = sp.csr_matrix((cache['data'], cache['indices'], cache['indptr']),
+                      shape=tuple(cache['shape']))
+    return (keys, cache['owners'], cache['alive'], X, cache['neighbors'],
+            cache['neighbor_sims'], int(cache['max_rank']))
+
+def write_neighbors(rows, keys, neighbors, neighbor_sims, replace=True,
+                    table='tierlist_neighbors'):
+    '''
+    Writes the neighbors of the given rows to table (tierlist_neighbors by
+    default), replacing the old ones if replace is True.
+    '''
+    cursor = app.conn.cursor()
+    batch = []
+    deletes = []
+
+    def flush():
+        if deletes:
+            cursor.executemany(f'DELETE FROM {table} WHERE '
+                               'username = %s AND tierlist_name = %s;',
+                               deletes)
+        if batch:
+            cursor.executemany(f'INSERT INTO {table} VALUES '
+                               '(%s, %s, %s, %s, %s, %s);', batch)
+        app.conn.commit()
+        batch.clear()
+        deletes.clear()
+
+    for row in rows:
+        username, tierlist_name = keys[row]
+        if replace:
+            deletes.append((username, tierlist_name))
+        for rank, (col, sim) in enumerate(zip(neighbors[row],
+                                              neighbor_sims[row]), 1):
+            if col < 0:
+                break
+            batch.append((username, tierlist_name, rank, keys[col][0],
+                          keys[col][1], float(sim)))
+        if len(batch) >= WRITE_BATCH_SIZE:
+            flush()
+    flush()
+
+# ----------------------------------------------------------------------
+# Full and Incremental Runs
+# ----------------------------------------------------------------------
+def full_build(args):
+    '''
+    Computes the neighbors of every tierlist and replaces
+    tierlist_neighbors. The neighbors are written to a new table that is
+    swapped in once it is complete, so the app keeps showing the old
+    neighbors until then.
+    '''
+    start = time.perf_counter()
+    cursor = app.conn.cursor()
+    # The tierlists and the marks are read in one snapshot, so the marks
+    # read are exactly those of the changes the run sees; changes that
+    # aren't in the snapshot keep their marks for the next incremental run
+    app.conn.start_transaction(consistent_snapshot=True, readonly=True)
+    keys, R = load_rank_matrix()
+    max_rank = get_max_rank()
+    dirty = read_dirty()
+    app.conn.commit()
+    X = to_unit_scores(R, max_rank)
+    print(f'Loaded {len(keys)} tierlists with {X.nnz} ranked games '
+          f'({time.perf_counter() - start:.0f}s)')
+
+    owner_ids = {}
+    owners = np.array([owner_ids.setdefault(key[0], len(owner_ids))
+                       for key in keys], dtype=np.int32)
+    alive = np.ones(len(keys), dtype=bool)
+    neighbors = np.full((len(keys), args.k), -1, dtype=np.int32)
+    neighbor_sims = np.zeros((len(keys), args.k), dtype=np.float32)
+
+    cursor.execute('DROP TABLE IF EXISTS tierlist_neighbors_new;')
+    cursor.execute('CREATE TABLE tierlist_neighbors_new '
+                   'LIKE tierlist_neighbors;')
+    all_rows = np.arange(len(keys))
+    step = args.block_size * 64
+    for chunk_start in range(0, len(keys), step):
+        chunk = all_rows[chunk_start:chunk_start + step]
+        for row, (cols, sims) in top_k_rows(X, chunk, owners, alive, args.k,
+                                            args.block_size).items():
+            set_neighbors(neighbors, neighbor_sims, row, cols, sims)
+        write_neighbors(chunk, keys, neighbors, neighbor_sims, replace=False,
+                        table='tierlist_neighbors_new')
+        print(f'Computed {min(chunk_start + step, len(keys))}/{len(keys)} '
+              f'tierlists ({time.perf_counter() - start:.0f}s)')
+
+    # swap the tables in one atomic rename
+    cursor.execute('DROP TABLE IF EXISTS tierlist_neighbors_old;')
+    cursor.execute('''RENAME TABLE tierlist_neighbors
+                          TO tierlist_neighbors_old,
+                      tierlist_neighbors_new TO tierlist_neighbors;''')
+    cursor.execute('DROP TABLE tierlist_neighbors_old;')
+    # clear the marks read, unless the tierlist changed again since
+    cursor.executemany('DELETE FROM tierlist_similarity_dirty WHERE '
+                       'username = %s AND tierlist_name = %s AND '
+                       'marked_at = %s;', dirty)
+    app.conn.commit()
+    save_cache(args.cache, keys, owners, alive, X, neighbors, neighbor_sims,
+               max_rank)
+    app.print_success(f'Done in {time.perf_counter() - start:.0f}s.')
+
+def read_dirty():
+    '''
+    Returns the tierlists marked as changed, as (username, tierlist_name,
+    marked_at) tuples.
+    '''
+    cursor = app.conn.cursor()
+    cursor.execute('SELECT username, tierlist_name, marked_at '
+                   'FROM tierlist_similarity_dirty;')
+    return cursor.fetchall()
+
+def fetch_tierlists(dirty_keys):
+    '''
+    Returns the rank matrix of the given tierlists, read by primary key
+    from game_tier or, for the ones archived since they changed, from
+    tierlist_archive.
+    '''
+    contents = {}
+    for start in range(0, len(dirty_keys), 500):
+        batch = dirty_keys[start:start + 500]
+        placeholders = ', '.join(['(%s, %s)'] * len(batch))
+        params = [value for key in batch for value in key]
+        sql = f'''SELECT username, tierlist_name, game_id, tier_rank
+                  FROM game_tier JOIN tier USING (tier_id)
+                  WHERE (username, tierlist_name) IN ({placeholders})
+                  UNION ALL
+                  SELECT username, tierlist_name, game_id, tier_rank
+                  FROM archived_game_tiers JOIN tier USING (tier_id)
+                  WHERE (username, tierlist_name) IN ({placeholders})
+                  ORDER BY username, tierlist_name;'''
+        keys, R = load_rank_matrix(sql, params * 2)
+        for i, key in enumerate(keys):
+            contents[key] = R[i]
+    return contents
+
+def incremental_update(args):
+    '''
+    Updates the neighbors of the tierlists that changed since the last run,
+    and of the tierlists whose neighbors they affect.
+    '''
+    start = time.perf_counter()
+    if not os.path.exists(args.cache):
+        app.print_err(f'No cache file {args.cache}. Run with --full first.')
+        sys.exit(1)
+    keys, owners, alive, X, neighbors, neighbor_sims, max_rank = \
+        load_cache(args.cache)
+    if get_max_rank() != max_rank:
+        app.print_err('The tiers have changed since the last full run. '
+                      'Run with --full.')
+        sys.exit(1)
+    if neighbors.shape[1] != args.k:
+        app.print_err(f'The cache has {neighbors.shape[1]} neighbors per '
+                      'tierlist. Run with --full to change -k.')
+        sys.exit(1)
+    dirty = read_dirty()
+    if not dirty:
+        app.print_success('No tierlists have changed.')
+        return
+    dirty_keys = [(row[0], row[1]) for row in dirty]
+    contents = fetch_tierlists(dirty_keys)
+
+    # Add rows for new tierlists, then replace the rows of changed ones.
+    # Tierlists with no game tiers left (or deleted) become empty rows.
+    index = {key: i for i, key in enumerate(keys)}
+    owner_ids = {}
+    for key, owner in zip(keys, owners):
+        owner_ids.setdefault(key[0], int(owner))
+    for key in dirty_keys:
+        if key not in index:
+            index[key] = len(keys)
+            keys.append(key)
+    num_games = max([X.shape[1]] + [R.shape[1] for R in contents.values()])
+    n = len(keys)
+    old_n = len(owners)
+    owners = np.concatenate([owners, np.array(
+        [owner_ids.setdefault(key[0], len(owner_ids))
+         for key in keys[old_n:]], dtype=np.int32)])
+    alive = np.concatenate([alive, np.ones(n - old_n, dtype=bool)])
+    neighbors = np.vstack([neighbors,
+                           np.full((n - old_n, args.k), -1, dtype=np.int32)])
+    neighbor_sims = np.vstack([neighbor_sims,
+                               np.zeros((n - old_n, args.k), dtype=np.float32)])
+    X.resize((n, num_games))
+
+    dirty_rows = np.array(sorted(index[key] for key in dirty_keys))
+    keep = np.ones(n, dtype=np.float32)
+    keep[dirty_rows] = 0
+    new_rows, new_cols, new_vals = [], [], []
+    for key in dirty_keys:
+        R = contents.get(key)
+        alive[index[key]] = R is not None
+        if R is None:
+            continue
+        R = R.tocoo()
+        new_rows.append(np.full(R.nnz, index[key], dtype=np.int32))
+        new_cols.append(R.col)
+        new_vals.append(R.data)
+    X = sp.diags(keep).dot(X).tocsr()
+    if new_rows:
+        changed = sp.csr_matrix(
+            (np.concatenate(new_vals),
+             (np.concatenate(new_rows), np.concatenate(new_cols))),
+            shape=(n, num_games))
+        X = X + to_unit_scores(changed, max_rank)
+    X.eliminate_zeros()
+
+    # Rows whose neighbors must be rewritten, and rows whose neighbors must
+    # be recomputed from scratch because a neighbor got less similar and
+    # something else may take its place.
+    touched = set(dirty_rows.tolist())
+    recompute = set(int(row) for row in dirty_rows if alive[row])
+    for row in dirty_rows:
+        if not alive[row]:
+            set_neighbors(neighbors, neighbor_sims, row, [], [])
+    had_dirty = np.isin(neighbors, dirty_rows)
+
+    had_rows, had_slots = np.nonzero(had_dirty)
+    had_cols = neighbors[had_rows, had_slots]
+
+    # Similarities between the changed tierlists and all the others
+    XT = X.T.tocsr()
+    for block_start in range(0, len(dirty_rows), args.block_size):
+        block = dirty_rows[block_start:block_start + args.block_size]
+        S = X[block].dot(XT).tocsc()
+        # old neighbors that are changed tierlists of this block
+        in_block = np.isin(had_cols, block)
+        for row, slot, col in zip(had_rows[in_block], had_slots[in_block],
+                                  had_cols[in_block]):
+            pos = np.searchsorted(block, col)
+            sim = S[pos, row] if alive[col] else 0.0
+            if sim >= neighbor_sims[row, -1] and sim > 0 and \
+                    neighbors[row, -1] >= 0:
+                neighbor_sims[row, slot] = sim
+                touched.add(int(row))
+            else:
+                recompute.add(int(row))
+        # changed tierlists that now beat another tierlist's last neighbor
+        S = S.T.tocsr()  # rows: all tierlists, cols: block
+        for row in np.flatnonzero(np.diff(S.indptr)):
+            if row in recompute or not alive[row]:
+                continue
+            lo, hi = S.indptr[row], S.indptr[row + 1]
+            for pos, sim in zip(S.indices[lo:hi], S.data[lo:hi]):
+                col = block[pos]
+                if col == row or owners[col] == owners[row] or \
+                        not alive[col] or col in neighbors[row]:
+                    continue
+                if sim > neighbor_sims[row, -1] or neighbors[row, -1] < 0:
+                    neighbors[row, -1] = col
+                    neighbor_sims[row, -1] = sim
+                    touched.add(int(row))
+                    # keep the row sorted, with empty slots last
+                    order = np.lexsort((-neighbor_sims[row],
+                                        neighbors[row] < 0))
+                    neighbors[row] = neighbors[row][order]
+                    neighbor_sims[row] = neighbor_sims[row][order]
+
+    recompute = np.array(sorted(recompute), dtype=np.int64)
+    for row, (cols, sims) in top_k_rows(X, recompute, owners, alive, args.k,
+                                        args.block_size).items():
+        set_neighbors(neighbors, neighbor_sims, row, cols, sims)
+    touched.update(recompute.tolist())
+    # re-sort rows whose similarities were updated in place
+    for row in touched:
+        order = np.lexsort((-neighbor_sims[row], neighbors[row] < 0))
+        neighbors[row] = neighbors[row][order]
+        neighbor_sims[row] = neighbor_sims[row][order]
+
+    write_neighbors(sorted(row for row in touched if alive[row]), keys,
+                    neighbors, neighbor_sims)
+    # clear the marks, unless the tierlist changed again in the meantime
+    cursor = app.conn.cursor()
+    cursor.executemany('DELETE FROM tierlist_similarity_dirty WHERE '
+                       'username = %s AND tierlist_name = %s AND '
+                       'marked_at = %s;', dirty)
+    app.conn.commit()
+    save_cache(args.cache, keys, owners, alive, X, neighbors, neighbor_sims,
+               max_rank)
+    app.print_success(f'Updated {len(dirty_rows)} changed tierlists and '
+                      f'{len(touched) - len(dirty_rows)} affected tierlists '
+                      f'in {time.perf_counter() - start:.1f}s.')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compute the most similar tierlists of each tierlist.')
+    parser.add_argument('--full', action='store_true',
+                        help='recompute every tierlist instead of only the '
+                        'changed ones')
+    parser.add_argument('-k', type=int, default=DEFAULT_K,
+                        help='similar tierlists kept per tierlist')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument('--cache', default=DEFAULT_CACHE)
+    args = parser.parse_args()
+    app.conn = app.get_conn(admin=True)
+    if args.full:
+        full_build(args)
+    else:
+        incremental_update(args)
+    app.conn.close()
+
+if __name__ == '__main__':
+    main()